@@ -0,0 +1,72 @@
+"""
+Measure lease+store round-trips per second against a local server, comparing the original wire format (one
+connection per request, JSON double-encoded in form fields) with the pooled session and the JSON API.
+
+Usage: python -m benchmarks.bench_client_roundtrip [numRoundTrips]
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+from resultslogger.client import ResultsLoggerClient
+from resultslogger.constants import ResultLoggerConstants
+from resultslogger.experimentqueue import CsvExperimentQueue
+from resultslogger.server import ResultsLoggerServer
+
+
+def start_server(num_experiments: int, autosave_path: str) -> str:
+    experiments_path = os.path.join(autosave_path, 'experiments.csv')
+    with open(experiments_path, 'w') as f:
+        f.write('learning_rate,num_layers\n')
+        for i in range(num_experiments):
+            f.write('%s,%s\n' % (0.001 * (i % 100), i % 10))
+    server = ResultsLoggerServer('bench', CsvExperimentQueue(experiments_path), autosave_path=autosave_path)
+    http_server = make_server('127.0.0.1', 0, server.wsgi_app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%s' % http_server.server_port
+
+
+def form_round_trip(server_url: str):
+    """The wire format used by the client before connection pooling and the JSON API."""
+    r = requests.post(server_url + ResultLoggerConstants.ROUTE_LEASE_EXPERIMENT,
+                      data={ResultLoggerConstants.FIELD_CLIENT: 'bench'})
+    data = r.json()
+    requests.post(server_url + ResultLoggerConstants.ROUTE_STORE_EXPERIMENT,
+                  data={ResultLoggerConstants.FIELD_CLIENT: 'bench',
+                        ResultLoggerConstants.FIELD_PARAMETERS: json.dumps(data['parameters']),
+                        ResultLoggerConstants.FIELD_RESULTS: json.dumps({'accuracy': 0.5}),
+                        ResultLoggerConstants.FIELD_EXPERIMENT_ID: data['experiment_id']})
+
+
+def time_round_trips(name: str, num_round_trips: int, round_trip):
+    start = time.perf_counter()
+    for _ in range(num_round_trips):
+        round_trip()
+    elapsed = time.perf_counter() - start
+    print('%-40s %8.1f round-trips/sec' % (name, num_round_trips / elapsed))
+
+
+if __name__ == "__main__":
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    num_round_trips = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as autosave_path:
+        server_url = start_server(3 * num_round_trips, autosave_path)
+        time_round_trips('form-encoded, new connection per request', num_round_trips,
+                         lambda: form_round_trip(server_url))
+
+        for use_json in (False, True):
+            client = ResultsLoggerClient(server_url, use_json=use_json)
+
+            def client_round_trip():
+                experiment_id, parameters = client.lease_next_experiment()
+                client.store_experiment_results(experiment_id, parameters, {'accuracy': 0.5})
+            time_round_trips('pooled session, %s' % ('JSON API' if use_json else 'form-encoded'), num_round_trips,
+                             client_round_trip)
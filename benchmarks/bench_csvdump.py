@@ -0,0 +1,72 @@
+"""
+Measure the time-to-first-byte, total time and peak RSS growth of downloading all results from /csvdump, for each
+export format and a growing number of results. Each measurement runs in a fresh process, so that peak RSS is not
+shared between measurements.
+
+Usage: python -m benchmarks.bench_csvdump [maxNumResults]
+"""
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from resultslogger.experimentlogger import ExperimentLogger
+from resultslogger.experimentqueue import ExperimentQueue
+from resultslogger.server import ResultsLoggerServer
+
+
+class _FixedParametersQueue(ExperimentQueue):
+    @property
+    def experiment_parameters(self):
+        return ['learning_rate', 'num_layers', 'optimizer']
+
+
+def _measure(num_results: int, query: str, output):
+    rng = np.random.RandomState(0)
+    logger = ExperimentLogger(['learning_rate', 'num_layers', 'optimizer'], [])
+    for i in range(num_results):
+        logger.log_experiment({'learning_rate': float(rng.rand()), 'num_layers': int(rng.randint(10)),
+                               'optimizer': 'adam' if i % 2 else 'sgd'},
+                              {'minimized-value': float(rng.rand()), 'accuracy': float(rng.rand())})
+    with tempfile.TemporaryDirectory() as autosave_path:
+        server = ResultsLoggerServer('bench', _FixedParametersQueue(), autosave_path=autosave_path,
+                                     experiment_logger=logger)
+        client = server.wsgi_app.test_client()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        start = time.perf_counter()
+        response = client.get('/csvdump' + query, buffered=False)
+        chunks = iter(response.response)
+        num_bytes = len(next(chunks))
+        time_to_first_byte = time.perf_counter() - start
+        for chunk in chunks:
+            num_bytes += len(chunk)
+        total_time = time.perf_counter() - start
+
+        rss_growth_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    output.put((time_to_first_byte, total_time, rss_growth_kb, num_bytes))
+
+
+def measure(num_results: int, query: str):
+    output = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(num_results, query, output))
+    process.start()
+    result = output.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    max_num_results = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    queries = ['', '?compression=gzip', '?format=parquet', '?format=arrow']
+    print('%10s %-20s %10s %10s %14s %12s' % ('results', 'query', 'TTFB (ms)', 'total (s)', 'RSS growth (MB)', 'size (MB)'))
+    num_results = 10000
+    while num_results <= max_num_results:
+        for query in queries:
+            ttfb, total, rss_growth_kb, num_bytes = measure(num_results, query)
+            print('%10d %-20s %10.1f %10.2f %14.1f %12.1f' % (num_results, query or '(csv)', 1e3 * ttfb, total,
+                                                           rss_growth_kb / 1024., num_bytes / 1e6))
+        num_results *= 10
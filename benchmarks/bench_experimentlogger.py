@@ -0,0 +1,32 @@
+"""
+Measure the cost of ExperimentLogger.log_experiment as the log grows. The per-append cost should stay flat.
+
+Usage: python -m benchmarks.bench_experimentlogger [numResults]
+"""
+import random
+import sys
+import time
+
+from resultslogger.experimentlogger import ExperimentLogger
+
+
+def run_benchmark(num_results: int, report_every: int):
+    logger = ExperimentLogger(['learning_rate', 'num_layers', 'optimizer'], [])
+    start = time.perf_counter()
+    for i in range(num_results):
+        logger.log_experiment({'learning_rate': random.random(), 'num_layers': random.randint(1, 10),
+                               'optimizer': random.choice(['sgd', 'adam'])},
+                              {'minimized-value': random.random(), 'accuracy': random.random()})
+        if (i + 1) % report_every == 0:
+            elapsed = time.perf_counter() - start
+            print('%9d results: %.2f us/append' % (i + 1, 1e6 * elapsed / report_every))
+            start = time.perf_counter()
+
+    start = time.perf_counter()
+    frame = logger.all_results
+    print('Building the results frame (%s rows): %.1f ms' % (len(frame), 1e3 * (time.perf_counter() - start)))
+
+
+if __name__ == "__main__":
+    num_results = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    run_benchmark(num_results, report_every=max(1, num_results // 10))
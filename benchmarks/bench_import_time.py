@@ -0,0 +1,61 @@
+"""
+Measure the time to import the client, the server and each queue backend in a fresh interpreter, and check that the
+imports do not pull in heavy dependencies that they do not need: the client must not import pandas or Flask, and the
+server must not import the optimization libraries of the bayesianOpt backend. Exits with status 1 if they do.
+
+Usage: python -m benchmarks.bench_import_time [numRepeats]
+"""
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ('numpy', 'pandas', 'flask', 'scipy', 'sklearn', 'skopt')
+
+# module -> the heavy modules that importing it must not load
+FORBIDDEN_IMPORTS = {
+    'resultslogger.client': ('pandas', 'flask'),
+    'resultslogger.server': ('scipy', 'sklearn', 'skopt'),
+    'resultslogger.backends': ('numpy', 'pandas', 'flask'),
+    'resultslogger.experimentqueue': ('scipy', 'sklearn', 'skopt'),
+    'resultslogger.lazyqueue': ('scipy', 'sklearn', 'skopt'),
+    'resultslogger.sqlitestore': ('scipy', 'sklearn', 'skopt'),
+    'resultslogger.bayesoptqueue': (),
+}
+
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [m for m in %r if m in sys.modules]]))
+"""
+
+
+def measure(module: str):
+    """
+    :return: the import time of module in a fresh interpreter and the heavy modules that it loaded.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    output = subprocess.run([sys.executable, '-c', _MEASURE % (module, HEAVY_MODULES)], check=True,
+                            stdout=subprocess.PIPE, env=environment).stdout
+    elapsed, loaded = json.loads(output.decode().strip().splitlines()[-1])
+    return elapsed, loaded
+
+
+if __name__ == "__main__":
+    num_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    violations = []
+    print('%-32s %12s  %s' % ('module', 'import (ms)', 'heavy modules loaded'))
+    for module, forbidden in FORBIDDEN_IMPORTS.items():
+        timings, loaded = [], []
+        for _ in range(num_repeats):
+            elapsed, loaded = measure(module)
+            timings.append(elapsed)
+        print('%-32s %12.1f  %s' % (module, 1e3 * sorted(timings)[len(timings) // 2], ', '.join(loaded)))
+        violations.extend('%s imports %s' % (module, m) for m in loaded if m in forbidden)
+
+    for violation in violations:
+        print('ERROR: ' + violation)
+    sys.exit(1 if len(violations) > 0 else 0)
@@ -0,0 +1,258 @@
+"""
+Load-test a local ResultsLoggerServer with simulated clients. For each queue type and queue size, a fresh process
+generates the experiments (a csv or parameter grid, or a BO dimensions file), starts the server on a local port and
+runs a number of concurrent ResultsLoggerClient workers with a synthetic result computer. Each configuration is
+reported as one line of JSON with the lease and store latency percentiles, the throughput, the RSS of the process
+(the server and its simulated clients) and the cost of an autosave.
+
+Usage: python -m benchmarks.bench_load [--queues csv grid] [--rows 1000 1000000] [--clients 1 8] [--experiments 2000]
+                                       [--work-ms 0] [--output results.jsonl]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from werkzeug.serving import make_server
+
+from resultslogger.client import ResultsLoggerClient
+
+QUEUE_TYPES = ('csv', 'grid', 'lazycsv', 'sqlite', 'bayesianOpt')
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+def grid_sizes(num_rows: int) -> List[int]:
+    """
+    :return: the number of values of the three parameters of a generated grid with (about) num_rows experiments.
+    """
+    return [max(1, num_rows // 100), 10, 10] if num_rows >= 100 else [num_rows, 1, 1]
+
+
+def generate_grid(num_rows: int) -> Dict[str, List[Any]]:
+    learning_rates, layers, optimizers = grid_sizes(num_rows)
+    return {'learning_rate': [round(1e-4 * (i + 1), 6) for i in range(learning_rates)],
+            'num_layers': list(range(1, layers + 1)),
+            'optimizer': ['opt%s' % i for i in range(optimizers)]}
+
+
+def write_grid_csv(grid: Dict[str, List[Any]], path: str) -> int:
+    names = list(grid)
+    num_rows = int(np.prod([len(grid[name]) for name in names]))
+    with open(path, 'w') as f:
+        f.write(','.join(names) + '\n')
+        for row in range(num_rows):
+            values, index = [], row
+            for name in reversed(names):
+                index, position = divmod(index, len(grid[name]))
+                values.append(str(grid[name][position]))
+            f.write(','.join(reversed(values)) + '\n')
+    return num_rows
+
+
+def generate_dimensions(num_dimensions: int) -> List[Dict[str, Any]]:
+    """
+    :return: a BO dimensions file with num_dimensions dimensions, cycling through real, integer and categorical ones.
+    """
+    dimensions = []
+    for i in range(num_dimensions):
+        if i % 3 == 0:
+            dimensions.append({'name': 'x%s' % i, 'type': 'Real', 'low': -2., 'high': 2.})
+        elif i % 3 == 1:
+            dimensions.append({'name': 'n%s' % i, 'type': 'Integer', 'low': 1, 'high': 10})
+        else:
+            dimensions.append({'name': 'c%s' % i, 'type': 'Categorical', 'categories': ['a', 'b', 'c']})
+    return dimensions
+
+
+def synthetic_result(parameters: Dict[str, Any], work_secs: float) -> Tuple[float, Dict[str, Any]]:
+    """
+    A result computer that sleeps for an exponentially distributed time with mean work_secs and returns a smooth
+    function of the parameters.
+    """
+    if work_secs > 0:
+        time.sleep(random.expovariate(1. / work_secs))
+    value = sum(float(v) ** 2 if isinstance(v, (int, float)) else float(hash(v) % 7) for v in parameters.values())
+    return value, {'loss': value, 'accuracy': 1. / (1. + value)}
+
+
+def build_queue(queue_type: str, num_rows: int, num_dimensions: int, work_path: str):
+    """
+    :return: the queue, the experiment logger (or None for the default) and the number of experiments in the queue.
+    """
+    if queue_type == 'bayesianOpt':
+        from resultslogger.bayesoptqueue import BayesianOptimizedExperimentQueue
+        dimensions_path = os.path.join(work_path, 'dimensions.json')
+        with open(dimensions_path, 'w') as f:
+            json.dump(generate_dimensions(num_dimensions), f)
+        return BayesianOptimizedExperimentQueue(dimensions_path), None, None
+
+    grid = generate_grid(num_rows)
+    if queue_type == 'grid':
+        from resultslogger.lazyqueue import LazyExperimentQueue, ParameterGridSource
+        return LazyExperimentQueue(ParameterGridSource(grid)), None, int(np.prod([len(v) for v in grid.values()]))
+
+    experiments_path = os.path.join(work_path, 'experiments.csv')
+    num_experiments = write_grid_csv(grid, experiments_path)
+    if queue_type == 'csv':
+        from resultslogger.experimentqueue import CsvExperimentQueue
+        return CsvExperimentQueue(experiments_path), None, num_experiments
+    elif queue_type == 'lazycsv':
+        from resultslogger.lazyqueue import ChunkedCsvSource, LazyExperimentQueue
+        return LazyExperimentQueue(ChunkedCsvSource(experiments_path)), None, num_experiments
+    elif queue_type == 'sqlite':
+        from resultslogger.sqlitestore import SqliteExperimentLogger, SqliteExperimentQueue
+        db_path = os.path.join(work_path, 'bench.sqlite')
+        queue = SqliteExperimentQueue(db_path, experiments_path)
+        return queue, SqliteExperimentLogger(db_path, queue.experiment_parameters, []), num_experiments
+    else:
+        raise Exception('Unrecognized queue type %s' % queue_type)
+
+
+def current_peak_rss_bytes() -> int:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):  # Not Linux: fall back to the peak RSS
+        return current_peak_rss_bytes()
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    if len(latencies) == 0:
+        return {'count': 0}
+    latencies_ms = 1e3 * np.array(latencies)
+    summary = {'count': len(latencies), 'mean_ms': float(latencies_ms.mean()), 'max_ms': float(latencies_ms.max())}
+    for percentile in LATENCY_PERCENTILES:
+        summary['p%s_ms' % percentile] = float(np.percentile(latencies_ms, percentile))
+    return summary
+
+
+def run_workers(server_url: str, num_clients: int, max_experiments: int, work_secs: float):
+    """
+    Run num_clients workers until max_experiments experiments are stored or the queue runs out.
+    :return: the lease latencies, the store latencies and the number of stored experiments
+    """
+    lease_latencies, store_latencies = [], []
+    num_claimed = [0]
+    claim_lock = threading.Lock()
+
+    def worker():
+        client = ResultsLoggerClient(server_url)
+        while True:
+            with claim_lock:
+                if num_claimed[0] >= max_experiments:
+                    return
+                num_claimed[0] += 1
+            start = time.perf_counter()
+            leased = client.lease_next_experiment()
+            lease_latencies.append(time.perf_counter() - start)
+            if leased is None:
+                return
+            experiment_id, parameters = leased
+            minimized_result, results = synthetic_result(parameters, work_secs)
+            start = time.perf_counter()
+            client.store_experiment_results(experiment_id, parameters, results, minimized_result)
+            store_latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker) for _ in range(num_clients)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return lease_latencies, store_latencies, len(store_latencies)
+
+
+def _measure(config: Dict[str, Any], output):
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    from resultslogger.server import ResultsLoggerServer
+
+    rss_at_start = current_rss_bytes()
+    with tempfile.TemporaryDirectory() as work_path:
+        start = time.perf_counter()
+        queue, experiment_logger, num_experiments = build_queue(config['queue'], config['rows'],
+                                                                config['dimensions'], work_path)
+        server = ResultsLoggerServer('bench', queue, autosave_path=work_path, experiment_logger=experiment_logger,
+                                     snapshot_every=config['snapshot_every'])
+        setup_secs = time.perf_counter() - start
+        rss_after_setup = current_rss_bytes()
+
+        http_server = make_server('127.0.0.1', 0, server.wsgi_app, threaded=True)
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        server_url = 'http://127.0.0.1:%s' % http_server.server_port
+
+        start = time.perf_counter()
+        lease_latencies, store_latencies, num_stored = run_workers(server_url, config['clients'],
+                                                                   config['experiments'], config['work_ms'] / 1e3)
+        elapsed = time.perf_counter() - start
+        rss_after_run = current_rss_bytes()
+
+        autosave_secs = []
+        for _ in range(config['autosave_repeats']):
+            start = time.perf_counter()
+            server.autosave()
+            autosave_secs.append(time.perf_counter() - start)
+        snapshot_bytes = os.path.getsize(os.path.join(work_path, 'bench.pkl'))
+        http_server.shutdown()
+
+    output.put(dict(config, num_experiments=num_experiments, setup_secs=setup_secs, num_stored=num_stored,
+                    elapsed_secs=elapsed, throughput_per_sec=num_stored / elapsed if elapsed > 0 else None,
+                    lease_latency=latency_summary(lease_latencies), store_latency=latency_summary(store_latencies),
+                    rss_bytes={'start': rss_at_start, 'after_setup': rss_after_setup, 'after_run': rss_after_run,
+                               'peak': current_peak_rss_bytes()},
+                    autosave={'mean_secs': float(np.mean(autosave_secs)), 'max_secs': float(np.max(autosave_secs)),
+                              'snapshot_bytes': snapshot_bytes}))
+
+
+def measure(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run one configuration in a fresh process, so that RSS is not shared between configurations.
+    """
+    output = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(config, output))
+    process.start()
+    result = output.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load-test a local results logger server with simulated clients.')
+    parser.add_argument('--queues', nargs='+', choices=QUEUE_TYPES, default=['csv', 'grid'])
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000, 100000, 1000000],
+                        help='the sizes of the generated grids (ignored by bayesianOpt)')
+    parser.add_argument('--dimensions', type=int, default=6, help='the number of dimensions of generated BO spaces')
+    parser.add_argument('--clients', nargs='+', type=int, default=[1, 8], help='the numbers of concurrent workers')
+    parser.add_argument('--experiments', type=int, default=2000,
+                        help='the maximum number of experiments to lease per configuration')
+    parser.add_argument('--work-ms', type=float, default=0., help='the mean time that each experiment takes')
+    parser.add_argument('--snapshot-every', type=int, default=1000)
+    parser.add_argument('--autosave-repeats', type=int, default=3)
+    parser.add_argument('--output', help='append the JSON lines to this file instead of stdout')
+    args = parser.parse_args()
+
+    output_file = open(args.output, 'a') if args.output is not None else sys.stdout
+    try:
+        for queue_type in args.queues:
+            for num_rows in (args.rows if queue_type != 'bayesianOpt' else [None]):
+                for num_clients in args.clients:
+                    result = measure({'queue': queue_type, 'rows': num_rows, 'dimensions': args.dimensions,
+                                      'clients': num_clients, 'experiments': args.experiments,
+                                      'work_ms': args.work_ms, 'snapshot_every': args.snapshot_every,
+                                      'autosave_repeats': args.autosave_repeats})
+                    print(json.dumps(result), file=output_file, flush=True)
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
@@ -0,0 +1,98 @@
+"""
+Measure the fit and ask time of each surrogate of BayesianOptimizedExperimentQueue as the number of observations grows.
+For each number of observations n, a queue is given n random results without fitting, and then the benchmark times:
+  - fit: complete() of a point, which refits the surrogate on n+1 results (for 'gp-periodic' the first fit
+    optimizes the hyperparameters, which is reported separately, and the next ones reuse them),
+  - ask: lease_new() when no other point is leased, which returns the point suggested by the last fit,
+  - ask (leased): lease_new() while another point is leased, which fits a model to pick an alternative point.
+A surrogate is not measured for larger n once its first fit takes more than maxFitSecs.
+
+Usage: python -m benchmarks.bench_surrogate [maxNumObservations] [maxFitSecs]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from resultslogger.bayesoptqueue import BayesianOptimizedExperimentQueue
+
+DIMENSIONS = [{'name': 'x0', 'type': 'Real', 'low': -2., 'high': 2.},
+              {'name': 'x1', 'type': 'Real', 'low': -2., 'high': 2.},
+              {'name': 'x2', 'type': 'Real', 'low': 0., 'high': 1.},
+              {'name': 'num_layers', 'type': 'Integer', 'low': 1, 'high': 10},
+              {'name': 'optimizer', 'type': 'Categorical', 'categories': ['sgd', 'adam', 'rmsprop']}]
+NUM_TIMED_STEPS = 3
+
+
+def random_parameters() -> dict:
+    parameters = {}
+    for dimension in DIMENSIONS:
+        if dimension['type'] == 'Real':
+            parameters[dimension['name']] = random.uniform(dimension['low'], dimension['high'])
+        elif dimension['type'] == 'Integer':
+            parameters[dimension['name']] = random.randint(dimension['low'], dimension['high'])
+        else:
+            parameters[dimension['name']] = random.choice(dimension['categories'])
+    return parameters
+
+
+def objective(parameters: dict) -> float:
+    return (parameters['x0'] - .5) ** 2 + (parameters['x1'] + .3) ** 2 + parameters['x2'] + \
+           .01 * parameters['num_layers'] + (.1 if parameters['optimizer'] == 'sgd' else 0.) + random.gauss(0, .01)
+
+
+def measure(dimensions_path: str, surrogate: str, num_observations: int):
+    """
+    :return: the time of the first fit, the mean time of the next fits, of ask and of ask while a point is leased
+    """
+    queue = BayesianOptimizedExperimentQueue(dimensions_path, min_num_results_to_fit=num_observations,
+                                             surrogate=surrogate)
+    for _ in range(num_observations):
+        parameters = random_parameters()
+        queue.complete(-1, parameters, 'bench', objective(parameters))
+
+    fit_secs, ask_secs, leased_ask_secs = [], [], []
+    parameters = random_parameters()
+    for _ in range(NUM_TIMED_STEPS):
+        start = time.perf_counter()
+        queue.complete(-1, parameters, 'bench', objective(parameters))
+        fit_secs.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        parameters, _ = queue.lease_new('bench')
+        ask_secs.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        other_parameters, _ = queue.lease_new('bench')
+        leased_ask_secs.append(time.perf_counter() - start)
+        queue.complete(-1, other_parameters, 'bench', objective(other_parameters))
+    mean = lambda values: sum(values) / len(values)
+    return fit_secs[0], mean(fit_secs[1:]), mean(ask_secs), mean(leased_ask_secs)
+
+
+if __name__ == "__main__":
+    import contextlib
+    import io
+
+    max_num_observations = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    max_fit_secs = float(sys.argv[2]) if len(sys.argv) > 2 else 60.
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as work_path:
+        dimensions_path = os.path.join(work_path, 'dimensions.json')
+        with open(dimensions_path, 'w') as f:
+            json.dump(DIMENSIONS, f)
+
+        print('%-12s %8s %14s %14s %10s %16s' % ('surrogate', 'n', 'first fit (s)', 'next fits (s)', 'ask (s)',
+                                                 'ask, leased (s)'))
+        for surrogate in BayesianOptimizedExperimentQueue.SURROGATES:
+            num_observations = 100
+            while num_observations <= max_num_observations:
+                with contextlib.redirect_stdout(io.StringIO()):  # The queue logs the discounted acquisition values
+                    first_fit, next_fits, ask, leased_ask = measure(dimensions_path, surrogate, num_observations)
+                print('%-12s %8d %14.3f %14.3f %10.3f %16.3f' % (surrogate, num_observations, first_fit, next_fits,
+                                                                 ask, leased_ask), flush=True)
+                if first_fit > max_fit_secs:
+                    break
+                num_observations *= 2
@@ -0,0 +1,107 @@
+"""
+The registry of queue backends that the server can be started with. Each backend is a factory that accepts the name of
+the experiment and the path given on the command line and returns a (queue, experiment logger) tuple, where the logger
+may be None for the default in-memory one. Backends import their modules only when they are created, so that starting
+a server with one backend never pays for the imports of the others (e.g. skopt for bayesianOpt).
+
+Other packages can add backends through the 'resultslogger.queues' entry point group, e.g. in their setup.py:
+    entry_points={'resultslogger.queues': ['myqueue = mypackage.queues:create_my_queue']}
+A backend can also be selected directly by its 'module:factory' name.
+"""
+import importlib
+from typing import Callable, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from resultslogger.experimentlogger import ExperimentLogger
+    from resultslogger.experimentqueue import ExperimentQueue
+
+ENTRY_POINT_GROUP = 'resultslogger.queues'
+
+
+def _csv_backend(experiment_name: str, path: str):
+    from resultslogger.experimentqueue import CsvExperimentQueue
+    return CsvExperimentQueue(path), None
+
+
+def _bayesian_optimization_backend(experiment_name: str, path: str):
+    from resultslogger.bayesoptqueue import BayesianOptimizedExperimentQueue
+    return BayesianOptimizedExperimentQueue(path), None
+
+
+def _grid_backend(experiment_name: str, path: str):
+    from resultslogger.lazyqueue import LazyExperimentQueue, ParameterGridSource
+    return LazyExperimentQueue(ParameterGridSource.from_json(path)), None
+
+
+def _lazy_csv_backend(experiment_name: str, path: str):
+    from resultslogger.lazyqueue import LazyExperimentQueue, ChunkedCsvSource
+    return LazyExperimentQueue(ChunkedCsvSource(path)), None
+
+
+def _sqlite_backend(experiment_name: str, path: str):
+    from resultslogger.sqlitestore import SqliteExperimentQueue, SqliteExperimentLogger
+    queue = SqliteExperimentQueue(experiment_name + ".sqlite", path)
+    return queue, SqliteExperimentLogger(experiment_name + ".sqlite", queue.experiment_parameters, [])
+
+
+# name -> (factory or 'module:factory', description of the path argument)
+_BACKENDS = {
+    'csv': (_csv_backend, '<listOfExperiments.csv>'),
+    'bayesianOpt': (_bayesian_optimization_backend, '<inputSpaceParameters.json>'),
+    'grid': (_grid_backend, '<parameterGrid.json>'),
+    'lazycsv': (_lazy_csv_backend, '<listOfExperiments.csv>'),
+    'sqlite': (_sqlite_backend, '<listOfExperiments.csv>'),
+}  # type: Dict[str, Tuple[Union[Callable, str], str]]
+
+
+def register_backend(name: str, factory: Union[Callable, str], argument_description: str='<path>') -> None:
+    """
+    Register a queue backend.
+    :param factory: a callable (experiment_name, path) -> (queue, experiment logger or None), or the 'module:attribute'
+    name of one, so that its module is only imported when the backend is created.
+    """
+    _BACKENDS[name] = (factory, argument_description)
+
+
+def _entry_points() -> Dict:
+    from importlib.metadata import entry_points
+    return {entry_point.name: entry_point for entry_point in entry_points(group=ENTRY_POINT_GROUP)}
+
+
+def _load_by_name(module_and_attribute: str) -> Callable:
+    module_name, _, attribute = module_and_attribute.partition(':')
+    factory = importlib.import_module(module_name)
+    for name in attribute.split('.'):
+        factory = getattr(factory, name)
+    return factory
+
+
+def available_backends() -> List[Tuple[str, str]]:
+    """
+    :return: the (name, description of the path argument) of the registered and installed backends.
+    """
+    backends = [(name, argument_description) for name, (_, argument_description) in _BACKENDS.items()]
+    return backends + [(name, '<path>') for name in _entry_points() if name not in _BACKENDS]
+
+
+def get_backend(name: str) -> Callable:
+    """
+    :param name: the name of a registered backend, of an installed entry point or a 'module:factory' name.
+    :return: the backend factory, importing its module if needed.
+    """
+    if name in _BACKENDS:
+        factory = _BACKENDS[name][0]
+        return _load_by_name(factory) if isinstance(factory, str) else factory
+    entry_points = _entry_points()
+    if name in entry_points:
+        return entry_points[name].load()
+    if ':' in name:
+        return _load_by_name(name)
+    raise Exception('Unrecognized queue type %s' % name)
+
+
+def create_backend(name: str, experiment_name: str, path: str) -> Tuple['ExperimentQueue', Optional['ExperimentLogger']]:
+    """
+    :return: the (queue, experiment logger or None) of the backend.
+    """
+    return get_backend(name)(experiment_name, path)
@@ -1,16 +1,19 @@
-from collections import OrderedDict
-from typing import List, Tuple, Dict, Any
+from collections import OrderedDict, deque
+from typing import List, Tuple, Dict, Any, Optional
 
 import pandas as pd
-from functools import reduce
 from typing import List
 import warnings
 import json
+import logging
+import threading
+import time
+import traceback
 
 import numpy as np
 from skopt import Optimizer
-from skopt.acquisition import gaussian_ei, _gaussian_acquisition
-from skopt.learning import GaussianProcessRegressor
+from skopt.acquisition import _gaussian_acquisition
+from skopt.learning import GaussianProcessRegressor, ExtraTreesRegressor, RandomForestRegressor
 
 from skopt.learning.gaussian_process.kernels import ConstantKernel
 from skopt.learning.gaussian_process.kernels import HammingKernel
@@ -19,21 +22,83 @@ from skopt.space import check_dimension
 from skopt.space import Categorical, Real, Integer
 from skopt.space import Space
 from sklearn.base import clone
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
 
 from resultslogger.experimentqueue import ExperimentQueue
+from resultslogger.leaseindex import AdaptiveLeaseTimeout
+from resultslogger.pruning import Pruner
+
+LOGGER = logging.getLogger(__name__)
 
 
 class BayesianOptimizedExperimentQueue(ExperimentQueue):
-    def __init__(self, dimensions_file: str, min_num_results_to_fit: int=8, lease_timout='2 days'):
+    # The initial width of the discount around leased points, in the transformed space.
+    MAX_DISCOUNT_WIDTH = .5
+    # Use a KD-tree to find the candidates close to leased points when more than this many points are leased.
+    KDTREE_MIN_LEASED = 256
+
+    BATCH_STRATEGIES = ('cl_min', 'cl_mean', 'cl_max', 'penalize')
+    SURROGATES = ('gp', 'gp-periodic', 'et', 'rf')
+    # The default number of results between two optimizations of the kernel hyperparameters for 'gp-periodic'.
+    DEFAULT_REOPTIMIZE_EVERY = 50
+
+    def __init__(self, dimensions_file: str, min_num_results_to_fit: int=8, lease_timout='2 days',
+                 async_refit: bool=False, batch_size: int=1, batch_strategy: str='penalize',
+                 heartbeat_timeout='5 minutes', surrogate: Optional[str]=None,
+                 reoptimize_every: Optional[int]=None, pruner: Optional[Pruner]=None):
+        """
+        :param dimensions_file: a json file with the list of dimensions of the optimized space, or an object with the
+        list of "dimensions" and optionally the "surrogate" and "reoptimize_every" options.
+        :param min_num_results_to_fit: the number of results before starting to fit the surrogate model
+        :param lease_timout: the maximum time that a leased point is discounted in suggestions. Once the durations of
+        enough experiments are known, leases time out after a multiple of the (95th percentile) duration, if shorter.
+        :param heartbeat_timeout: the time that a lease lasts after the last heartbeat of its client.
+        :param async_refit: refit the surrogate model in a background thread. Completed results are queued and leases
+        are served from the latest fitted model and a buffer of candidate points precomputed after each refit, so that
+        neither complete() nor lease_new() waits for a model fit.
+        :param batch_size: when larger than 1, suggest this many points at once and keep them in a ready pool, so that
+        most leases just pop a pre-suggested point. The pool is kept across refits and refilled when it runs out or once
+        batch_size results were added since it was suggested (or after each refit, when async_refit is set).
+        :param batch_strategy: how a batch is suggested. 'cl_min', 'cl_mean' and 'cl_max' are constant liar strategies
+        that refit the model after each picked point, assuming that it returned the min/mean/max of the results so far.
+        'penalize' evaluates the acquisition function once over the candidate points and greedily picks
+        points, discounting the acquisition values around the leased and the already picked points.
+        :param surrogate: the model of the objective. 'gp' is an exact Gaussian process whose kernel hyperparameters
+        are optimized at each fit, which costs O(n^3) per fit with several restarts and becomes slow after a few
+        thousand results. 'gp-periodic' optimizes the hyperparameters only every reoptimize_every results and otherwise
+        refits with the last hyperparameters, which needs a single Cholesky decomposition, and optimizes the acquisition
+        function by sampling. 'et' and 'rf' are extra
+        trees and random forest ensembles, which fit in O(n log n) and are optimized by sampling. Defaults to the surrogate of the dimensions file, or 'gp'.
+        :param reoptimize_every: the number of results between two optimizations of the hyperparameters for
+        'gp-periodic'. Defaults to the value of the dimensions file, or DEFAULT_REOPTIMIZE_EVERY.
+        :param pruner: stops running experiments early from their reported intermediate results (e.g. a
+        SuccessiveHalvingPruner), comparing all the suggested points. Defaults to never stopping them.
+        """
+        if batch_strategy not in self.BATCH_STRATEGIES:
+            raise Exception('Unrecognized batch strategy %s' % batch_strategy)
         self.__all_experiments = pd.DataFrame()
         self.__all_experiments['status'] = [self.WAITING] * len(self.__all_experiments)
         self.__all_experiments['last_update'] = pd.Series(pd.Timestamp(float('NaN')))
         self.__all_experiments['client'] = [""] * len(self.__all_experiments)
 
+        self.__pruner = pruner
         self.__lease_duration = pd.to_timedelta(lease_timout)
+        self.__lease_timeout = AdaptiveLeaseTimeout(self.__lease_duration.total_seconds(),
+                                                    pd.to_timedelta(heartbeat_timeout).total_seconds())
+        # The leased points and, aligned with them, the [client, lease start, lease expiry] of each lease.
         self.__leased_experiments = []
-
-        dims = self.__load_dimensions(dimensions_file)
+        self.__lease_details = []
+
+        dims, options = self.__load_dimensions(dimensions_file)
+        self.__surrogate = surrogate if surrogate is not None else options.get('surrogate', 'gp')
+        if self.__surrogate not in self.SURROGATES:
+            raise Exception('Unrecognized surrogate %s' % self.__surrogate)
+        self.__reoptimize_every = reoptimize_every if reoptimize_every is not None else \
+            options.get('reoptimize_every', self.DEFAULT_REOPTIMIZE_EVERY)
+        # For 'gp-periodic': the fitted (kernel, noise level) and the number of results when they were optimized
+        self.__fitted_kernel = None  # type: Optional[Tuple[Any, Optional[float]]]
+        self.__num_results_at_reoptimization = 0
         self.__dimension_names = list(dims.keys())
         self.__dimensions = list(dims.values())
         self.__min_num_results_to_fit = min_num_results_to_fit
@@ -66,13 +131,147 @@ class BayesianOptimizedExperimentQueue(ExperimentQueue):
                 length_scale_bounds=[(0.01, 100)] * space.transformed_n_dims,
                 nu=2.5)
 
-        base_estimator = GaussianProcessRegressor(
-            kernel=cov_amplitude * other_kernel,
-            normalize_y=True, random_state=None, alpha=0.0, noise='gaussian',
-            n_restarts_optimizer=2)
-
-        self.__opt = Optimizer(self.__dimensions, base_estimator, acq_optimizer="lbfgs",
-                               n_random_starts=100, acq_optimizer_kwargs=dict(n_points=10000))
+        if self.__surrogate == 'et':
+            base_estimator = ExtraTreesRegressor(n_estimators=100, min_samples_leaf=3)
+        elif self.__surrogate == 'rf':
+            base_estimator = RandomForestRegressor(n_estimators=100, min_samples_leaf=3)
+        else:
+            base_estimator = GaussianProcessRegressor(
+                kernel=cov_amplitude * other_kernel,
+                normalize_y=True, random_state=None, alpha=0.0, noise='gaussian',
+                n_restarts_optimizer=2)
+
+        self.__base_estimator = base_estimator
+        self.__opt = self.__make_optimizer()
+
+        self.__async_refit = async_refit
+        self.__batch_size = batch_size
+        self.__batch_strategy = batch_strategy
+        self.__ready_pool = deque()
+        # The number of results of the model that suggested the ready pool, or None if its points are random
+        self.__ready_pool_num_results = None  # type: Optional[int]
+        self.__pending_results = []  # type: List[Tuple[List, float]]
+        self.__candidates = None  # type: Optional[Tuple[np.ndarray, np.ndarray]]
+        self.__num_refits = 0
+        self.__last_refit_secs = 0.
+        self.__last_model_update = time.time()
+        self.__start_refit_worker()
+
+    def __make_optimizer(self) -> Optimizer:
+        if self.__surrogate == 'gp':
+            return Optimizer(self.__dimensions, clone(self.__base_estimator), acq_optimizer="lbfgs",
+                             n_initial_points=100, acq_optimizer_kwargs=dict(n_points=10000))
+        # Tree ensembles have no gradients, so the acquisition function is optimized over random samples. So is it for
+        # 'gp-periodic', since a multi-start lbfgs over the acquisition function costs as much as a fit. EI (as in the
+        # candidates of the queue) needs a single prediction per sample, instead of three for the default gp_hedge.
+        return Optimizer(self.__dimensions, clone(self.__base_estimator), acq_func="EI", acq_optimizer="sampling",
+                         n_initial_points=100, acq_optimizer_kwargs=dict(n_points=10000))
+
+    def __prepare_fit(self, opt: Optimizer, num_results: int) -> bool:
+        """
+        For 'gp-periodic', configure the estimator of opt before fitting it on num_results results: optimize the kernel
+        hyperparameters if reoptimize_every results were added since they were last optimized, otherwise fix them.
+        :return: True if the hyperparameters will be optimized
+        """
+        if self.__surrogate != 'gp-periodic':
+            return False
+        if self.__fitted_kernel is None or num_results - self.__num_results_at_reoptimization >= self.__reoptimize_every:
+            opt.base_estimator_.set_params(**self.__base_estimator.get_params(deep=False))
+            return True
+        kernel, noise = self.__fitted_kernel
+        opt.base_estimator_.set_params(kernel=kernel, noise=noise, optimizer=None, n_restarts_optimizer=0)
+        return False
+
+    def __record_fit(self, opt: Optimizer, reoptimized: bool) -> None:
+        """
+        Keep the hyperparameters of the model that was just fitted with reoptimized hyperparameters.
+        """
+        if not reoptimized or len(opt.models) == 0:
+            return
+        model = opt.models[-1]
+        if model.noise_ is not None:
+            # The fitted kernel is (amplitude * kernel) + white noise, whose noise level was zeroed for predictions.
+            self.__fitted_kernel = model.kernel_.k1, model.noise_
+        else:
+            self.__fitted_kernel = model.kernel_, None
+        self.__num_results_at_reoptimization = len(opt.yi)
+
+    # Synchronization primitives and threads cannot be pickled, they are recreated when unpickling.
+    __TRANSIENT_FIELDS = ('_BayesianOptimizedExperimentQueue__model_lock',
+                          '_BayesianOptimizedExperimentQueue__refit_requested',
+                          '_BayesianOptimizedExperimentQueue__refit_thread')
+
+    def __start_refit_worker(self) -> None:
+        self.__model_lock = threading.RLock()
+        self.__refit_requested = threading.Event()
+        self.__refit_thread = None
+        if self.__async_refit:
+            self.__refit_thread = threading.Thread(target=self.__refit_loop, name='bayesopt-refit', daemon=True)
+            self.__refit_thread.start()
+            if len(self.__pending_results) > 0:
+                self.__refit_requested.set()
+
+    def __getstate__(self):
+        with self.__model_lock:
+            state = self.__dict__.copy()
+            state['_BayesianOptimizedExperimentQueue__pending_results'] = list(self.__pending_results)
+        for field in self.__TRANSIENT_FIELDS:
+            del state[field]
+        return state
+
+    def __setstate__(self, state):
+        if '_BayesianOptimizedExperimentQueue__lease_details' not in state:
+            raise Exception('Snapshots of a BayesianOptimizedExperimentQueue from before leases expired cannot be loaded')
+        self.__dict__.update(state)
+        self.__start_refit_worker()
+
+    def __refit_loop(self) -> None:
+        while True:
+            self.__refit_requested.wait()
+            self.__refit_requested.clear()
+            with self.__model_lock:
+                pending = self.__pending_results
+                self.__pending_results = []
+                Xi = list(self.__opt.Xi) + [parameters for parameters, _ in pending]
+                yi = list(self.__opt.yi) + [result for _, result in pending]
+            if len(pending) == 0:
+                continue
+
+            try:
+                start = time.perf_counter()
+                opt = self.__make_optimizer()
+                do_fit_model = len(yi) > self.__min_num_results_to_fit
+                reoptimized = False
+                if do_fit_model:
+                    opt._n_initial_points = 0  # Same hack as in complete()
+                    with self.__model_lock:
+                        reoptimized = self.__prepare_fit(opt, len(yi))
+                opt.tell(Xi, yi, fit=do_fit_model)
+                with self.__model_lock:
+                    self.__record_fit(opt, reoptimized)
+                candidates = None
+                if do_fit_model and len(opt.models) > 0:
+                    candidates = self.__compute_candidates(opt, opt.models[-1])
+                ready_pool = deque()
+                if self.__batch_size > 1:
+                    with self.__model_lock:
+                        self.__expire_leases()
+                        leased = list(self.__leased_experiments)
+                    ready_pool = deque(self.__suggest_batch(opt, candidates, leased))
+                refit_secs = time.perf_counter() - start
+            except Exception:
+                traceback.print_exc()
+                with self.__model_lock:
+                    self.__pending_results = pending + self.__pending_results
+                continue
+
+            with self.__model_lock:
+                self.__opt = opt
+                self.__candidates = candidates
+                self.__ready_pool = ready_pool
+                self.__num_refits += 1
+                self.__last_refit_secs = refit_secs
+                self.__last_model_update = time.time()
 
     @property
     def all_experiments(self) -> pd.DataFrame:
@@ -89,20 +288,60 @@ class BayesianOptimizedExperimentQueue(ExperimentQueue):
     def leased_percent(self) -> float:
         return 0
 
+    @property
+    def status_counts(self) -> Dict[str, int]:
+        with self.__model_lock:
+            return {self.LEASED: len(self.__leased_experiments),
+                    self.DONE: len(self.__opt.yi) + len(self.__pending_results)}
+
     @property
     def experiment_parameters(self) -> List:
         return self.__dimension_names
 
+    @property
+    def model_metrics(self) -> Dict[str, float]:
+        """
+        :return: metrics about the surrogate model: the number of completed results that are not yet in the model, the
+        seconds since the model was last updated, the duration of the last refit in seconds, the number of refits and
+        the number of pre-suggested points in the ready pool.
+        """
+        with self.__model_lock:
+            return {'pending_results': len(self.__pending_results),
+                    'ready_pool_size': len(self.__ready_pool),
+                    'model_age_secs': time.time() - self.__last_model_update,
+                    'last_refit_secs': self.__last_refit_secs,
+                    'num_refits': self.__num_refits}
+
+    @property
+    def max_cache_hits_per_lease(self) -> Optional[int]:
+        # Without async_refit, each completion refits the model
+        return None if self.__async_refit else 1
+
     def lease_new(self, client_name: str) -> Tuple[int, Dict]:
         """
         Lease a new experiment lock. Select first any waiting experiments and then re-lease expired ones
         :param client_name: The name of the leasing client
         :return: a tuple (id, parameters) or None if nothing is available
         """
-        experiment_params = self.__opt.ask()
-        if experiment_params in self.__leased_experiments:
-            experiment_params = self.__compute_alternative_params()
-        self.__leased_experiments.append(experiment_params)
+        with self.__model_lock:
+            self.__expire_leases()
+            experiment_params = self.__pop_ready_point()
+            if experiment_params is None and self.__batch_size > 1 and not self.__async_refit:
+                candidates = None
+                if len(self.__opt.models) > 0:
+                    candidates = self.__compute_candidates(self.__opt, self.__opt.models[-1])
+                self.__ready_pool = deque(self.__suggest_batch(self.__opt, candidates, self.__leased_experiments))
+                self.__ready_pool_num_results = len(self.__opt.yi) if candidates is not None else None
+                experiment_params = self.__pop_ready_point()
+
+            if experiment_params is None:
+                if self.__async_refit and self.__candidates is not None:
+                    experiment_params = self.__select_candidate(*self.__candidates, self.__leased_experiments)
+                else:
+                    experiment_params = self.__opt.ask()
+                    if experiment_params in self.__leased_experiments:
+                        experiment_params = self.__compute_alternative_params()
+            self.__add_lease(experiment_params, client_name)
         # TODO: Add to all experiments, use Ids
 
         def parse_dim_val(value, dim_type):
@@ -111,56 +350,168 @@ class BayesianOptimizedExperimentQueue(ExperimentQueue):
             elif type(dim_type) is Integer:
                 return int(value)
             return value
-        return {name: parse_dim_val(value, dim_type) for name, dim_type, value in zip(self.__dimension_names, self.__dimensions, experiment_params)}, -1
+        parameters = {name: parse_dim_val(value, dim_type) for name, dim_type, value in zip(self.__dimension_names, self.__dimensions, experiment_params)}
+        if self.__pruner is not None:
+            # The same point may be suggested again; drop any stop and rung values left from its previous lease
+            self.__pruner.forget(tuple(parameters[n] for n in self.__dimension_names))
+        return parameters, -1
+
+    def __pop_ready_point(self) -> Optional[List]:
+        while len(self.__ready_pool) > 0:
+            point = self.__ready_pool.popleft()
+            if point not in self.__leased_experiments:
+                return point
+        return None
+
+    def __suggest_batch(self, opt: Optimizer, candidates: Optional[Tuple[np.ndarray, np.ndarray]],
+                        leased: List[List]) -> List[List]:
+        """
+        Suggest batch_size diverse points from the model of opt.
+        :param candidates: the candidate points and their acquisition values under the latest model of opt (if any)
+        :param leased: the currently leased points
+        """
+        if candidates is None:
+            # The model is not fitted yet, so these are random points.
+            return opt.ask(n_points=self.__batch_size)
+
+        X, values = candidates
+        picked = []
+        if self.__batch_strategy == 'penalize':
+            for _ in range(self.__batch_size):
+                picked.append(self.__select_candidate(X, values, leased + picked))
+            return picked
+
+        # Constant liar: pretend that each picked point returned the lie and refit before picking the next one.
+        lie = {'cl_min': np.min, 'cl_mean': np.mean, 'cl_max': np.max}[self.__batch_strategy](opt.yi)
+        Xi, yi = list(opt.Xi), list(opt.yi)
+        for _ in range(self.__batch_size):
+            picked.append(self.__select_candidate(X, values, leased + picked))
+            if len(picked) == self.__batch_size:
+                break
+            Xi.append(picked[-1])
+            yi.append(lie)
+            est = clone(opt.base_estimator_)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                est.fit(opt.space.transform(Xi), yi)
+            values = _gaussian_acquisition(X=X, model=est, y_opt=np.min(yi),
+                                           acq_func='EI',
+                                           acq_func_kwargs=dict(n_points=10000))
+        return picked
+
+    def restore_lease(self, experiment_id: int, parameters: Dict, client: str) -> None:
+        with self.__model_lock:
+            self.__add_lease([parameters[n] for n in self.__dimension_names], client)
+
+    def __add_lease(self, point: List, client: str) -> None:
+        now = time.time()
+        self.__leased_experiments.append(point)
+        self.__lease_details.append([client, now, now + self.__lease_timeout.timeout_secs])
+
+    def __expire_leases(self) -> None:
+        """
+        Forget the leases that expired, so that their points are not discounted any more.
+        """
+        now = time.time()
+        if all(expiry >= now for _, _, expiry in self.__lease_details):
+            return
+        active = [i for i, (_, _, expiry) in enumerate(self.__lease_details) if expiry >= now]
+        self.__leased_experiments = [self.__leased_experiments[i] for i in active]
+        self.__lease_details = [self.__lease_details[i] for i in active]
+
+    def __find_lease(self, point: List, client: str) -> Optional[int]:
+        """
+        :return: the index of the lease of point by client (or of any lease of point if client has none), or None.
+        """
+        leases = [i for i, leased_point in enumerate(self.__leased_experiments) if leased_point == point]
+        for i in leases:
+            if self.__lease_details[i][0] == client:
+                return i
+        return leases[0] if len(leases) > 0 else None
+
+    def heartbeat(self, experiment_id: int, parameters: Dict, client: str) -> bool:
+        with self.__model_lock:
+            lease = self.__find_lease([parameters[n] for n in self.__dimension_names], client)
+            if lease is None or self.__lease_details[lease][0] != client:
+                return False
+            self.__lease_details[lease][2] = time.time() + self.__lease_timeout.heartbeat_timeout_secs
+            return True
+
+    def report(self, experiment_id: int, parameters: Dict, client: str, step: float, value: float) -> bool:
+        if not self.heartbeat(experiment_id, parameters, client):
+            return False
+        with self.__model_lock:
+            return self.__pruner is None or \
+                   self.__pruner.report(tuple(parameters[n] for n in self.__dimension_names), step, value)
 
     def __compute_alternative_params(self):
         # Copied directly from skopt
-        transformed_bounds = np.array(self.__opt.space.transformed_bounds)
-        est = clone(self.__opt.base_estimator)
+        est = clone(self.__opt.base_estimator_)
 
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             est.fit(self.__opt.space.transform(self.__opt.Xi), self.__opt.yi)
 
-        X = self.__opt.space.transform(self.__opt.space.rvs(
-            n_samples=self.__opt.n_points, random_state=self.__opt.rng))
+        return self.__select_candidate(*self.__compute_candidates(self.__opt, est), self.__leased_experiments)
 
-        values = _gaussian_acquisition(X=X, model=est, y_opt=np.min(self.__opt.yi),
+    @staticmethod
+    def __compute_candidates(opt: Optimizer, est) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: a random sample of (transformed) candidate points and their acquisition values under the model est.
+        """
+        X = opt.space.transform(opt.space.rvs(n_samples=opt.n_points, random_state=opt.rng))
+        values = _gaussian_acquisition(X=X, model=est, y_opt=np.min(opt.yi),
                                        acq_func='EI',
                                        acq_func_kwargs=dict(n_points=10000))
+        return X, values
 
-        print('original point ei: %s' % np.min(values))
-        discount_width = .5
-        values = self.__discount_leased_params(X, values, discount_width)
-        while np.min(values) > -1e-5 and discount_width > 1e-2:
-            discount_width *= .9
-            values = _gaussian_acquisition(X=X, model=est, y_opt=np.min(self.__opt.yi),
-                                           acq_func='EI',
-                                           acq_func_kwargs=dict(n_points=10000))
-            values = self.__discount_leased_params(X, values, discount_width)
-        next_x = X[np.argmin(values)]
-        print('new point ei: %s' % np.min(values))
+    def __select_candidate(self, X: np.ndarray, values: np.ndarray, leased: List[List]) -> List:
+        """
+        Select the best candidate point, discounting the acquisition values close to the leased points.
+        """
+        transformed_bounds = np.array(self.__opt.space.transformed_bounds)
+        if len(leased) == 0:
+            next_x = X[np.argmin(values)]
+        else:
+            LOGGER.debug('original point ei: %s', np.min(values))
+            discount_width = self.MAX_DISCOUNT_WIDTH
+            nearby_leased = self.__nearby_leased_distances(X, leased, discount_width)
+            discounted_values = self.__discount_leased_params(X, values, nearby_leased, discount_width)
+            while np.min(discounted_values) > -1e-5 and discount_width > 1e-2:
+                discount_width *= .9
+                discounted_values = self.__discount_leased_params(X, values, nearby_leased, discount_width)
+            next_x = X[np.argmin(discounted_values)]
+            LOGGER.debug('new point ei: %s', np.min(discounted_values))
 
         if not self.__opt.space.is_categorical:
             next_x = np.clip(next_x, transformed_bounds[:, 0], transformed_bounds[:, 1])
 
         return self.__opt.space.inverse_transform(next_x.reshape((1, -1)))[0]
 
+    def __nearby_leased_distances(self, X: np.ndarray, leased: List[List],
+                                  max_width: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Compute once the distances between the candidates X and the leased points that are closer than max_width, in the
+        transformed space.
+        :return: a tuple of arrays (candidate_idx, leased_idx, distance)
+        """
+        transformed_leased_params = np.array(self.__opt.space.transform(leased), dtype=np.float64)
+        if len(leased) > self.KDTREE_MIN_LEASED:
+            pairs = cKDTree(X).sparse_distance_matrix(cKDTree(transformed_leased_params), max_width, output_type='ndarray')
+            return pairs['i'], pairs['j'], pairs['v']
+        distances = cdist(X, transformed_leased_params)
+        candidate_idx, leased_idx = np.nonzero(distances < max_width)
+        return candidate_idx, leased_idx, distances[candidate_idx, leased_idx]
+
     @staticmethod
-    def leased_discount(center, width, x_values):
-        """Triangular (cone) discount"""
-        distance_from_center = np.linalg.norm(x_values - center, 2, axis=1)
-        discount = -distance_from_center / width + 1
-        discount[discount < 0] = 0
-        return discount
-
-    def __discount_leased_params(self, X, values, discount_width_size):
-        transformed_leased_params = self.__opt.space.transform(np.array(self.__leased_experiments))
-        discount_factor = reduce(lambda x, y: x * y,
-                                 (self.leased_discount(p, discount_width_size, X) for p in self.__leased_experiments),
-                                 np.ones(values.shape[0]))
-        out_vals = values * (1. - discount_factor)
-        return out_vals
+    def __discount_leased_params(X, values, nearby_leased, discount_width_size):
+        """
+        Discount the acquisition values of the candidates with a triangular (cone) discount around each leased point.
+        """
+        candidate_idx, _, distances = nearby_leased
+        keep_factor = np.ones(values.shape[0])
+        np.multiply.at(keep_factor, candidate_idx, np.minimum(distances / discount_width_size, 1.))
+        return values * keep_factor
 
     def complete(self, experiment_id: int, parameters: Dict, client: str, result: float = 0) -> None:
         """
@@ -170,17 +521,47 @@ class BayesianOptimizedExperimentQueue(ExperimentQueue):
         :param result: the output results of the experiment. This may be used in optimizing queues.
         """
         parameters = [parameters[n] for n in self.__dimension_names]
-        if parameters in self.__leased_experiments:
-            self.__leased_experiments.remove(parameters)
-        do_fit_model = len(self.__opt.yi) >= self.__min_num_results_to_fit
-        # Unfortunate hack: this depends on the internals.
-        if do_fit_model:
-            self.__opt._n_random_starts = 0  # Since we have adequately many results, stop using random
-        self.__opt.tell(parameters, result, fit=do_fit_model)
-
-    def __load_dimensions(self, dimensions_file:str)->Dict:
+        with self.__model_lock:
+            lease = self.__find_lease(parameters, client)
+            if lease is not None:
+                leased_client, lease_start, _ = self.__lease_details.pop(lease)
+                del self.__leased_experiments[lease]
+                if leased_client == client:
+                    self.__lease_timeout.record_duration(time.time() - lease_start)
+            if self.__async_refit:
+                self.__pending_results.append((parameters, result))
+                self.__refit_requested.set()
+                return
+
+            start = time.perf_counter()
+            do_fit_model = len(self.__opt.yi) >= self.__min_num_results_to_fit
+            reoptimized = False
+            # Unfortunate hack: this depends on the internals.
+            if do_fit_model:
+                self.__opt._n_initial_points = 0  # Since we have adequately many results, stop using random
+                reoptimized = self.__prepare_fit(self.__opt, len(self.__opt.yi) + 1)
+            self.__opt.tell(parameters, result, fit=do_fit_model)
+            if do_fit_model:
+                self.__record_fit(self.__opt, reoptimized)
+                # Keep the pre-suggested points until batch_size results were added since they were suggested, so that
+                # interleaved leases and completions still pop them. Random points are dropped at the first fit.
+                if self.__ready_pool_num_results is None or \
+                        len(self.__opt.yi) - self.__ready_pool_num_results >= self.__batch_size:
+                    self.__ready_pool.clear()
+                self.__num_refits += 1
+                self.__last_refit_secs = time.perf_counter() - start
+            self.__last_model_update = time.time()
+
+    def __load_dimensions(self, dimensions_file:str)->Tuple[Dict, Dict[str, Any]]:
+        """
+        :return: the dimensions and the options of the dimensions file
+        """
         with open(dimensions_file) as f:
             dimensions = json.load(f)
+        options = {}
+        if isinstance(dimensions, dict):
+            options = dimensions
+            dimensions = options['dimensions']
 
         def parse_dimension(specs: Dict[str, Any]):
             if specs['type'] == 'Real':
@@ -192,4 +573,4 @@ class BayesianOptimizedExperimentQueue(ExperimentQueue):
             else:
                 raise Exception('Unrecognized dimension type %s' % specs['type'])
 
-        return OrderedDict([parse_dimension(d) for d in dimensions])
\ No newline at end of file
+        return OrderedDict([parse_dimension(d) for d in dimensions]), options
\ No newline at end of file
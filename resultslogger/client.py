@@ -1,18 +1,104 @@
 import os
 import socket
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor, Future, BrokenExecutor, wait, FIRST_COMPLETED
 from copy import copy
-from typing import Tuple, Dict, Any, Optional, Callable
+from typing import Tuple, Dict, Any, Optional, Callable, List, Union
 
 import requests
 import sys
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from resultslogger.constants import ResultLoggerConstants
 
 
+class _HeartbeatSender:
+    """
+    Send heartbeats for the running experiments every interval_secs, in a background thread. No heartbeats are sent if
+    interval_secs is None.
+    """
+    def __init__(self, send: Callable[[List[Tuple[int, Dict[str, Any]]]], bool], interval_secs: Optional[float]):
+        """
+        :param send: sends the heartbeats of a list of (experiment_id, parameters) tuples. It returns False to stop
+        sending heartbeats, e.g. when the server does not support them.
+        """
+        self.__send = send
+        self.__interval_secs = interval_secs
+        self.__running = {}  # type: Dict[int, Tuple[int, Dict[str, Any]]]
+        self.__next_token = 0
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+        if interval_secs is not None:
+            self.__thread = threading.Thread(target=self.__loop, name='resultslogger-heartbeat', daemon=True)
+            self.__thread.start()
+
+    def add(self, experiment_id: int, parameters: Dict[str, Any]) -> int:
+        """
+        :return: a token to remove the experiment with
+        """
+        with self.__lock:
+            self.__next_token += 1
+            self.__running[self.__next_token] = experiment_id, parameters
+            return self.__next_token
+
+    def remove(self, token: int) -> None:
+        with self.__lock:
+            del self.__running[token]
+
+    def __loop(self) -> None:
+        while not self.__stopped.wait(self.__interval_secs):
+            with self.__lock:
+                running = list(self.__running.values())
+            if len(running) == 0:
+                continue
+            try:
+                if not self.__send(running):
+                    return
+            except Exception as e:
+                print('Failed to send heartbeat: %r' % e, file=sys.stderr)
+
+    def close(self) -> None:
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 class ResultsLoggerClient:
-    def __init__(self, servername: str):
-        self.__servername = servername
+    def __init__(self, servername: Union[str, List[str]], pool_size: int=4, max_retries: int=5,
+                 retry_backoff_secs: float=0.5, use_json: bool=True):
+        """
+        :param servername: the URL of the server, or a list of URLs of servers (e.g. shards or coordinators). Leases
+        go to the current server and fail over to the next one when it is unreachable. When a server has no more
+        experiments, the other servers are asked before giving up. Results, heartbeats and intermediate results are
+        sent to the server that leased the experiment.
+        :param pool_size: the maximum number of kept-alive connections to the server
+        :param max_retries: the number of times to retry a request on connection errors (and GET requests on transient
+        server errors)
+        :param retry_backoff_secs: the backoff factor between retries. Retry n waits retry_backoff_secs * 2^(n-1) secs.
+        :param use_json: talk to the server through the JSON API. Set to False for servers that only support the
+        form-encoded routes.
+        """
+        self.__servernames = [servername] if isinstance(servername, str) else list(servername)
+        self.__current_server = 0
+        self.__leased_from = {}  # type: Dict[int, str]
+        self.__use_json = use_json
+
+        # POST requests (e.g. lease and store) are only retried when the connection could not be established: after a
+        # read error or a server error the server may have handled them, and resending would duplicate leases or results.
+        retries = Retry(total=max_retries, read=0, backoff_factor=retry_backoff_secs, status_forcelist=(502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        self.__session = requests.Session()
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
 
     @property
     def client_name(self)-> str:
@@ -22,55 +108,311 @@ class ResultsLoggerClient:
         """
         return str(socket.gethostname()) + "-pid:" + str(os.getpid())
 
+    def __post(self, route: str, server: Optional[str]=None, failover: bool=False, **kwargs) -> Tuple[requests.Response, str]:
+        """
+        Post to the given server (or the current one).
+        :param failover: fail over to the other servers if the server is unreachable. Only leases may fail over, since
+        other requests (e.g. stores) are about experiments that only the server that leased them knows.
+        :return: the response and the server that replied
+        """
+        if server is None:
+            server = self.__servernames[self.__current_server]
+        servers = [server] + ([s for s in self.__servernames if s != server] if failover else [])
+        for i, server in enumerate(servers):
+            try:
+                r = self.__session.post(server + route, **kwargs)
+            except requests.ConnectionError:
+                if i == len(servers) - 1:
+                    raise
+                print('[%s] Server %s is unreachable, failing over' % (self.client_name, server), file=sys.stderr)
+                continue
+            if server in self.__servernames:
+                self.__current_server = self.__servernames.index(server)
+            return r, server
+
+    def __post_json(self, route: str, payload: Dict[str, Any], server: Optional[str]=None,
+                    failover: bool=False) -> Tuple[Dict[str, Any], str]:
+        payload[ResultLoggerConstants.FIELD_CLIENT] = self.client_name
+        r, server = self.__post(route, server, failover, json=payload)
+        assert r.status_code == requests.codes.ok, r.content
+        return r.json(), server
+
     def lease_next_experiment(self)-> Tuple:
         """
         Lease a new experiment to this client
         :return: a dict with the necessary parameters
         """
-        r = requests.post(self.__servername + ResultLoggerConstants.ROUTE_LEASE_EXPERIMENT,
-                          data={ResultLoggerConstants.FIELD_CLIENT: self.client_name})
+        leased = self.lease_batch(1)
+        return leased[0] if len(leased) > 0 else None
+
+    def __lease_from(self, num_experiments: int) -> Tuple[List[Dict[str, Any]], str]:
+        if self.__use_json:
+            leased, server = self.__post_json(ResultLoggerConstants.ROUTE_API_LEASE,
+                                              {ResultLoggerConstants.FIELD_NUM_EXPERIMENTS: num_experiments},
+                                              failover=True)
+            return leased[ResultLoggerConstants.FIELD_EXPERIMENTS], server
+        elif num_experiments == 1:
+            r, server = self.__post(ResultLoggerConstants.ROUTE_LEASE_EXPERIMENT, failover=True,
+                                    data={ResultLoggerConstants.FIELD_CLIENT: self.client_name})
+            assert r.status_code == requests.codes.ok, r
+            return ([] if r.text == ResultLoggerConstants.END else [r.json()]), server
+        r, server = self.__post(ResultLoggerConstants.ROUTE_LEASE_EXPERIMENTS_BATCH, failover=True,
+                                data={ResultLoggerConstants.FIELD_CLIENT: self.client_name,
+                                      ResultLoggerConstants.FIELD_NUM_EXPERIMENTS: num_experiments})
         assert r.status_code == requests.codes.ok, r
-        if r.text == ResultLoggerConstants.END:
-            return None
-        data = r.json()
-        return data['experiment_id'], data['parameters']
+        return r.json(), server
+
+    def lease_batch(self, num_experiments: int) -> List[Tuple]:
+        """
+        Lease up to num_experiments new experiments to this client in a single request.
+        :return: a list of (experiment_id, parameters) tuples. The list is empty if no experiments are available.
+        """
+        for _ in range(len(self.__servernames)):
+            leased, server = self.__lease_from(num_experiments)
+            if len(leased) > 0:
+                break
+            # This server has no experiments, try the next one
+            self.__current_server = (self.__servernames.index(server) + 1) % len(self.__servernames)
+        if len(self.__servernames) > 1:
+            for data in leased:
+                if data['experiment_id'] != -1:
+                    self.__leased_from[data['experiment_id']] = server
+        return [(data['experiment_id'], data['parameters']) for data in leased]
+
+    @staticmethod
+    def __results_with_minimized(results: Dict[str, Any], minimized_result: Optional[float]) -> Dict[str, Any]:
+        if minimized_result is not None:
+            results = copy(results)
+            results[ResultLoggerConstants.BASE_RESULT_FIELD] = minimized_result
+        return results
 
     def store_experiment_results(self, experiment_id: int, parameters: Dict[str, Any], results: Dict[str, Any], minimized_result: Optional[float]=None):
         """
         Store the results of an experiment.
         :param parameters: the used parameters
         :param results: the results
+        :param minimized_result: the value that the queue minimizes (if any). It is stored along with the results.
         """
-        if minimized_result is not None:
-            parameters = copy(parameters)
-            parameters[ResultLoggerConstants.BASE_RESULT_FIELD] = minimized_result
+        if self.__use_json:
+            self.store_batch([(experiment_id, parameters, results, minimized_result)])
+            return
         data = {ResultLoggerConstants.FIELD_CLIENT: self.client_name,
                 ResultLoggerConstants.FIELD_PARAMETERS: json.dumps(parameters),
-                ResultLoggerConstants.FIELD_RESULTS: json.dumps(results),
+                ResultLoggerConstants.FIELD_RESULTS: json.dumps(self.__results_with_minimized(results, minimized_result)),
                 ResultLoggerConstants.FIELD_EXPERIMENT_ID: experiment_id}
 
-        r = requests.post(self.__servername + ResultLoggerConstants.ROUTE_STORE_EXPERIMENT, data=data)
+        r, _ = self.__post(ResultLoggerConstants.ROUTE_STORE_EXPERIMENT, self.__leased_from.get(experiment_id), data=data)
         assert r.status_code == requests.codes.ok, r.content
         assert r.text == ResultLoggerConstants.OK
+        self.__leased_from.pop(experiment_id, None)
 
-    def compute_in_loop(self, result_computer: Callable[[Dict[str, Any]], Tuple[float, Dict[str, Any]]], output_stream=sys.stdout):
+    def store_batch(self, experiments: List[Tuple[int, Dict[str, Any], Dict[str, Any], Optional[float]]]):
+        """
+        Store the results of multiple experiments in a single request (per server that leased them).
+        :param experiments: a list of (experiment_id, parameters, results, minimized_result) tuples
+        """
+        # The server of an experiment is forgotten once its results are stored, so that a failed store can be retried.
+        per_server = {}  # type: Dict[Optional[str], List[Dict[str, Any]]]
+        for experiment_id, parameters, results, minimized_result in experiments:
+            per_server.setdefault(self.__leased_from.get(experiment_id), []).append(
+                {ResultLoggerConstants.FIELD_EXPERIMENT_ID: experiment_id,
+                 ResultLoggerConstants.FIELD_PARAMETERS: parameters,
+                 ResultLoggerConstants.FIELD_RESULTS: self.__results_with_minimized(results, minimized_result)})
+
+        for server, batch in per_server.items():
+            if self.__use_json:
+                reply, _ = self.__post_json(ResultLoggerConstants.ROUTE_API_STORE,
+                                            {ResultLoggerConstants.FIELD_EXPERIMENTS: batch}, server)
+                assert reply['status'] == ResultLoggerConstants.OK
+            else:
+                data = {ResultLoggerConstants.FIELD_CLIENT: self.client_name,
+                        ResultLoggerConstants.FIELD_EXPERIMENTS: json.dumps(batch)}
+
+                r, _ = self.__post(ResultLoggerConstants.ROUTE_STORE_EXPERIMENTS_BATCH, server, data=data)
+                assert r.status_code == requests.codes.ok, r.content
+                assert r.text == ResultLoggerConstants.OK
+            for experiment in batch:
+                self.__leased_from.pop(experiment[ResultLoggerConstants.FIELD_EXPERIMENT_ID], None)
+
+    def heartbeat(self, experiments: List[Tuple[int, Dict[str, Any]]]) -> List[bool]:
+        """
+        Declare that leased experiments are still running, so that their leases do not expire. Heartbeats are only part
+        of the JSON API, whatever use_json is. Raises requests.HTTPError if the server rejects them (e.g. with 404 if it
+        does not support heartbeats).
+        :param experiments: a list of (experiment_id, parameters) tuples
+        :return: for each experiment, whether it is still leased to this client
+        """
+        per_server = {}  # type: Dict[Optional[str], List[int]]
+        for i, (experiment_id, _) in enumerate(experiments):
+            per_server.setdefault(self.__leased_from.get(experiment_id), []).append(i)
+
+        leased = [False] * len(experiments)
+        for server, batch in per_server.items():
+            r, _ = self.__post(ResultLoggerConstants.ROUTE_API_HEARTBEAT, server,
+                               json={ResultLoggerConstants.FIELD_CLIENT: self.client_name,
+                                     ResultLoggerConstants.FIELD_EXPERIMENTS: [
+                                         {ResultLoggerConstants.FIELD_EXPERIMENT_ID: experiments[i][0],
+                                          ResultLoggerConstants.FIELD_PARAMETERS: experiments[i][1]} for i in batch]})
+            r.raise_for_status()
+            for i, is_leased in zip(batch, r.json()[ResultLoggerConstants.FIELD_LEASED]):
+                leased[i] = is_leased
+        return leased
+
+    def __send_heartbeats(self, experiments: List[Tuple[int, Dict[str, Any]]]) -> bool:
+        """
+        Send the heartbeats of the background _HeartbeatSender.
+        :return: False if the server does not support heartbeats, so that they are not sent any more
+        """
+        try:
+            self.heartbeat(experiments)
+        except requests.HTTPError as e:
+            if e.response.status_code != requests.codes.not_found:
+                raise
+            print('[%s] The server does not support heartbeats, not sending them' % self.client_name, file=sys.stderr)
+            return False
+        return True
+
+    def report_intermediate_result(self, experiment_id: int, parameters: Dict[str, Any], step: float,
+                                   value: float) -> bool:
+        """
+        Report an intermediate result of a running experiment, e.g. its validation loss after each epoch, so that the
+        server can stop unpromising experiments early. A report also extends the lease of the experiment.
+        :param step: the checkpoint of the result (e.g. the epoch)
+        :param value: the intermediate result. Lower is better, as for the minimized result.
+        :return: True if the experiment should continue. If False, stop it and store its results so far.
+        """
+        reply, _ = self.__post_json(ResultLoggerConstants.ROUTE_API_REPORT,
+                                    {ResultLoggerConstants.FIELD_EXPERIMENTS: [
+                                        {ResultLoggerConstants.FIELD_EXPERIMENT_ID: experiment_id,
+                                         ResultLoggerConstants.FIELD_PARAMETERS: parameters,
+                                         ResultLoggerConstants.FIELD_STEP: step,
+                                         ResultLoggerConstants.FIELD_VALUE: value}]},
+                                    self.__leased_from.get(experiment_id))
+        return reply[ResultLoggerConstants.FIELD_CONTINUE][0]
+
+    def __lease(self, batch_size: int) -> List[Tuple]:
+        if batch_size == 1:
+            next_experiment = self.lease_next_experiment()
+            return [] if next_experiment is None else [next_experiment]
+        return self.lease_batch(batch_size)
+
+    def __lease_with_heartbeats(self, batch_size: int, heartbeats: _HeartbeatSender) -> List[Tuple[int, Dict[str, Any], int]]:
+        """
+        Lease a batch and start sending its heartbeats right away, since its experiments may wait (e.g. when prefetched)
+        before they run.
+        :return: a list of (experiment_id, parameters, heartbeat token) tuples
+        """
+        return [(experiment_id, parameters, heartbeats.add(experiment_id, parameters))
+                for experiment_id, parameters in self.__lease(batch_size)]
+
+    def compute_in_loop(self, result_computer: Callable[[Dict[str, Any]], Tuple[float, Dict[str, Any]]], output_stream=sys.stdout,
+                        batch_size: int=1, prefetch: bool=False, heartbeat_interval_secs: Optional[float]=60.):
         """
         Keep asking and running new experiments, until there are no more experiments available.
         :param result_computer: a lambda that accepts a dict of parameters and returns a dict of results. The method
         receives a copy of the parameters.
         :param output_stream: the file to output (default stdout)
+        :param batch_size: the number of experiments to lease (and store) per request.
+        :param prefetch: lease the next batch of experiments while the current one is running, hiding the round-trip
+        latency to the server.
+        :param heartbeat_interval_secs: send a heartbeat for the running experiments this often (in a background
+        thread), so that the server can quickly re-lease the experiments of clients that died. None disables heartbeats.
         """
-        while True:
+        with ThreadPoolExecutor(max_workers=1) as prefetcher, self.__heartbeats(heartbeat_interval_secs) as heartbeats:
             print('[%s] Requesting new experiment...' % self.client_name, file=output_stream)
-            next_experiment = self.lease_next_experiment()
-            if next_experiment is None:
-                print('[%s] No more experiments available...' % self.client_name, file=output_stream)
-                break
-            experiment_id, parameters = next_experiment
-            print("Running with new parameters %s" % parameters, file=output_stream)
-            optimized_result, results = result_computer(dict(parameters))
-            self.store_experiment_results(experiment_id, parameters, results, minimized_result=optimized_result)
-            print("[%s] Finished experiments with parameters %s and results %s" % (self.client_name, parameters, results), file=output_stream)
+            next_batch = prefetcher.submit(self.__lease_with_heartbeats, batch_size, heartbeats) if prefetch else None
+            while True:
+                batch = next_batch.result() if prefetch else self.__lease_with_heartbeats(batch_size, heartbeats)
+                if len(batch) == 0:
+                    print('[%s] No more experiments available...' % self.client_name, file=output_stream)
+                    break
+                if prefetch:
+                    next_batch = prefetcher.submit(self.__lease_with_heartbeats, batch_size, heartbeats)
+
+                completed = []
+                for experiment_id, parameters, _ in batch:
+                    print("Running with new parameters %s" % parameters, file=output_stream)
+                    optimized_result, results = result_computer(dict(parameters))
+                    completed.append((experiment_id, parameters, results, optimized_result))
+                    print("[%s] Finished experiments with parameters %s and results %s" % (self.client_name, parameters, results), file=output_stream)
+
+                if len(completed) == 1:
+                    self.store_experiment_results(*completed[0])
+                else:
+                    self.store_batch(completed)
+                for _, _, token in batch:
+                    heartbeats.remove(token)
+                if not prefetch:
+                    print('[%s] Requesting new experiment...' % self.client_name, file=output_stream)
+
+    def compute_parallel(self, result_computer: Callable[[Dict[str, Any]], Tuple[float, Dict[str, Any]]], num_workers: int,
+                         use_processes: bool=True, output_stream=sys.stdout, heartbeat_interval_secs: Optional[float]=60.):
+        """
+        Keep asking and running new experiments on a pool of num_workers workers, until there are no more experiments
+        available. All workers share the leasing loop and the HTTP session of this client. An experiment that raises an
+        exception is not stored (its lease will eventually expire) and does not stop the loop.
+        :param result_computer: a lambda that accepts a dict of parameters and returns a dict of results. When
+        use_processes is True, it must be picklable (e.g. a module-level function).
+        :param num_workers: the number of experiments to run concurrently
+        :param use_processes: run the experiments in a process pool. Otherwise use a thread pool, e.g. for I/O-bound
+        experiments.
+        :param output_stream: the file to output (default stdout)
+        :param heartbeat_interval_secs: send a heartbeat for the running experiments this often. None disables heartbeats.
+        """
+        def make_executor():
+            return ProcessPoolExecutor(max_workers=num_workers) if use_processes else ThreadPoolExecutor(max_workers=num_workers)
+
+        executor = make_executor()
+        running = {}  # type: Dict[Future, Tuple[int, Dict[str, Any], Executor, int]]
+        has_more_experiments = True
+        heartbeats = self.__heartbeats(heartbeat_interval_secs)
+        try:
+            while True:
+                if has_more_experiments and len(running) < num_workers:
+                    batch = self.__lease(num_workers - len(running))
+                    if len(batch) == 0:
+                        print('[%s] No more experiments available...' % self.client_name, file=output_stream)
+                        has_more_experiments = False
+                    for experiment_id, parameters in batch:
+                        print("Running with new parameters %s" % parameters, file=output_stream)
+                        try:
+                            future = executor.submit(result_computer, dict(parameters))
+                        except BrokenExecutor:
+                            executor.shutdown(wait=False)
+                            executor = make_executor()
+                            future = executor.submit(result_computer, dict(parameters))
+                        running[future] = experiment_id, parameters, executor, heartbeats.add(experiment_id, parameters)
+                if len(running) == 0:
+                    break
+
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                completed = []
+                for future in done:
+                    experiment_id, parameters, submitted_to, token = running.pop(future)
+                    heartbeats.remove(token)
+                    try:
+                        optimized_result, results = future.result()
+                    except BrokenExecutor:
+                        print("[%s] Worker pool broke while running experiment with parameters %s." % (self.client_name, parameters), file=output_stream)
+                        if submitted_to is executor:
+                            executor.shutdown(wait=False)
+                            executor = make_executor()
+                        continue
+                    except Exception as e:
+                        print("[%s] Experiment with parameters %s failed: %r" % (self.client_name, parameters, e), file=output_stream)
+                        continue
+                    completed.append((experiment_id, parameters, results, optimized_result))
+                    print("[%s] Finished experiments with parameters %s and results %s" % (self.client_name, parameters, results), file=output_stream)
+                if len(completed) > 0:
+                    self.store_batch(completed)
+        finally:
+            heartbeats.close()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __heartbeats(self, interval_secs: Optional[float]) -> _HeartbeatSender:
+        if not self.__use_json:
+            interval_secs = None  # The form-encoded routes have no heartbeats
+        return _HeartbeatSender(self.__send_heartbeats, interval_secs)
 
 
 # Sample
@@ -2,6 +2,17 @@ class ResultLoggerConstants:
 
     ROUTE_LEASE_EXPERIMENT = '/lease_next_experiment'
     ROUTE_STORE_EXPERIMENT = '/store_experiment'
+    ROUTE_LEASE_EXPERIMENTS_BATCH = '/lease_experiments'
+    ROUTE_STORE_EXPERIMENTS_BATCH = '/store_experiments'
+    ROUTE_API_LEASE = '/api/lease'
+    ROUTE_API_STORE = '/api/store'
+    ROUTE_API_RESULTS = '/api/results'
+    ROUTE_API_QUEUE = '/api/queue'
+    ROUTE_API_PROGRESS = '/api/progress'
+    ROUTE_API_HEARTBEAT = '/api/heartbeat'
+    ROUTE_API_REPORT = '/api/report'
+    ROUTE_METRICS = '/metrics'
+    ROUTE_METRICS_PROFILE = '/metrics/profile'
     ROUTE_EXPERIMENTS_ALL_RESULTS = '/results'
     ROUTE_EXPERIMENTS_SUMMARY = '/resultsummary'
     ROUTE_EXPERIMENTS_QUEUE = '/'
@@ -12,6 +23,24 @@ class ResultLoggerConstants:
     FIELD_PARAMETERS = 'parameters'
     FIELD_RESULTS = 'results'
     FIELD_GROUPBY = 'groupby'
+    FIELD_NUM_EXPERIMENTS = 'numexperiments'
+    FIELD_EXPERIMENTS = 'experiments'
+    FIELD_LIMIT = 'limit'
+    FIELD_OFFSET = 'offset'
+    FIELD_SORT = 'sort'
+    FIELD_ASCENDING = 'ascending'
+    FIELD_FILTER = 'filter'
+    FIELD_FORMAT = 'format'
+    FIELD_COMPRESSION = 'compression'
+    FIELD_LEASED = 'leased'
+    FIELD_STEP = 'step'
+    FIELD_VALUE = 'value'
+    FIELD_CONTINUE = 'continue'
+    FIELD_SAMPLING_RATE = 'rate'
+    FIELD_RESET = 'reset'
+
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
 
     OK = 'OK'
     END = 'END'
@@ -0,0 +1,323 @@
+import io
+import json
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+import pandas as pd
+import requests
+from flask import Flask, Response, request, jsonify, abort
+import pystache
+
+from resultslogger.constants import ResultLoggerConstants
+from resultslogger.export import csv_chunks, gzip_chunks, columnar_chunks
+from resultslogger.pagination import paginated_json
+from resultslogger.server import ResultsLoggerServer, get_groupby_links
+
+
+class ShardCoordinator:
+    """
+    A front end for N ResultsLoggerServer shards, each serving a CsvExperimentQueue with the same list of experiments
+    and shard_index=i, num_shards=N. Leases are forwarded to shards in turn, skipping shards that recently had no
+    waiting experiments. Results are stored in the shard that owns the experiment. The results, summary and csv dump
+    views are merged across shards.
+    """
+    def __init__(self, experiment_name: str, shard_urls: List[str], exhausted_recheck_secs: float=30.,
+                 merged_results_max_age_secs: float=5.):
+        """
+        :param shard_urls: the URLs of the shards, in shard_index order.
+        :param exhausted_recheck_secs: how long to skip a shard that had no experiments to lease (or was unreachable).
+        :param merged_results_max_age_secs: how long the merged results of all shards are reused.
+        """
+        self.__app = Flask(__name__)
+        self.__experiment_name = experiment_name
+        self.__shard_urls = shard_urls
+        self.__exhausted_recheck_secs = exhausted_recheck_secs
+        self.__merged_results_max_age_secs = merged_results_max_age_secs
+
+        self.__session = requests.Session()
+        self.__renderer = pystache.Renderer()
+        self.__lock = threading.Lock()
+        self.__next_shard = 0
+        self.__exhausted_until = [0.] * len(shard_urls)
+        self.__merged_results = None, 0.
+        self.__parameter_names = None
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_LEASE_EXPERIMENT, methods=['POST'])
+        def lease_next_experiment():
+            leased = self.__lease(request.form[ResultLoggerConstants.FIELD_CLIENT], 1)
+            if len(leased) == 0:
+                return ResultLoggerConstants.END
+            return json.dumps(leased[0])
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_LEASE_EXPERIMENTS_BATCH, methods=['POST'])
+        def lease_experiments_batch():
+            return json.dumps(self.__lease(request.form[ResultLoggerConstants.FIELD_CLIENT],
+                                           int(request.form[ResultLoggerConstants.FIELD_NUM_EXPERIMENTS])))
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_STORE_EXPERIMENT, methods=['POST'])
+        def store_experiment():
+            self.__store(request.form[ResultLoggerConstants.FIELD_CLIENT],
+                         [{ResultLoggerConstants.FIELD_EXPERIMENT_ID: int(request.form[ResultLoggerConstants.FIELD_EXPERIMENT_ID]),
+                           ResultLoggerConstants.FIELD_PARAMETERS: json.loads(request.form[ResultLoggerConstants.FIELD_PARAMETERS]),
+                           ResultLoggerConstants.FIELD_RESULTS: json.loads(request.form[ResultLoggerConstants.FIELD_RESULTS])}])
+            return ResultLoggerConstants.OK
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_STORE_EXPERIMENTS_BATCH, methods=['POST'])
+        def store_experiments_batch():
+            self.__store(request.form[ResultLoggerConstants.FIELD_CLIENT],
+                         json.loads(request.form[ResultLoggerConstants.FIELD_EXPERIMENTS]))
+            return ResultLoggerConstants.OK
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_LEASE, methods=['POST'])
+        def api_lease():
+            payload = request.get_json(force=True)
+            return jsonify({ResultLoggerConstants.FIELD_EXPERIMENTS: self.__lease(
+                payload[ResultLoggerConstants.FIELD_CLIENT], int(payload.get(ResultLoggerConstants.FIELD_NUM_EXPERIMENTS, 1)))})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_STORE, methods=['POST'])
+        def api_store():
+            payload = request.get_json(force=True)
+            self.__store(payload[ResultLoggerConstants.FIELD_CLIENT], payload[ResultLoggerConstants.FIELD_EXPERIMENTS])
+            return jsonify({'status': ResultLoggerConstants.OK})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_HEARTBEAT, methods=['POST'])
+        def api_heartbeat():
+            payload = request.get_json(force=True)
+            return jsonify({ResultLoggerConstants.FIELD_LEASED: self.__forward_to_owners(
+                ResultLoggerConstants.ROUTE_API_HEARTBEAT, payload[ResultLoggerConstants.FIELD_CLIENT],
+                payload[ResultLoggerConstants.FIELD_EXPERIMENTS])})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_REPORT, methods=['POST'])
+        def api_report():
+            payload = request.get_json(force=True)
+            return jsonify({ResultLoggerConstants.FIELD_CONTINUE: self.__forward_to_owners(
+                ResultLoggerConstants.ROUTE_API_REPORT, payload[ResultLoggerConstants.FIELD_CLIENT],
+                payload[ResultLoggerConstants.FIELD_EXPERIMENTS], ResultLoggerConstants.FIELD_CONTINUE)})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_EXPERIMENTS_ALL_RESULTS)
+        def show_results_html():
+            return self.__renderer.render(ResultsLoggerServer.PAGE_TEMPLATE,
+                                          {'title': 'All Results',
+                                           'experiment_name': self.__experiment_name,
+                                           'api_url': ResultLoggerConstants.ROUTE_API_RESULTS,
+                                           'page_size': ResultLoggerConstants.DEFAULT_PAGE_SIZE,
+                                           'summary_links': get_groupby_links(self.__get_parameter_names(), set()),
+                                           'in_results': True})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_RESULTS)
+        def api_results():
+            all_results = self.__all_results()
+            try:
+                response = paginated_json(all_results, request.args)
+            except (KeyError, ValueError) as e:
+                abort(400, str(e))
+            return self.__app.response_class(response, mimetype='application/json')
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_CSV_DUMP)
+        def download_csv():
+            all_results = self.__all_results()
+            file_format = request.args.get(ResultLoggerConstants.FIELD_FORMAT, 'csv')
+            if file_format == 'csv':
+                chunks = csv_chunks(all_results)
+                extension = '.csv'
+                if request.args.get(ResultLoggerConstants.FIELD_COMPRESSION) == 'gzip':
+                    chunks = gzip_chunks(chunks)
+                    extension += '.gz'
+            elif file_format in ('parquet', 'arrow'):
+                chunks = columnar_chunks(all_results, file_format)
+                extension = '.' + file_format
+            else:
+                abort(400, 'Unrecognized format %s' % file_format)
+
+            response = Response(chunks)
+            response.headers['Content-Description'] = 'File Transfer'
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['Content-Type'] = 'application/octet-stream'
+            response.headers['Content-Disposition'] = 'attachment; filename=%s' % self.__experiment_name + extension
+            return response
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_EXPERIMENTS_SUMMARY)
+        def show_summary_html():
+            group_by_values = request.args.get(ResultLoggerConstants.FIELD_GROUPBY).split(',')
+            try:
+                summary = self.__group_summary(group_by_values)
+            except KeyError as e:
+                abort(400, str(e))
+            return self.__renderer.render(ResultsLoggerServer.PAGE_TEMPLATE,
+                                          {'title': 'Results Summary',
+                                           'experiment_name': self.__experiment_name,
+                                           'body': summary.to_html(classes=['table', 'table-striped', 'table-condensed', 'table-hover']).replace('border="1"', 'border="0"'),
+                                           'summary_links': get_groupby_links(self.__get_parameter_names(), set(group_by_values)),
+                                           'in_summary': True})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_EXPERIMENTS_QUEUE)
+        def experiment_queue_html():
+            progress = [self.__get_json(shard_url, ResultLoggerConstants.ROUTE_API_PROGRESS) for shard_url in self.__shard_urls]
+            # Shards differ in size by at most one experiment
+            pct_completed = 100 * sum(p['completed'] for p in progress) / len(progress)
+            pct_leased = 100 * sum(p['leased'] for p in progress) / len(progress)
+            return self.__renderer.render(ResultsLoggerServer.PAGE_TEMPLATE,
+                                          {'title': 'Experiments Queue',
+                                           'experiment_name': self.__experiment_name,
+                                           'body': '<p>%d shards</p>' % len(self.__shard_urls),
+                                           'progress': pct_completed + pct_leased > 0,
+                                           'progress_complete': int(pct_completed) if pct_completed > 0 else False,
+                                           'progress_leased': int(pct_leased) if pct_leased > 0 else False,
+                                           'summary_links': get_groupby_links(self.__get_parameter_names(), set()),
+                                           'in_queue': True})
+
+    @property
+    def wsgi_app(self) -> Flask:
+        return self.__app
+
+    def run(self, host: str='0.0.0.0', port: int=5000):
+        self.__app.run(host=host, port=port, threaded=True)
+
+    def __get_json(self, shard_url: str, route: str) -> Any:
+        r = self.__session.get(shard_url + route)
+        assert r.status_code == requests.codes.ok, r.content
+        return r.json()
+
+    def __get_parameter_names(self) -> List[str]:
+        if self.__parameter_names is None:
+            self.__parameter_names = self.__get_json(self.__shard_urls[0], ResultLoggerConstants.ROUTE_API_PROGRESS)[
+                ResultLoggerConstants.FIELD_PARAMETERS]
+        return self.__parameter_names
+
+    def __lease(self, client: str, num_experiments: int) -> List[Dict[str, Any]]:
+        """
+        Lease up to num_experiments experiments, visiting each shard at most once, starting from the next shard in turn.
+        """
+        with self.__lock:
+            first_shard = self.__next_shard
+            self.__next_shard = (self.__next_shard + 1) % len(self.__shard_urls)
+
+        leased = []
+        for i in range(len(self.__shard_urls)):
+            if len(leased) == num_experiments:
+                break
+            shard = (first_shard + i) % len(self.__shard_urls)
+            if self.__exhausted_until[shard] > time.time():
+                continue
+            try:
+                r = self.__session.post(self.__shard_urls[shard] + ResultLoggerConstants.ROUTE_API_LEASE,
+                                        json={ResultLoggerConstants.FIELD_CLIENT: client,
+                                              ResultLoggerConstants.FIELD_NUM_EXPERIMENTS: num_experiments - len(leased)})
+                r.raise_for_status()
+            except requests.RequestException as e:
+                print("Shard %s is unavailable: %s" % (self.__shard_urls[shard], e))
+                self.__exhausted_until[shard] = time.time() + self.__exhausted_recheck_secs
+                continue
+            shard_leased = r.json()[ResultLoggerConstants.FIELD_EXPERIMENTS]
+            if len(shard_leased) < num_experiments - len(leased):
+                self.__exhausted_until[shard] = time.time() + self.__exhausted_recheck_secs
+            leased.extend(shard_leased)
+        return leased
+
+    def __store(self, client: str, experiments: List[Dict[str, Any]]) -> None:
+        self.__forward_to_owners(ResultLoggerConstants.ROUTE_API_STORE, client, experiments)
+
+    def __forward_to_owners(self, route: str, client: str, experiments: List[Dict[str, Any]],
+                            reply_field: str=ResultLoggerConstants.FIELD_LEASED) -> List[Any]:
+        """
+        Forward each experiment to the shard that owns it. Unsolicited experiments (with id -1) go to the next shard.
+        :return: the values of the reply_field list of the shard replies (if any), in the order of experiments
+        """
+        per_shard = {}  # type: Dict[int, List[int]]
+        for i, experiment in enumerate(experiments):
+            experiment_id = int(experiment[ResultLoggerConstants.FIELD_EXPERIMENT_ID])
+            if experiment_id == -1:
+                with self.__lock:
+                    shard = self.__next_shard
+                    self.__next_shard = (self.__next_shard + 1) % len(self.__shard_urls)
+            else:
+                shard = experiment_id % len(self.__shard_urls)
+            per_shard.setdefault(shard, []).append(i)
+
+        replies = [None] * len(experiments)
+        for shard, shard_experiments in per_shard.items():
+            r = self.__session.post(self.__shard_urls[shard] + route,
+                                    json={ResultLoggerConstants.FIELD_CLIENT: client,
+                                          ResultLoggerConstants.FIELD_EXPERIMENTS: [experiments[i] for i in shard_experiments]})
+            assert r.status_code == requests.codes.ok, r.content
+            for i, reply in zip(shard_experiments, r.json().get(reply_field, [])):
+                replies[i] = reply
+        return replies
+
+    def __all_results(self) -> pd.DataFrame:
+        """
+        :return: the results of all shards. They are fetched again if they are older than merged_results_max_age_secs.
+        """
+        merged_results, fetched_at = self.__merged_results
+        if merged_results is None or time.time() - fetched_at > self.__merged_results_max_age_secs:
+            shard_results = []
+            for shard_url in self.__shard_urls:
+                shard_results.append(self.__get_results(shard_url))
+            merged_results = pd.concat(shard_results, ignore_index=True, sort=False)
+            self.__merged_results = merged_results, time.time()
+        return merged_results
+
+    def __get_results(self, shard_url: str) -> pd.DataFrame:
+        """
+        :return: the results of a shard, in the Arrow format so that their dtypes are kept. They are fetched as csv if
+        pyarrow is not installed or if the shard fails to send them as Arrow (e.g. a shard that truncates the stream of
+        results it cannot convert).
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            pa = None
+        if pa is not None:
+            r = self.__session.get(shard_url + ResultLoggerConstants.ROUTE_CSV_DUMP,
+                                   params={ResultLoggerConstants.FIELD_FORMAT: 'arrow'})
+            if r.status_code == requests.codes.ok:
+                try:
+                    return pa.ipc.open_stream(r.content).read_pandas()
+                except (pa.ArrowInvalid, OSError):
+                    pass
+        r = self.__session.get(shard_url + ResultLoggerConstants.ROUTE_CSV_DUMP,
+                               params={ResultLoggerConstants.FIELD_FORMAT: 'csv'})
+        assert r.status_code == requests.codes.ok, r.content
+        return pd.read_csv(io.BytesIO(r.content), index_col=0)
+
+    def __group_summary(self, group_by: List[str]) -> pd.DataFrame:
+        """
+        :return: the same summary as ExperimentLogger.group_summary, over the results of all shards.
+        """
+        all_results = self.__all_results()
+        for column in group_by:
+            if column not in all_results.columns:
+                raise KeyError('Unknown column %s' % column)
+        numeric_columns = sorted(c for c in all_results.columns
+                                 if c not in group_by and pd.api.types.is_numeric_dtype(all_results[c]))
+        return all_results.groupby(group_by)[numeric_columns].agg(['mean', 'std', 'count'])
+
+
+def run_shard(experiment_name: str, list_of_experiments_path: str, shard_index: int, num_shards: int, port: int,
+              autosave_path: str='.') -> None:
+    """
+    Serve one shard of the experiments in list_of_experiments_path (e.g. in a separate process).
+    """
+    from resultslogger.experimentqueue import CsvExperimentQueue
+    queue = CsvExperimentQueue(list_of_experiments_path, shard_index=shard_index, num_shards=num_shards)
+    ResultsLoggerServer('%s-shard%s' % (experiment_name, shard_index), queue, autosave_path=autosave_path).run(port=port)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5:
+        print("Usage <experimentName> <listOfExperiments.csv> <numShards> <port>")
+        print("Starts numShards local shard servers on ports port+1...port+numShards and a coordinator on port.")
+        sys.exit(-1)
+
+    import multiprocessing
+    experiment_name, list_of_experiments_path = sys.argv[1], sys.argv[2]
+    num_shards, port = int(sys.argv[3]), int(sys.argv[4])
+
+    shards = [multiprocessing.Process(target=run_shard, daemon=True,
+                                      args=(experiment_name, list_of_experiments_path, i, num_shards, port + 1 + i))
+              for i in range(num_shards)]
+    for shard in shards:
+        shard.start()
+    ShardCoordinator(experiment_name, ['http://localhost:%s' % (port + 1 + i) for i in range(num_shards)]).run(port=port)
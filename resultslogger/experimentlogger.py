@@ -1,22 +1,273 @@
-from typing import Any, List, Dict
+from collections import OrderedDict
+from numbers import Integral, Real
+from typing import Any, List, Dict, Optional, Tuple
+
+import numpy as np
 import pandas as pd
-from itertools import chain
+
+
+class _ColumnBuffer:
+    """
+    A growable buffer for the values of a single column. Integers and floats are stored in typed NumPy arrays that
+    double in capacity when full, everything else in a Python list.
+    """
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, num_missing: int=0):
+        self.__values = np.empty(max(self.INITIAL_CAPACITY, 2 * num_missing), dtype=np.int64)
+        self.__length = 0
+        self.__is_object = False
+        if num_missing > 0:
+            self.__promote(np.float64)
+            self.__values[:num_missing] = np.nan
+            self.__length = num_missing
+
+    def __len__(self):
+        return self.__length
+
+    @property
+    def is_numeric(self) -> bool:
+        return not self.__is_object
+
+    def __promote(self, dtype) -> None:
+        if dtype is object:
+            self.__values = self.__values[:self.__length].tolist()
+            self.__is_object = True
+        else:
+            self.__values = self.__values.astype(dtype)
+
+    def append(self, value: Any, dtype) -> None:
+        """
+        :param value: a value converted by _typed_value
+        :param dtype: the dtype of the value, as returned by _typed_value
+        """
+        if dtype is None:
+            self.append_missing(value)
+            return
+        if not self.__is_object:
+            if dtype is object:
+                self.__promote(object)
+            elif dtype is np.float64 and self.__values.dtype == np.int64:
+                self.__promote(np.float64)
+        self.__append(value)
+
+    def append_missing(self, value: Any=None) -> None:
+        """
+        :param value: the missing value (None or NaN) to keep if the column is not numeric
+        """
+        if self.__is_object:
+            self.__append(value)
+            return
+        if self.__values.dtype == np.int64:
+            self.__promote(np.float64)
+        self.__append(np.nan)
+
+    def __append(self, value: Any) -> None:
+        if self.__is_object:
+            self.__values.append(value)
+        else:
+            if self.__length == len(self.__values):
+                grown = np.empty(2 * len(self.__values), dtype=self.__values.dtype)
+                grown[:self.__length] = self.__values
+                self.__values = grown
+            self.__values[self.__length] = value
+        self.__length += 1
+
+    def to_array(self, length: int):
+        """
+        :return: a copy of the first length values. Values are never modified once appended, so this is safe to call
+        while another thread appends to the buffer.
+        """
+        values = self.__values
+        if isinstance(values, list):
+            return np.array(values[:length], dtype=object)
+        return values[:length].copy()
+
+
+def _is_missing(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+_INT64_INFO = np.iinfo(np.int64)
+
+
+def _typed_value(value: Any) -> Tuple[Any, Any]:
+    """
+    :return: the value to append to a _ColumnBuffer and the narrowest dtype of a column that holds it: np.int64,
+    np.float64 or object. Missing values (None and NaN) have no dtype (None), so that they do not promote numeric columns.
+    Integers that do not fit in an int64 are objects.
+    """
+    if _is_missing(value):
+        return value, None
+    if isinstance(value, bool) or not isinstance(value, Real):
+        return value, object
+    if isinstance(value, Integral):
+        value = int(value)
+        return (value, np.int64) if _INT64_INFO.min <= value <= _INT64_INFO.max else (value, object)
+    return float(value), np.float64
+
+
+class _GroupAggregates:
+    """
+    Running count, mean and sum of squared deviations (Welford's algorithm) of numeric columns, per group.
+    """
+    def __init__(self, group_by: Tuple[str, ...], results: pd.DataFrame, numeric_columns: List[str]):
+        """
+        :param group_by: the columns to group by
+        :param results: the results logged so far, used to initialize the aggregates
+        :param numeric_columns: the numeric columns of results
+        """
+        self.__group_by = group_by
+        self.__groups = {}  # type: Dict[Tuple, Dict[str, List[float]]]
+
+        aggregated_columns = [c for c in numeric_columns if c not in group_by]
+        if len(results) == 0 or len(aggregated_columns) == 0:
+            return
+        grouped = results.groupby(list(group_by))[aggregated_columns]
+        counts, means, variances = grouped.count(), grouped.mean(), grouped.var(ddof=0)
+        for key in counts.index:
+            group_stats = self.__groups.setdefault(key if isinstance(key, tuple) else (key,), {})
+            for column in aggregated_columns:
+                count = counts.at[key, column]
+                if count > 0:
+                    group_stats[column] = [count, means.at[key, column], variances.at[key, column] * count]
+
+    def add(self, row: Dict[str, Any], numeric_columns: Dict[str, bool]) -> None:
+        key = tuple(row.get(c) for c in self.__group_by)
+        if any(_is_missing(k) for k in key):
+            return
+        group_stats = self.__groups.setdefault(key, {})
+        for column, value in row.items():
+            if column in self.__group_by or not numeric_columns[column] or _is_missing(value):
+                continue
+            stats = group_stats.setdefault(column, [0, 0., 0.])
+            stats[0] += 1
+            delta = value - stats[1]
+            stats[1] += delta / stats[0]
+            stats[2] += delta * (value - stats[1])
+
+    def to_frame(self, group_by: List[str], numeric_columns: Dict[str, bool]) -> pd.DataFrame:
+        """
+        :param group_by: the order of the group by columns in the index of the returned frame
+        :return: a frame with a row per group and (column, mean|std|count) columns
+        """
+        columns = sorted({c for group_stats in self.__groups.values() for c in group_stats if numeric_columns[c]})
+        keys = sorted(self.__groups.keys(), key=lambda k: tuple(str(v) for v in k))
+        summary = {}
+        for column in columns:
+            column_stats = [self.__groups[k].get(column, (0, np.nan, np.nan)) for k in keys]
+            summary[(column, 'mean')] = [mean for _, mean, _ in column_stats]
+            summary[(column, 'std')] = [np.sqrt(m2 / (count - 1)) if count > 1 else np.nan for count, _, m2 in column_stats]
+            summary[(column, 'count')] = [count for count, _, _ in column_stats]
+
+        index = pd.MultiIndex.from_tuples(keys, names=self.__group_by) if len(keys) > 0 else \
+            pd.MultiIndex.from_arrays([[]] * len(self.__group_by), names=self.__group_by)
+        summary_columns = pd.MultiIndex.from_tuples(list(summary.keys())) if len(summary) > 0 else \
+            pd.MultiIndex.from_arrays([[], []])
+        frame = pd.DataFrame(summary, index=index, columns=summary_columns)
+        frame = frame.reorder_levels(group_by).sort_index()
+        if len(group_by) == 1:
+            frame.index = frame.index.get_level_values(0)
+        return frame
 
 
 class ExperimentLogger:
     """
-    Log all experiment results within the class.
+    Log all experiment results within the class. Results are appended into per-column buffers, so that logging a result
+    does not copy the results logged so far. The results frame is built lazily and cached until the next result.
+
+    all_results may be called from any thread while a single writer logs experiments: it returns a consistent snapshot of
+    all the results that were completely logged when it was called.
+
+    Grouped summaries (mean, std and count of the numeric columns per group) are maintained incrementally for the
+    MAX_CACHED_GROUPINGS most recently requested groupings.
     """
+    MAX_CACHED_GROUPINGS = 16
+
     def __init__(self, parameter_names: List[str], result_columns: List[str]) -> None:
-        self.__results_frame = pd.DataFrame(columns=parameter_names+result_columns)
+        self.__columns = {}  # type: Dict[str, _ColumnBuffer]
+        self.__column_order = []  # type: List[str]
+        self.__num_results = 0
+        self.__results_frame = None, 0  # type: Tuple[Optional[pd.DataFrame], int]
+        self.__group_aggregates = OrderedDict()  # type: OrderedDict[Tuple[str, ...], _GroupAggregates]
+        for column_name in parameter_names + result_columns:
+            self.__add_column(column_name)
+
+    def __setstate__(self, state):
+        if '_ExperimentLogger__columns' in state:
+            self.__dict__.update(state)
+            return
+        # Loggers pickled before the columnar buffers kept all their results in a single frame
+        results_frame = state['_ExperimentLogger__results_frame']
+        ExperimentLogger.__init__(self, list(results_frame.columns), [])
+        for row in results_frame.to_dict('records'):
+            self.log_experiment(row, {})
+
+    def __add_column(self, column_name: str) -> None:
+        self.__columns[column_name] = _ColumnBuffer(self.__num_results)
+        self.__column_order.append(column_name)
 
     def log_experiment(self, parameters: Dict[str, Any], results: Dict[str, Any]) -> None:
-        joined_dict = dict(chain(parameters.items(), results.items()))
-        self.__results_frame = self.__results_frame.append(joined_dict, ignore_index=True)
+        joined_dict = dict(parameters)
+        joined_dict.update(results)
+        # Convert all the values first, so that a value that cannot be converted leaves the columns untouched
+        typed_values = {column_name: _typed_value(value) for column_name, value in joined_dict.items()}
+        for column_name in joined_dict:
+            if column_name not in self.__columns:
+                self.__add_column(column_name)
+        for column_name, column in self.__columns.items():
+            if column_name in typed_values:
+                column.append(*typed_values[column_name])
+            else:
+                column.append_missing()
+        self.__num_results += 1
+
+        if len(self.__group_aggregates) > 0:
+            numeric_columns = self.__numeric_columns()
+            for aggregates in self.__group_aggregates.values():
+                aggregates.add(joined_dict, numeric_columns)
+
+    @property
+    def num_results(self) -> int:
+        """
+        :return: the number of logged results, without building the results frame
+        """
+        return self.__num_results
+
+    def __numeric_columns(self) -> Dict[str, bool]:
+        return {name: column.is_numeric for name, column in self.__columns.items()}
+
+    def group_summary(self, group_by: List[str]) -> pd.DataFrame:
+        """
+        Summarize the results per group, in O(number of groups) for groupings that were recently requested. Not safe to
+        call concurrently with log_experiment.
+        :param group_by: the columns to group by, in the order of the index of the returned frame
+        :return: a frame with a row per group and (column, mean|std|count) columns for each numeric column
+        """
+        grouping = tuple(sorted(group_by))
+        numeric_columns = self.__numeric_columns()
+        if grouping in self.__group_aggregates:
+            self.__group_aggregates.move_to_end(grouping)
+        else:
+            for column in grouping:
+                if column not in self.__columns:
+                    raise KeyError('Unknown column %s' % column)
+            self.__group_aggregates[grouping] = _GroupAggregates(grouping, self.all_results,
+                                                                 [c for c, is_numeric in numeric_columns.items() if is_numeric])
+            if len(self.__group_aggregates) > self.MAX_CACHED_GROUPINGS:
+                self.__group_aggregates.popitem(last=False)
+        return self.__group_aggregates[grouping].to_frame(list(group_by), numeric_columns)
 
     @property
     def all_results(self)-> pd.DataFrame:
-        return self.__results_frame
+        results_frame, num_results = self.__results_frame
+        if results_frame is None or num_results != self.__num_results:
+            num_results = self.__num_results
+            column_order = list(self.__column_order)
+            results_frame = pd.DataFrame({c: self.__columns[c].to_array(num_results) for c in column_order},
+                                         columns=column_order)
+            self.__results_frame = results_frame, num_results
+        return results_frame
 
     def save_results_csv(self, filename:str) -> None:
-        self.__results_frame.to_csv(filename)
\ No newline at end of file
+        self.all_results.to_csv(filename)
@@ -1,8 +1,13 @@
 import json
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+from resultslogger.leaseindex import LeaseIndex
+from resultslogger.pruning import Pruner
+from resultslogger.scheduling import SchedulingPolicy
+
 
 class ExperimentQueue:
     """
@@ -20,7 +25,37 @@ class ExperimentQueue:
         :return: The PandasFrame containing the details for all the experiments in the queue.
         """
         raise NotImplemented('Abstract Class')
-    
+
+    @property
+    def num_experiments(self) -> int:
+        """
+        :return: the number of rows of all_experiments
+        """
+        return len(self.all_experiments)
+
+    def experiments_slice(self, start: int, stop: int) -> pd.DataFrame:
+        """
+        :return: the rows [start, stop) of all_experiments. Queues override it to build only these rows.
+        """
+        return self.all_experiments.iloc[start:stop]
+
+    def snapshot_experiments(self) -> Callable[[], pd.DataFrame]:
+        """
+        Capture the state of the queue, so that all_experiments can be built later, e.g. outside of a lock that
+        serializes the queue operations. Queues override it when copying their state is cheaper than building the frame.
+        :return: a function that returns all_experiments as of this call
+        """
+        all_experiments = self.all_experiments
+        return lambda: all_experiments
+
+    @property
+    def max_cache_hits_per_lease(self) -> Optional[int]:
+        """
+        :return: the most leased experiments that a server may complete from its result cache in a single lease, if
+        complete() is too expensive (e.g. it refits a model) to complete many experiments while the client waits for the
+        lease, or None.
+        """
+        return None
 
     @property
     def completed_percent(self) -> float:
@@ -30,6 +65,13 @@ class ExperimentQueue:
     def leased_percent(self) -> float:
         raise NotImplemented('Abstract Class')
 
+    @property
+    def status_counts(self) -> Dict[str, int]:
+        """
+        :return: the number of experiments with each status.
+        """
+        return self.all_experiments['status'].value_counts().to_dict()
+
     @property
     def experiment_parameters(self)-> List:
         raise NotImplemented('Abstract Class')
@@ -51,79 +93,220 @@ class ExperimentQueue:
         """
         raise NotImplemented('Abstract Class')
 
+    def restore_lease(self, experiment_id: int, parameters: Dict, client: str) -> None:
+        """
+        Re-apply a lease that was previously returned by lease_new, e.g. when replaying a journal.
+        :param experiment_id: the id of the experiment or -1 if unknown
+        :param parameters: the leased parameters
+        :param client: the client that holds the lease
+        """
+        pass
+
+    def heartbeat(self, experiment_id: int, parameters: Dict, client: str) -> bool:
+        """
+        Declare that a leased experiment is still running, extending its lease.
+        :param experiment_id: the id of the experiment or -1 if unknown
+        :return: False if the experiment is not leased to the client any more
+        """
+        return True
+
+    def report(self, experiment_id: int, parameters: Dict, client: str, step: float, value: float) -> bool:
+        """
+        Record an intermediate result of a leased experiment (e.g. its validation loss after an epoch). A report is
+        also a heartbeat.
+        :param step: the checkpoint of the result (e.g. the epoch)
+        :param value: the intermediate result. Lower is better, as for the minimized result.
+        :return: False if the experiment should stop, e.g. because it is pruned or not leased to the client any more.
+        A stopped experiment should still store its results so far, so that it is not leased again.
+        """
+        return self.heartbeat(experiment_id, parameters, client)
+
 
 class CsvExperimentQueue(ExperimentQueue):
-    def __init__(self, list_of_experiments_path: str, lease_timout='2 days'):
+    def __init__(self, list_of_experiments_path: str, lease_timout='2 days', shard_index: int=0, num_shards: int=1,
+                 heartbeat_timeout='5 minutes', scheduling_policy: Optional[SchedulingPolicy]=None,
+                 pruner: Optional[Pruner]=None):
         """
         :param list_of_experiments_path: The path to a csv file containing all possible experiments.
+        :param lease_timout: the maximum time that a lease lasts. Once the durations of enough experiments are known,
+        leases time out after a multiple of the (95th percentile) duration, if that is shorter.
+        :param heartbeat_timeout: the time that a lease lasts after the last heartbeat of its client.
+        :param shard_index: the shard of the experiments that this queue holds, in [0, num_shards).
+        :param num_shards: split the experiments across num_shards queues (e.g. in different servers). Shard i holds
+        the experiments whose row number modulo num_shards is i. Experiment ids are the row numbers in the whole file.
+        :param scheduling_policy: the order in which waiting experiments are leased (e.g. a PriorityPolicy). Defaults
+        to the order of the csv file.
+        :param pruner: stops running experiments early from their reported intermediate results (e.g. a
+        SuccessiveHalvingPruner). Defaults to never stopping them.
         """
-        self.__all_experiments = pd.read_csv(list_of_experiments_path)
-        self.__all_experiments['status'] = [self.WAITING] * len(self.__all_experiments)
-        self.__all_experiments['last_update'] = pd.Series(pd.Timestamp(float('NaN')))
-        self.__all_experiments['client'] = [""] * len(self.__all_experiments)
+        assert 0 <= shard_index < num_shards
+        self.__shard_index = shard_index
+        self.__num_shards = num_shards
+        self.__pruner = pruner
+        if num_shards == 1:
+            self.__experiment_parameters = pd.read_csv(list_of_experiments_path)
+        else:
+            self.__experiment_parameters = pd.read_csv(list_of_experiments_path,
+                                                       skiprows=lambda row: row > 0 and (row - 1) % num_shards != shard_index)
         self.__lease_duration = pd.to_timedelta(lease_timout)
+        if scheduling_policy is not None:
+            scheduling_policy.bind(self.__experiment_parameters)
+        self.__leases = LeaseIndex(len(self.__experiment_parameters), self.__lease_duration.total_seconds(),
+                                   pd.to_timedelta(heartbeat_timeout).total_seconds(), scheduling_policy)
+
+        self.__all_experiments_view = None
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_CsvExperimentQueue__leases' not in state:
+            self.__migrate_experiments_frame()
+
+    def __migrate_experiments_frame(self) -> None:
+        """
+        Build the lease index of a queue pickled before it was added, when the experiments and their status, last
+        update and client were kept in a single frame.
+        """
+        all_experiments = self.__all_experiments
+        del self.__all_experiments
+        del self.__non_parameter_fields
+        self.__shard_index = 0
+        self.__num_shards = 1
+        self.__pruner = None
+        self.__experiment_parameters = all_experiments.drop(columns=['status', 'last_update', 'client'])
+        self.__experiment_parameters.reset_index(drop=True, inplace=True)
+        self.__leases = LeaseIndex(len(all_experiments), self.__lease_duration.total_seconds())
+        for experiment_id, (status, last_update, client) in enumerate(zip(all_experiments['status'],
+                                                                          all_experiments['last_update'],
+                                                                          all_experiments['client'])):
+            if status != self.WAITING:
+                # The frame kept the local time of the server
+                self.__leases.restore_status(experiment_id, status, client, last_update.to_pydatetime().timestamp())
+        self.__all_experiments_view = None
 
-        self.__non_parameter_fields = {'status', 'last_update', 'client'}
+    def __to_global_id(self, local_id: int) -> int:
+        return local_id * self.__num_shards + self.__shard_index
+
+    def __to_local_id(self, experiment_id: int) -> int:
+        local_id, shard_index = divmod(experiment_id, self.__num_shards)
+        assert shard_index == self.__shard_index, "Experiment %s is not in this shard" % experiment_id
+        return local_id
 
     @property
     def all_experiments(self)-> pd.DataFrame:
-        return self.__all_experiments
+        """
+        :return: The PandasFrame containing the details for all the experiments in the queue. The frame is rebuilt lazily
+        from the lease index and cached until the next change in the queue.
+        """
+        if self.__all_experiments_view is None:
+            self.__all_experiments_view = self.__build_view(self.__leases.copy_state())
+        return self.__all_experiments_view
+
+    @property
+    def num_experiments(self) -> int:
+        return self.__leases.num_experiments
+
+    def experiments_slice(self, start: int, stop: int) -> pd.DataFrame:
+        if self.__all_experiments_view is not None:
+            return self.__all_experiments_view.iloc[start:stop]
+        view = self.__experiment_parameters.iloc[start:stop].copy()
+        local_ids = range(*slice(start, stop).indices(self.__leases.num_experiments))
+        if self.__num_shards > 1:
+            view.index = self.__to_global_id(view.index)
+        view['status'] = [self.__leases.status(i) for i in local_ids]
+        view['last_update'] = pd.to_datetime([self.__leases.last_update(i) for i in local_ids], unit='s')
+        view['client'] = [self.__leases.client(i) for i in local_ids]
+        view['duration'] = pd.to_timedelta([self.__leases.duration(i) for i in local_ids], unit='s')
+        return view
+
+    def snapshot_experiments(self) -> Callable[[], pd.DataFrame]:
+        if self.__all_experiments_view is not None:
+            view = self.__all_experiments_view
+            return lambda: view
+        lease_state = self.__leases.copy_state()
+        return lambda: self.__build_view(lease_state)
+
+    def __build_view(self, lease_state: Tuple[Dict[int, str], Dict[int, float], Dict[int, str], Dict[int, float]]) -> pd.DataFrame:
+        """
+        :param lease_state: a copy of the state of the lease index (see LeaseIndex.copy_state)
+        """
+        touched_status, touched_last_update, touched_client, touched_duration = lease_state
+        status = np.full(len(self.__experiment_parameters), self.WAITING, dtype=object)
+        last_update = np.full(len(self.__experiment_parameters), np.nan)
+        client = np.full(len(self.__experiment_parameters), "", dtype=object)
+        duration = np.full(len(self.__experiment_parameters), np.nan)
+        for experiment_id, experiment_status in touched_status.items():
+            status[experiment_id] = experiment_status
+            last_update[experiment_id] = touched_last_update[experiment_id]
+            client[experiment_id] = touched_client[experiment_id]
+        for experiment_id, experiment_duration in touched_duration.items():
+            duration[experiment_id] = experiment_duration
+
+        view = self.__experiment_parameters.copy()
+        if self.__num_shards > 1:
+            view.index = self.__to_global_id(view.index)
+        view['status'] = status
+        view['last_update'] = pd.to_datetime(last_update, unit='s')
+        view['client'] = client
+        view['duration'] = pd.to_timedelta(duration, unit='s')
+        return view
 
     def __str__(self):
-        return str(self.__all_experiments)
+        return str(self.all_experiments)
 
     @property
     def completed_percent(self):
-        return float(len(self.__all_experiments[self.all_experiments.status == self.DONE])) / len(self.__all_experiments)
+        return float(self.__leases.num_done) / self.__leases.num_experiments
 
     @property
     def leased_percent(self):
-        return float(len(self.__all_experiments[self.all_experiments.status == self.LEASED])) / len(self.__all_experiments)
+        return float(self.__leases.num_leased) / self.__leases.num_experiments
 
     @property
-    def experiment_parameters(self)-> list:
-        return [c for c in self.__all_experiments.columns if c not in self.__non_parameter_fields]
+    def status_counts(self) -> Dict[str, int]:
+        return {self.WAITING: self.__leases.num_waiting, self.LEASED: self.__leases.num_leased,
+                self.DONE: self.__leases.num_done}
 
-    def lease_new(self, client_name: str) -> tuple:
-        available = self.__all_experiments[self.all_experiments.status == self.WAITING]
+    @property
+    def experiment_parameters(self)-> list:
+        return list(self.__experiment_parameters.columns)
 
-        if len(available) == 0:
-            available = self.__all_experiments[(self.__all_experiments.status == self.LEASED) &
-             (self.__all_experiments.last_update + self.__lease_duration < pd.Timestamp('now'))]
+    def __get_parameters(self, experiment_id: int) -> dict:
+        return json.loads(self.__experiment_parameters.iloc[experiment_id].to_json())
 
-        if len(available) == 0:
+    def lease_new(self, client_name: str) -> tuple:
+        lease = self.__leases.lease(client_name)
+        if lease is None:
             return None
+        selected_id, is_re_lease = lease
+        if is_re_lease:
+            print("Re-leasing experiment %s since it expired" % self.__to_global_id(selected_id))
+            if self.__pruner is not None:
+                self.__pruner.forget(self.__to_global_id(selected_id))
+        self.__all_experiments_view = None
+        return self.__get_parameters(selected_id), self.__to_global_id(selected_id)
 
-        # Pick the first non-leased element
-        leased_params = json.loads(available.iloc[0].to_json())
-        selected_id = int(available.index[0])
-
-        if self.__all_experiments.status.loc[selected_id] == self.LEASED:
-            print("Re-leasing experiment %s since it expired" % selected_id)
+    def restore_lease(self, experiment_id: int, parameters: dict, client: str) -> None:
+        if experiment_id == -1: return
+        self.__leases.restore_lease(self.__to_local_id(experiment_id), client)
+        self.__all_experiments_view = None
 
-        self.__all_experiments.loc[selected_id, 'status'] = self.LEASED
-        self.__all_experiments.loc[selected_id, 'last_update'] = pd.Timestamp('now')
-        self.__all_experiments.loc[selected_id, 'client'] = client_name
+    def heartbeat(self, experiment_id: int, parameters: dict, client: str) -> bool:
+        if experiment_id == -1: return True
+        return self.__leases.heartbeat(self.__to_local_id(experiment_id), client)
 
-        for k in self.__non_parameter_fields:
-            del leased_params[k]
-        return leased_params, selected_id
+    def report(self, experiment_id: int, parameters: dict, client: str, step: float, value: float) -> bool:
+        if not self.heartbeat(experiment_id, parameters, client):
+            return False
+        return self.__pruner is None or experiment_id == -1 or self.__pruner.report(experiment_id, step, value)
 
     def complete(self, experiment_id: int, parameters: dict, client: str, result: float):
         if experiment_id == -1: return
-        selected_experiment = self.__all_experiments.iloc[experiment_id]
-        original_params = selected_experiment.to_dict()
-
-        for k in self.__non_parameter_fields:
-            del original_params[k]
+        experiment_id = self.__to_local_id(experiment_id)
+        original_params = self.__get_parameters(experiment_id)
         assert original_params == parameters, "Experiment Parameters do not match!"
 
-        if selected_experiment.client != client:
+        if self.__leases.client(experiment_id) != client:
             print("Experiment returned from non-leased (or expired) client")
 
-        self.__all_experiments.loc[experiment_id, 'status'] = self.DONE
-        self.__all_experiments.loc[experiment_id, 'last_update'] = pd.Timestamp('now')
-        self.__all_experiments.loc[experiment_id, 'client'] = client
-        # TODO: Add duration of experiment
-
-
+        self.__leases.complete(experiment_id, client)
+        self.__all_experiments_view = None
@@ -0,0 +1,82 @@
+import io
+import zlib
+from typing import Iterator
+
+import pandas as pd
+
+# The rows that are serialized at a time when streaming a frame.
+CHUNK_ROWS = 10000
+
+
+def csv_chunks(frame: pd.DataFrame, chunk_rows: int=CHUNK_ROWS) -> Iterator[str]:
+    """
+    Serialize a frame as csv, chunk_rows rows at a time.
+    """
+    yield frame.iloc[:0].to_csv()
+    for start in range(0, len(frame), chunk_rows):
+        yield frame.iloc[start:start + chunk_rows].to_csv(header=False)
+
+
+def gzip_chunks(chunks: Iterator[str]) -> Iterator[bytes]:
+    """
+    gzip-compress a stream of strings.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if len(compressed) > 0:
+            yield compressed
+    yield compressor.flush()
+
+
+def columnar_chunks(frame: pd.DataFrame, file_format: str, chunk_rows: int=CHUNK_ROWS) -> Iterator[bytes]:
+    """
+    Serialize a frame in a columnar format, chunk_rows rows at a time. Requires pyarrow. The schema is inferred and the
+    writer is created when this is called, so that errors are raised before the first chunk is streamed.
+    :param file_format: 'parquet' (one row group per chunk) or 'arrow' (the Arrow IPC streaming format)
+    """
+    import pyarrow as pa
+    frame = _arrow_compatible(frame)
+    schema = pa.Schema.from_pandas(frame, preserve_index=True)
+    sink = io.BytesIO()
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema)
+        write_chunk = lambda chunk: writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=True))
+    elif file_format == 'arrow':
+        writer = pa.ipc.new_stream(sink, schema)
+        write_chunk = lambda chunk: writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=True))
+    else:
+        raise Exception('Unrecognized columnar format %s' % file_format)
+
+    def drain_sink() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    def chunks() -> Iterator[bytes]:
+        for start in range(0, len(frame), chunk_rows):
+            write_chunk(frame.iloc[start:start + chunk_rows])
+            yield drain_sink()
+        writer.close()
+        yield drain_sink()
+    return chunks()
+
+
+def _arrow_compatible(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    :return: the frame, with the object columns that Arrow cannot convert (e.g. of both strings and numbers, or of
+    integers that do not fit in an int64) converted to strings. Missing values are kept.
+    """
+    import pyarrow as pa
+    converted = frame
+    for column in frame.columns[frame.dtypes == object]:
+        try:
+            pa.array(frame[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+            if converted is frame:
+                converted = frame.copy(deep=False)
+            converted[column] = frame[column].map(
+                lambda value: value if pd.api.types.is_scalar(value) and pd.isna(value) else str(value))
+    return converted
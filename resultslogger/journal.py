@@ -0,0 +1,94 @@
+import json
+import os
+import time
+from typing import Any, Dict, Iterator
+
+
+class ExperimentJournal:
+    """
+    An append-only journal of lease and complete events, stored as one JSON object per line. Each event carries an
+    increasing sequence number, so that a snapshot can record up to which event it is up-to-date. Writes are flushed
+    immediately and fsynced in batches.
+    """
+
+    LEASE = 'lease'
+    COMPLETE = 'complete'
+
+    def __init__(self, path: str, fsync_every: int=32, fsync_interval_secs: float=1.):
+        """
+        :param path: the path of the journal file. Any existing events are kept and the sequence numbers continue
+        after the last existing event.
+        :param fsync_every: fsync after this many events have been written since the last fsync.
+        :param fsync_interval_secs: fsync if this many seconds have passed since the last fsync.
+        """
+        self.__path = path
+        self.__fsync_every = fsync_every
+        self.__fsync_interval_secs = fsync_interval_secs
+
+        self.__last_sequence_number = 0
+        for event in self.read_events(path):
+            self.__last_sequence_number = max(self.__last_sequence_number, event['seq'])
+
+        self.__file = open(path, 'a')
+        self.__num_unsynced = 0
+        self.__last_fsync = time.time()
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def last_sequence_number(self) -> int:
+        return self.__last_sequence_number
+
+    def __append(self, event: Dict[str, Any]) -> None:
+        self.__last_sequence_number += 1
+        event['seq'] = self.__last_sequence_number
+        self.__file.write(json.dumps(event) + '\n')
+        self.__file.flush()
+        self.__num_unsynced += 1
+        if self.__num_unsynced >= self.__fsync_every or time.time() - self.__last_fsync >= self.__fsync_interval_secs:
+            self.sync()
+
+    def log_lease(self, experiment_id: int, parameters: Dict[str, Any], client: str) -> None:
+        self.__append({'event': self.LEASE, 'experiment_id': experiment_id, 'parameters': parameters,
+                       'client': client})
+
+    def log_complete(self, experiment_id: int, parameters: Dict[str, Any], client: str,
+                     results: Dict[str, Any]) -> None:
+        self.__append({'event': self.COMPLETE, 'experiment_id': experiment_id, 'parameters': parameters,
+                       'client': client, 'results': results})
+
+    def sync(self) -> None:
+        """
+        Force all written events to disk.
+        """
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__num_unsynced = 0
+        self.__last_fsync = time.time()
+
+    def truncate(self) -> None:
+        """
+        Remove all events from the journal, e.g. after they have been compacted into a snapshot. Sequence numbers are
+        not reset.
+        """
+        self.__file.truncate(0)
+        self.sync()
+
+    def close(self) -> None:
+        self.sync()
+        self.__file.close()
+
+    @staticmethod
+    def read_events(path: str) -> Iterator[Dict[str, Any]]:
+        """
+        Read all the events of a journal. A partially written last line (e.g. after a crash) is ignored.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                yield json.loads(line)
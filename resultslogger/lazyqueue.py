@@ -0,0 +1,214 @@
+import json
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from resultslogger.experimentqueue import ExperimentQueue
+from resultslogger.leaseindex import LeaseIndex
+
+
+class ExperimentSource:
+    """
+    A fixed, ordered list of experiments whose parameters are materialized on demand.
+    """
+
+    @property
+    def parameter_names(self) -> List[str]:
+        raise NotImplemented('Abstract Class')
+
+    def __len__(self) -> int:
+        raise NotImplemented('Abstract Class')
+
+    def get(self, experiment_id: int) -> Dict[str, Any]:
+        """
+        :return: the parameters of the experiment with the given id. Accessing ids in increasing order is cheap.
+        """
+        raise NotImplemented('Abstract Class')
+
+
+class ParameterGridSource(ExperimentSource):
+    """
+    All the combinations of a set of parameter values (the Cartesian product), where the last parameter varies fastest.
+    """
+    def __init__(self, grid: Dict[str, List[Any]]):
+        self.__grid = OrderedDict(grid)
+        self.__num_values = [len(values) for values in self.__grid.values()]
+
+    @staticmethod
+    def from_json(grid_path: str) -> 'ParameterGridSource':
+        """
+        :param grid_path: a json file with a dict from each parameter name to the list of its values
+        """
+        with open(grid_path) as f:
+            return ParameterGridSource(json.load(f, object_pairs_hook=OrderedDict))
+
+    @property
+    def parameter_names(self) -> List[str]:
+        return list(self.__grid.keys())
+
+    def __len__(self) -> int:
+        return int(np.prod(self.__num_values, dtype=np.int64))
+
+    def get(self, experiment_id: int) -> Dict[str, Any]:
+        if not 0 <= experiment_id < len(self):
+            raise IndexError('Experiment %s is not in the grid' % experiment_id)
+        parameters = {}
+        for (name, values), num_values in zip(reversed(self.__grid.items()), reversed(self.__num_values)):
+            experiment_id, value_idx = divmod(experiment_id, num_values)
+            parameters[name] = values[value_idx]
+        return {name: parameters[name] for name in self.__grid}
+
+
+class ChunkedCsvSource(ExperimentSource):
+    """
+    The rows of a csv file, read chunksize rows at a time. Only the chunk containing the last accessed row is in memory.
+    """
+    def __init__(self, csv_path: str, chunksize: int=10000):
+        self.__csv_path = csv_path
+        self.__chunksize = chunksize
+
+        self.__parameter_names = list(pd.read_csv(csv_path, nrows=0).columns)
+        self.__num_rows = sum(len(chunk) for chunk in pd.read_csv(csv_path, usecols=[0], chunksize=chunksize))
+
+        self.__reader = None
+        self.__chunk_start = 0
+        self.__chunk = []  # type: List[Dict[str, Any]]
+
+    @property
+    def parameter_names(self) -> List[str]:
+        return self.__parameter_names
+
+    def __len__(self) -> int:
+        return self.__num_rows
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_ChunkedCsvSource__reader'] = None
+        state['_ChunkedCsvSource__chunk'] = []
+        return state
+
+    def __seek(self, experiment_id: int) -> None:
+        """
+        Start reading from the chunk that contains experiment_id.
+        """
+        self.__chunk_start = (experiment_id // self.__chunksize) * self.__chunksize
+        rows_to_skip = self.__chunk_start
+        self.__reader = pd.read_csv(self.__csv_path, chunksize=self.__chunksize,
+                                    skiprows=lambda row: 0 < row <= rows_to_skip)
+        self.__chunk = []
+
+    def get(self, experiment_id: int) -> Dict[str, Any]:
+        if not 0 <= experiment_id < self.__num_rows:
+            raise IndexError('Experiment %s is not in %s' % (experiment_id, self.__csv_path))
+        if self.__reader is None or experiment_id < self.__chunk_start:
+            self.__seek(experiment_id)
+        while experiment_id >= self.__chunk_start + len(self.__chunk):
+            self.__chunk_start += len(self.__chunk)
+            self.__chunk = json.loads(next(self.__reader).to_json(orient='records'))
+        return self.__chunk[experiment_id - self.__chunk_start]
+
+
+class LazyExperimentQueue(ExperimentQueue):
+    """
+    A queue over an ExperimentSource (e.g. a parameter grid or a large csv file) that materializes the parameters of an
+    experiment only when it is leased. Memory is proportional to the number of experiments leased so far, not to the
+    number of experiments.
+    """
+    def __init__(self, source: ExperimentSource, lease_timout='2 days', heartbeat_timeout='5 minutes'):
+        """
+        :param lease_timout: the maximum time that a lease lasts (see CsvExperimentQueue)
+        :param heartbeat_timeout: the time that a lease lasts after the last heartbeat of its client
+        """
+        self.__source = source
+        self.__lease_duration = pd.to_timedelta(lease_timout)
+        self.__leases = LeaseIndex(len(source), self.__lease_duration.total_seconds(),
+                                   pd.to_timedelta(heartbeat_timeout).total_seconds())
+        self.__materialized = {}  # type: Dict[int, Dict[str, Any]]
+        self.__all_experiments_view = None  # type: Optional[pd.DataFrame]
+
+    @property
+    def all_experiments(self) -> pd.DataFrame:
+        """
+        :return: The PandasFrame containing the details of the experiments that have been leased so far, indexed by
+        their id. Experiments that have never been leased are not materialized.
+        """
+        if self.__all_experiments_view is None:
+            self.__all_experiments_view = self.__build_view(dict(self.__materialized), self.__leases.copy_state())
+        return self.__all_experiments_view
+
+    def snapshot_experiments(self) -> Callable[[], pd.DataFrame]:
+        if self.__all_experiments_view is not None:
+            view = self.__all_experiments_view
+            return lambda: view
+        materialized, lease_state = dict(self.__materialized), self.__leases.copy_state()
+        return lambda: self.__build_view(materialized, lease_state)
+
+    def __build_view(self, materialized: Dict[int, Dict[str, Any]],
+                     lease_state: Tuple[Dict[int, str], Dict[int, float], Dict[int, str], Dict[int, float]]) -> pd.DataFrame:
+        """
+        :param materialized: a copy of the materialized parameters
+        :param lease_state: a copy of the state of the lease index (see LeaseIndex.copy_state)
+        """
+        status, last_update, client, duration = lease_state
+        touched = sorted(status.keys())
+        view = pd.DataFrame([materialized[experiment_id] for experiment_id in touched], index=touched,
+                            columns=self.experiment_parameters)
+        view['status'] = [status[experiment_id] for experiment_id in touched]
+        view['last_update'] = pd.to_datetime([last_update[experiment_id] for experiment_id in touched], unit='s')
+        view['client'] = [client[experiment_id] for experiment_id in touched]
+        view['duration'] = pd.to_timedelta([duration.get(experiment_id) for experiment_id in touched], unit='s')
+        return view
+
+    @property
+    def completed_percent(self) -> float:
+        return float(self.__leases.num_done) / self.__leases.num_experiments
+
+    @property
+    def leased_percent(self) -> float:
+        return float(self.__leases.num_leased) / self.__leases.num_experiments
+
+    @property
+    def status_counts(self) -> Dict[str, int]:
+        return {self.WAITING: self.__leases.num_waiting, self.LEASED: self.__leases.num_leased,
+                self.DONE: self.__leases.num_done}
+
+    @property
+    def experiment_parameters(self) -> List[str]:
+        return self.__source.parameter_names
+
+    def __get_parameters(self, experiment_id: int) -> Dict[str, Any]:
+        if experiment_id not in self.__materialized:
+            self.__materialized[experiment_id] = self.__source.get(experiment_id)
+        return self.__materialized[experiment_id]
+
+    def lease_new(self, client_name: str) -> tuple:
+        lease = self.__leases.lease(client_name)
+        if lease is None:
+            return None
+        selected_id, is_re_lease = lease
+        if is_re_lease:
+            print("Re-leasing experiment %s since it expired" % selected_id)
+        self.__all_experiments_view = None
+        return dict(self.__get_parameters(selected_id)), selected_id
+
+    def restore_lease(self, experiment_id: int, parameters: dict, client: str) -> None:
+        if experiment_id == -1: return
+        self.__get_parameters(experiment_id)
+        self.__leases.restore_lease(experiment_id, client)
+        self.__all_experiments_view = None
+
+    def heartbeat(self, experiment_id: int, parameters: dict, client: str) -> bool:
+        if experiment_id == -1: return True
+        return self.__leases.heartbeat(experiment_id, client)
+
+    def complete(self, experiment_id: int, parameters: dict, client: str, result: float):
+        if experiment_id == -1: return
+        assert self.__get_parameters(experiment_id) == parameters, "Experiment Parameters do not match!"
+
+        if self.__leases.client(experiment_id) != client:
+            print("Experiment returned from non-leased (or expired) client")
+
+        self.__leases.complete(experiment_id, client)
+        self.__all_experiments_view = None
@@ -0,0 +1,265 @@
+import heapq
+import sys
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class AdaptiveLeaseTimeout:
+    """
+    Lease timeouts derived from the observed durations of experiments (from lease to completion). Until enough durations
+    have been observed, leases time out after max_timeout_secs. Then they time out after DURATION_SLACK times the
+    DURATION_QUANTILE of the recent durations, so that dead leases come back long before max_timeout_secs while live
+    experiments are very unlikely to be leased twice. Experiments whose clients send heartbeats time out
+    heartbeat_timeout_secs after the last heartbeat instead.
+    """
+    DURATION_QUANTILE = .95
+    DURATION_SLACK = 2.
+    # Adaptive timeouts are never shorter than this, to tolerate delays in reporting short experiments.
+    MIN_TIMEOUT_SECS = 60.
+    MIN_OBSERVED_DURATIONS = 10
+    MAX_OBSERVED_DURATIONS = 1000
+
+    def __init__(self, max_timeout_secs: float, heartbeat_timeout_secs: Optional[float]=None):
+        self.__max_timeout_secs = max_timeout_secs
+        self.__heartbeat_timeout_secs = heartbeat_timeout_secs
+        self.__durations = deque(maxlen=self.MAX_OBSERVED_DURATIONS)
+
+    def record_duration(self, duration_secs: float) -> None:
+        self.__durations.append(duration_secs)
+
+    @property
+    def num_observed_durations(self) -> int:
+        return len(self.__durations)
+
+    def duration_percentile(self, percentile: float) -> Optional[float]:
+        """
+        :return: the percentile (in [0, 100]) of the recent durations or None if no durations were observed.
+        """
+        if len(self.__durations) == 0:
+            return None
+        return float(np.percentile(self.__durations, percentile))
+
+    @property
+    def timeout_secs(self) -> float:
+        if len(self.__durations) < self.MIN_OBSERVED_DURATIONS:
+            return self.__max_timeout_secs
+        adaptive_timeout_secs = self.DURATION_SLACK * self.duration_percentile(100 * self.DURATION_QUANTILE)
+        return min(self.__max_timeout_secs, max(self.MIN_TIMEOUT_SECS, adaptive_timeout_secs))
+
+    @property
+    def heartbeat_timeout_secs(self) -> float:
+        if self.__heartbeat_timeout_secs is None:
+            return self.timeout_secs
+        return self.__heartbeat_timeout_secs
+
+
+class LeaseIndex:
+    """
+    Incremental bookkeeping of the status of a fixed number of experiments (identified by 0..num_experiments-1).
+    Waiting experiments are handed out in id order and active leases in a min-heap keyed by their expiry time, so that leasing
+    and completing an experiment does not require scanning all experiments. Lease expiry is adaptive (see
+    AdaptiveLeaseTimeout) and extended by heartbeats.
+    """
+
+    DONE = 'DONE'
+    WAITING = 'WAITING'
+    LEASED = 'LEASED'
+
+    def __init__(self, num_experiments: int, lease_duration_secs: float, heartbeat_timeout_secs: Optional[float]=None,
+                 scheduling_policy=None):
+        """
+        :param lease_duration_secs: the maximum time a lease lasts without heartbeats
+        :param heartbeat_timeout_secs: the time a lease lasts after its last heartbeat
+        :param scheduling_policy: a bound SchedulingPolicy that orders the waiting experiments. Defaults to id order.
+        """
+        self.__num_experiments = num_experiments
+        self.__timeout = AdaptiveLeaseTimeout(lease_duration_secs, heartbeat_timeout_secs)
+        self.__scheduling_policy = scheduling_policy
+
+        # Experiments with an id >= __next_untouched have never been leased and are implicitly waiting.
+        self.__next_untouched = 0
+
+        # Sparse per-experiment state, only for experiments that have been touched. Client names are interned, since
+        # few clients lease many experiments.
+        self.__status = {}  # type: Dict[int, str]
+        self.__last_update = {}  # type: Dict[int, float]
+        self.__client = {}  # type: Dict[int, str]
+        self.__lease_expiry = {}  # type: Dict[int, float]
+        self.__lease_start = {}  # type: Dict[int, float]
+        self.__duration = {}  # type: Dict[int, float]
+        self.__leases_heap = []
+
+        self.__num_leased = 0
+        self.__num_done = 0
+
+    @property
+    def num_experiments(self) -> int:
+        return self.__num_experiments
+
+    @property
+    def num_waiting(self) -> int:
+        return self.__num_experiments - self.__num_leased - self.__num_done
+
+    @property
+    def num_leased(self) -> int:
+        return self.__num_leased
+
+    @property
+    def num_done(self) -> int:
+        return self.__num_done
+
+    def status(self, experiment_id: int) -> str:
+        return self.__status.get(experiment_id, self.WAITING)
+
+    def client(self, experiment_id: int) -> str:
+        return self.__client.get(experiment_id, "")
+
+    @property
+    def timeout(self) -> AdaptiveLeaseTimeout:
+        return self.__timeout
+
+    def duration(self, experiment_id: int) -> Optional[float]:
+        """
+        :return: the seconds from the (last) lease to the completion of the experiment or None if unknown.
+        """
+        return self.__duration.get(experiment_id)
+
+    def last_update(self, experiment_id: int) -> Optional[float]:
+        """
+        :return: the unix time of the last status change of the experiment or None if it was never touched.
+        """
+        return self.__last_update.get(experiment_id)
+
+    def copy_state(self) -> Tuple[Dict[int, str], Dict[int, float], Dict[int, str], Dict[int, float]]:
+        """
+        :return: copies of the status, last update, client and duration of the touched experiments, keyed by their id.
+        Copying is much cheaper than iterating over the experiments, e.g. to build a frame of them outside of a lock.
+        """
+        return dict(self.__status), dict(self.__last_update), dict(self.__client), dict(self.__duration)
+
+    def __pop_waiting(self) -> Optional[int]:
+        if self.__scheduling_policy is not None:
+            experiment_id = self.__scheduling_policy.pop_next()
+            while experiment_id is not None and self.status(experiment_id) != self.WAITING:
+                experiment_id = self.__scheduling_policy.pop_next()
+            return experiment_id
+        while self.__next_untouched < self.__num_experiments:
+            experiment_id = self.__next_untouched
+            self.__next_untouched += 1
+            if self.status(experiment_id) == self.WAITING:
+                return experiment_id
+        return None
+
+    def __pop_expired(self, now: float) -> Optional[int]:
+        while len(self.__leases_heap) > 0:
+            expiry, experiment_id = self.__leases_heap[0]
+            if self.__lease_expiry.get(experiment_id) != expiry:
+                heapq.heappop(self.__leases_heap)  # Stale entry: the experiment was completed or re-leased
+                continue
+            if expiry >= now:
+                return None
+            heapq.heappop(self.__leases_heap)
+            return experiment_id
+        return None
+
+    def lease(self, client_name: str) -> Optional[Tuple[int, bool]]:
+        """
+        Lease the next waiting experiment, or an expired lease if no experiments are waiting.
+        :return: a tuple (experiment_id, is_re_lease) or None if nothing is available
+        """
+        now = time.time()
+        experiment_id = self.__pop_waiting()
+        is_re_lease = False
+        if experiment_id is None:
+            experiment_id = self.__pop_expired(now)
+            if experiment_id is None:
+                return None
+            is_re_lease = True
+        else:
+            self.__num_leased += 1
+
+        self.__mark_leased(experiment_id, client_name, now)
+        return experiment_id, is_re_lease
+
+    def __mark_leased(self, experiment_id: int, client_name: str, now: float) -> None:
+        self.__status[experiment_id] = self.LEASED
+        self.__last_update[experiment_id] = now
+        self.__client[experiment_id] = sys.intern(client_name)
+        self.__lease_start[experiment_id] = now
+        self.__set_expiry(experiment_id, now + self.__timeout.timeout_secs)
+
+    def __set_expiry(self, experiment_id: int, expiry: float) -> None:
+        self.__lease_expiry[experiment_id] = expiry
+        heapq.heappush(self.__leases_heap, (expiry, experiment_id))
+        self.__compact_leases_heap()
+
+    def __compact_leases_heap(self) -> None:
+        """
+        Rebuild the heap from the active leases once its stale entries (of heartbeats and completed experiments)
+        outnumber them, since they are otherwise only dropped when expired leases are popped.
+        """
+        if len(self.__leases_heap) > 2 * len(self.__lease_expiry) + 1:
+            self.__leases_heap = [(expiry, experiment_id) for experiment_id, expiry in self.__lease_expiry.items()]
+            heapq.heapify(self.__leases_heap)
+
+    def heartbeat(self, experiment_id: int, client_name: str) -> bool:
+        """
+        Extend the lease of a running experiment.
+        :return: False if the experiment is not leased to client_name (e.g. because its lease expired and it was re-leased)
+        """
+        if self.status(experiment_id) != self.LEASED or self.__client[experiment_id] != client_name:
+            return False
+        self.__set_expiry(experiment_id, time.time() + self.__timeout.heartbeat_timeout_secs)
+        return True
+
+    def restore_lease(self, experiment_id: int, client_name: str) -> None:
+        """
+        Mark a specific experiment as leased, e.g. when replaying a journal. The lease starts now.
+        """
+        status = self.status(experiment_id)
+        if status == self.DONE:
+            return
+        elif status == self.WAITING:
+            self.__num_leased += 1
+        self.__mark_leased(experiment_id, client_name, time.time())
+
+    def restore_status(self, experiment_id: int, status: str, client_name: str, last_update: float) -> None:
+        """
+        Set the status of a waiting experiment as of the unix time last_update, e.g. when migrating the state of a queue
+        that did not keep a lease index. A leased experiment is leased at last_update, so its lease expires as it would
+        have in that queue.
+        """
+        assert self.status(experiment_id) == self.WAITING, "Experiment %s is not waiting" % experiment_id
+        if status == self.LEASED:
+            self.__num_leased += 1
+            self.__mark_leased(experiment_id, client_name, last_update)
+        elif status == self.DONE:
+            self.__num_done += 1
+            self.__status[experiment_id] = self.DONE
+            self.__last_update[experiment_id] = last_update
+            self.__client[experiment_id] = sys.intern(client_name)
+
+    def complete(self, experiment_id: int, client_name: str) -> None:
+        now = time.time()
+        status = self.status(experiment_id)
+        if status == self.DONE:
+            pass
+        elif status == self.LEASED:
+            self.__num_leased -= 1
+            self.__num_done += 1
+            if self.__client[experiment_id] == client_name:
+                self.__duration[experiment_id] = now - self.__lease_start[experiment_id]
+                self.__timeout.record_duration(self.__duration[experiment_id])
+                if self.__scheduling_policy is not None:
+                    self.__scheduling_policy.record_duration(experiment_id, self.__duration[experiment_id])
+        else:
+            self.__num_done += 1
+        self.__lease_expiry.pop(experiment_id, None)
+        self.__lease_start.pop(experiment_id, None)
+        self.__compact_leases_heap()
+        self.__status[experiment_id] = self.DONE
+        self.__last_update[experiment_id] = now
+        self.__client[experiment_id] = sys.intern(client_name)
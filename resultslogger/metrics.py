@@ -0,0 +1,207 @@
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+# The default buckets of latency histograms, in seconds.
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30.)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if len(labels) == 0:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+class _Metric:
+    def __init__(self, name: str, documentation: str, metric_type: str):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+
+    def samples(self) -> List[Tuple[str, Tuple[Tuple[str, str], ...], float]]:
+        raise NotImplemented('Abstract Class')
+
+
+class Counter(_Metric):
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation, 'counter')
+        self.__values = {}  # type: Dict[Tuple[Tuple[str, str], ...], float]
+
+    def inc(self, amount: float=1., **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        self.__values[key] = self.__values.get(key, 0.) + amount
+
+    def samples(self):
+        return [(self.name + '_total', labels, value) for labels, value in self.__values.items()]
+
+
+class Gauge(_Metric):
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation, 'gauge')
+        self.__values = {}  # type: Dict[Tuple[Tuple[str, str], ...], float]
+
+    def set(self, value: float, **labels) -> None:
+        self.__values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        return [(self.name, labels, value) for labels, value in self.__values.items()]
+
+
+class Histogram(_Metric):
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...]=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, 'histogram')
+        self.__buckets = tuple(sorted(buckets))
+        # Per label set: the (non-cumulative) count of each bucket and +Inf, and the sum of the observations
+        self.__values = {}  # type: Dict[Tuple[Tuple[str, str], ...], Tuple[List[int], List[float]]]
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        if key not in self.__values:
+            self.__values[key] = [0] * (len(self.__buckets) + 1), [0.]
+        counts, total = self.__values[key]
+        bucket = 0
+        while bucket < len(self.__buckets) and value > self.__buckets[bucket]:
+            bucket += 1
+        counts[bucket] += 1
+        total[0] += value
+
+    def samples(self):
+        samples = []
+        for labels, (counts, total) in self.__values.items():
+            cumulative = 0
+            for upper_bound, count in zip(self.__buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + (('le', '%g' % upper_bound if upper_bound != float('inf') else '+Inf'),), cumulative))
+            samples.append((self.name + '_sum', labels, total[0]))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    A set of metrics that can be rendered in the Prometheus text exposition format. Updates and rendering are
+    serialized on a lock.
+    """
+    def __init__(self):
+        self.__metrics = {}  # type: Dict[str, _Metric]
+        self.__lock = threading.Lock()
+
+    def __get_or_create(self, metric_class, name: str, documentation: str, **kwargs):
+        if name not in self.__metrics:
+            self.__metrics[name] = metric_class(name, documentation, **kwargs)
+        return self.__metrics[name]
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.__get_or_create(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self.__get_or_create(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...]=DEFAULT_BUCKETS) -> Histogram:
+        return self.__get_or_create(Histogram, name, documentation, buckets=buckets)
+
+    def inc(self, name: str, documentation: str, amount: float=1., **labels) -> None:
+        with self.__lock:
+            self.counter(name, documentation).inc(amount, **labels)
+
+    def set(self, name: str, documentation: str, value: float, **labels) -> None:
+        with self.__lock:
+            self.gauge(name, documentation).set(value, **labels)
+
+    def observe(self, name: str, documentation: str, value: float, **labels) -> None:
+        with self.__lock:
+            self.histogram(name, documentation).observe(value, **labels)
+
+    @contextmanager
+    def time(self, name: str, documentation: str, **labels):
+        """
+        Observe the duration of the with-block in the histogram name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, documentation, time.perf_counter() - start, **labels)
+
+    def render(self) -> str:
+        lines = []
+        with self.__lock:
+            for name in sorted(self.__metrics):
+                metric = self.__metrics[name]
+                lines.append('# HELP %s %s' % (name, metric.documentation))
+                lines.append('# TYPE %s %s' % (name, metric.metric_type))
+                for sample_name, labels, value in metric.samples():
+                    lines.append('%s%s %r' % (sample_name, _format_labels(labels), float(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """
+    Profile a random sample of requests with cProfile and accumulate the statistics. The sampling rate can be changed
+    at runtime; a rate of 0 disables profiling. Profiles are not collected for concurrent requests, since only one
+    profiler can be active per process.
+    """
+    def __init__(self, sampling_rate: float=0.):
+        self.__sampling_rate = sampling_rate
+        self.__stats = None  # type: Optional[pstats.Stats]
+        self.__num_profiled = 0
+        self.__active = threading.Lock()
+        self.__lock = threading.Lock()
+
+    @property
+    def sampling_rate(self) -> float:
+        return self.__sampling_rate
+
+    @sampling_rate.setter
+    def sampling_rate(self, sampling_rate: float) -> None:
+        self.__sampling_rate = sampling_rate
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """
+        :return: a running profiler if this request is sampled, None otherwise.
+        """
+        if self.__sampling_rate <= 0 or random.random() >= self.__sampling_rate:
+            return None
+        if not self.__active.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Another profiler is active in this process
+            self.__active.release()
+            return None
+        return profiler
+
+    def stop(self, profiler: cProfile.Profile) -> None:
+        profiler.disable()
+        self.__active.release()
+        with self.__lock:
+            if self.__stats is None:
+                self.__stats = pstats.Stats(profiler)
+            else:
+                self.__stats.add(profiler)
+            self.__num_profiled += 1
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__stats = None
+            self.__num_profiled = 0
+
+    def report(self, sort_by: str='cumulative', num_lines: int=50) -> str:
+        """
+        :return: the accumulated statistics of the profiled requests, as printed by pstats.
+        """
+        with self.__lock:
+            if self.__stats is None:
+                return 'No requests profiled (sampling rate %s)\n' % self.__sampling_rate
+            output = io.StringIO()
+            self.__stats.stream = output
+            output.write('%d requests profiled (sampling rate %s)\n' % (self.__num_profiled, self.__sampling_rate))
+            self.__stats.sort_stats(sort_by).print_stats(num_lines)
+            return output.getvalue()
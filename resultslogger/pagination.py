@@ -0,0 +1,86 @@
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from resultslogger.constants import ResultLoggerConstants
+
+
+def parse_filters(filter_args: List[str]) -> Dict[str, str]:
+    """
+    Parse filters of the form column:value
+    """
+    filters = {}
+    for filter_arg in filter_args:
+        column, _, value = filter_arg.partition(':')
+        filters[column] = value
+    return filters
+
+
+def paginate_frame(frame: pd.DataFrame, limit: int, offset: int=0, sort_by: Optional[str]=None,
+                   ascending: bool=True, filters: Optional[Dict[str, str]]=None) -> Tuple[int, pd.DataFrame]:
+    """
+    Filter, sort and slice a frame.
+    :param filters: a dict from column names to the (string representation) of the values to keep
+    :return: a tuple (total number of rows after filtering, the rows in [offset, offset+limit))
+    """
+    if filters:
+        mask = pd.Series(True, index=frame.index)
+        for column, value in filters.items():
+            if column not in frame.columns:
+                raise KeyError('Unknown filter column %s' % column)
+            mask &= frame[column].astype(str) == value
+        frame = frame[mask]
+    if sort_by is not None:
+        if sort_by not in frame.columns:
+            raise KeyError('Unknown sort column %s' % sort_by)
+        frame = frame.sort_values(sort_by, ascending=ascending, kind='mergesort')
+    return len(frame), frame.iloc[offset:offset + limit]
+
+
+def _non_negative_int(args, name: str, default: int) -> int:
+    value = args.get(name, default)
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError('The %s must be an integer, not %s' % (name, value))
+    if value < 0:
+        raise ValueError('The %s must not be negative' % name)
+    return value
+
+
+def page_arguments(args) -> Tuple[int, int, Optional[str], bool, Dict[str, str]]:
+    """
+    :param args: the request arguments (a werkzeug MultiDict)
+    :return: a tuple (limit, offset, sort_by, ascending, filters) of the limit, offset, sort, ascending and filter
+    request arguments. Raises ValueError if the limit or the offset is not a non-negative integer.
+    """
+    limit = min(_non_negative_int(args, ResultLoggerConstants.FIELD_LIMIT, ResultLoggerConstants.DEFAULT_PAGE_SIZE),
+                ResultLoggerConstants.MAX_PAGE_SIZE)
+    offset = _non_negative_int(args, ResultLoggerConstants.FIELD_OFFSET, 0)
+    return limit, offset, args.get(ResultLoggerConstants.FIELD_SORT), \
+        args.get(ResultLoggerConstants.FIELD_ASCENDING, '1') != '0', \
+        parse_filters(args.getlist(ResultLoggerConstants.FIELD_FILTER))
+
+
+def page_json(total: int, offset: int, limit: int, page: pd.DataFrame) -> str:
+    """
+    :return: the page as JSON. Timedelta columns (e.g. the durations of the experiments) are in seconds.
+    """
+    timedelta_columns = [c for c in page.columns if pd.api.types.is_timedelta64_dtype(page[c])]
+    if len(timedelta_columns) > 0:
+        page = page.copy()
+        for column in timedelta_columns:
+            page[column] = page[column].dt.total_seconds()
+    return '{"total": %d, "offset": %d, "limit": %d, "page": %s}' % (
+        total, offset, limit, page.to_json(orient='split', date_format='iso'))
+
+
+def paginated_json(frame: pd.DataFrame, args) -> str:
+    """
+    A page of the frame as JSON, as selected by the limit, offset, sort, ascending and filter request arguments.
+    :param args: the request arguments (a werkzeug MultiDict)
+    Raises KeyError for unknown sort or filter columns and ValueError for invalid limits or offsets.
+    """
+    limit, offset, sort_by, ascending, filters = page_arguments(args)
+    total, page = paginate_frame(frame, limit, offset, sort_by=sort_by, ascending=ascending, filters=filters)
+    return page_json(total, offset, limit, page)
@@ -0,0 +1,88 @@
+import bisect
+from typing import Any, Dict, Hashable, List, Set
+
+
+class Pruner:
+    """
+    Decides whether a running experiment should continue, given the intermediate results that it reported (e.g. the
+    validation loss after each epoch). As with the minimized-value of the results, lower values are better.
+    """
+
+    def report(self, experiment: Hashable, step: float, value: float) -> bool:
+        """
+        Record an intermediate result of an experiment.
+        :param experiment: an identifier of the experiment (e.g. its id)
+        :param step: the checkpoint of the result (e.g. the epoch). Steps increase during an experiment.
+        :return: True if the experiment should continue, False if it should stop
+        """
+        raise NotImplemented('Abstract Class')
+
+    def forget(self, experiment: Hashable) -> None:
+        """
+        Forget the intermediate results of an experiment and whether it was stopped, e.g. because it is run again after
+        its lease expired. Its next report is treated as the report of a new experiment.
+        """
+        pass
+
+
+class SuccessiveHalvingPruner(Pruner):
+    """
+    Asynchronous successive halving (ASHA). Rung k is at step min_step * reduction_factor^(min_early_stopping_rate + k).
+    When an experiment reaches a rung, its intermediate value is compared to the values of all the experiments that
+    reached the same rung so far and it continues only if it is in their best 1/reduction_factor. Until a rung has
+    reduction_factor values, an experiment continues only if it is the best at the rung.
+
+    Since experiments are never paused, each rung is decided when an experiment reaches it, without waiting for the
+    other experiments (as in Li et al., "A System for Massively Parallel Hyperparameter Tuning", 2020).
+    """
+    def __init__(self, min_step: float=1, reduction_factor: int=3, min_early_stopping_rate: int=0):
+        """
+        :param min_step: the step of the first rung (before it, no experiment is stopped)
+        :param reduction_factor: the inverse of the fraction of experiments that continue at each rung
+        :param min_early_stopping_rate: skip this many rungs at the start
+        """
+        assert min_step > 0 and reduction_factor >= 2 and min_early_stopping_rate >= 0
+        self.__min_step = min_step
+        self.__reduction_factor = reduction_factor
+        self.__min_early_stopping_rate = min_early_stopping_rate
+        # The sorted values of the experiments that reached each rung
+        self.__rung_values = []  # type: List[List[float]]
+        # The value of each experiment at each rung it reached
+        self.__experiment_values = {}  # type: Dict[Any, List[float]]
+        self.__stopped = set()  # type: Set[Any]
+
+    def rung_step(self, rung: int) -> float:
+        return self.__min_step * self.__reduction_factor ** (self.__min_early_stopping_rate + rung)
+
+    @property
+    def rung_sizes(self) -> List[int]:
+        """
+        :return: the number of experiments that reached each rung
+        """
+        return [len(values) for values in self.__rung_values]
+
+    def report(self, experiment: Hashable, step: float, value: float) -> bool:
+        if experiment in self.__stopped:
+            return False
+        experiment_values = self.__experiment_values.setdefault(experiment, [])
+        rung = len(experiment_values)
+        while step >= self.rung_step(rung):
+            if rung == len(self.__rung_values):
+                self.__rung_values.append([])
+            bisect.insort(self.__rung_values[rung], value)
+            experiment_values.append(value)
+            if not self.__is_promotable(value, self.__rung_values[rung]):
+                self.__stopped.add(experiment)
+                return False
+            rung += 1
+        return True
+
+    def forget(self, experiment: Hashable) -> None:
+        self.__stopped.discard(experiment)
+        for rung, value in enumerate(self.__experiment_values.pop(experiment, [])):
+            rung_values = self.__rung_values[rung]
+            del rung_values[bisect.bisect_left(rung_values, value)]
+
+    def __is_promotable(self, value: float, sorted_competing_values: List[float]) -> bool:
+        num_promoted = max(len(sorted_competing_values) // self.__reduction_factor, 1)
+        return value <= sorted_competing_values[num_promoted - 1]
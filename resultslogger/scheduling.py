@@ -0,0 +1,199 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class SchedulingPolicy:
+    """
+    Decides the order in which the waiting experiments of a queue are leased. Experiments are identified by their row
+    in the frame of parameters that the policy is bound to. Each experiment is returned by pop_next at most once; the
+    queue skips experiments that are not waiting any more (e.g. restored leases).
+    """
+
+    def bind(self, parameters: pd.DataFrame) -> None:
+        """
+        Called once by the queue with the parameters of all its experiments.
+        """
+        raise NotImplemented('Abstract Class')
+
+    def pop_next(self) -> Optional[int]:
+        """
+        :return: the next experiment to lease or None if all experiments have been returned.
+        """
+        raise NotImplemented('Abstract Class')
+
+    def record_duration(self, experiment_id: int, duration_secs: float) -> None:
+        """
+        Called when an experiment completes, with the time from its lease to its completion.
+        """
+        pass
+
+
+class PriorityPolicy(SchedulingPolicy):
+    """
+    Lease experiments in decreasing order of a priority column of the experiments. Ties are leased in row order.
+    """
+    def __init__(self, priority_column: str, ascending: bool=False):
+        """
+        :param ascending: lease experiments with the lowest priority value first instead.
+        """
+        self.__priority_column = priority_column
+        self.__ascending = ascending
+        self.__order = np.zeros(0, dtype=np.int64)
+        self.__next = 0
+
+    def bind(self, parameters: pd.DataFrame) -> None:
+        if self.__priority_column not in parameters.columns:
+            raise KeyError('Unknown priority column %s' % self.__priority_column)
+        priorities = parameters[self.__priority_column].to_numpy()
+        self.__order = np.argsort(priorities if self.__ascending else -priorities, kind='stable')
+        self.__next = 0
+
+    def pop_next(self) -> Optional[int]:
+        if self.__next >= len(self.__order):
+            return None
+        self.__next += 1
+        return int(self.__order[self.__next - 1])
+
+
+class LongestExpectedFirstPolicy(SchedulingPolicy):
+    """
+    Lease the experiments that are expected to take the longest first, so that the sweep does not end waiting for a few
+    long experiments that started last. The expected duration comes from an additive model of the log-duration: each
+    value of each parameter adds (or removes) a constant, estimated from the completed experiments. Until
+    MIN_DURATIONS_TO_FIT durations are known, experiments are leased in a (seeded) random order, so that the model sees
+    many parameter values early.
+
+    The remaining experiments are re-ordered when the number of known durations has grown by REFIT_GROWTH since the
+    last fit, so that refitting costs O(number of experiments * log(number of durations)) overall.
+    """
+    MIN_DURATIONS_TO_FIT = 10
+    REFIT_GROWTH = 1.5
+    # Backfitting iterations of the additive model
+    NUM_FIT_ITERATIONS = 5
+
+    def __init__(self, cost_columns: Optional[List[str]]=None, seed: int=0):
+        """
+        :param cost_columns: the parameters that affect the duration of an experiment. Defaults to all parameters.
+        :param seed: the seed of the initial random order
+        """
+        self.__cost_columns = cost_columns
+        self.__seed = seed
+        self.__parameters = None  # type: Optional[pd.DataFrame]
+        self.__popped = np.zeros(0, dtype=bool)
+        self.__order = np.zeros(0, dtype=np.int64)
+        self.__next = 0
+        self.__durations = {}  # type: Dict[int, float]
+        self.__num_durations_at_fit = 0
+
+    def bind(self, parameters: pd.DataFrame) -> None:
+        if self.__cost_columns is None:
+            self.__cost_columns = list(parameters.columns)
+        self.__parameters = parameters[self.__cost_columns]
+        self.__popped = np.zeros(len(parameters), dtype=bool)
+        self.__order = np.random.RandomState(self.__seed).permutation(len(parameters))
+        self.__next = 0
+
+    def pop_next(self) -> Optional[int]:
+        while self.__next < len(self.__order):
+            experiment_id = int(self.__order[self.__next])
+            self.__next += 1
+            if not self.__popped[experiment_id]:
+                self.__popped[experiment_id] = True
+                return experiment_id
+        return None
+
+    def record_duration(self, experiment_id: int, duration_secs: float) -> None:
+        self.__durations[experiment_id] = duration_secs
+        num_durations = len(self.__durations)
+        if num_durations >= self.MIN_DURATIONS_TO_FIT and num_durations >= self.REFIT_GROWTH * self.__num_durations_at_fit:
+            self.__reorder()
+
+    def expected_log_durations(self) -> pd.Series:
+        """
+        :return: the expected log-duration of each experiment under the model fitted on the known durations.
+        """
+        completed = list(self.__durations.keys())
+        log_durations = np.log(np.maximum(np.array(list(self.__durations.values())), 1e-6))
+        completed_parameters = self.__parameters.iloc[completed]
+
+        intercept = log_durations.mean()
+        effects = {c: pd.Series(dtype=float) for c in self.__cost_columns}
+        for _ in range(self.NUM_FIT_ITERATIONS):
+            for column in self.__cost_columns:
+                others = sum((completed_parameters[c].map(effects[c]).fillna(0.).to_numpy()
+                              for c in self.__cost_columns if c != column), np.zeros(len(completed)))
+                residuals = pd.Series(log_durations - intercept - others, index=completed_parameters.index)
+                effects[column] = residuals.groupby(completed_parameters[column].to_numpy()).mean()
+
+        expected = np.full(len(self.__parameters), intercept)
+        for column in self.__cost_columns:
+            expected += self.__parameters[column].map(effects[column]).fillna(0.).to_numpy()
+        return pd.Series(expected, index=self.__parameters.index)
+
+    def __reorder(self) -> None:
+        self.__num_durations_at_fit = len(self.__durations)
+        remaining = np.flatnonzero(~self.__popped)
+        expected = self.expected_log_durations().to_numpy()[remaining]
+        self.__order = remaining[np.argsort(-expected, kind='stable')]
+        self.__next = 0
+
+
+class FairSharePolicy(SchedulingPolicy):
+    """
+    Share the workers between groups of experiments (e.g. the sub-sweeps of different users or teams, as given by a
+    column of the experiments). Each lease goes to the group that has used the least worker time relative to its share,
+    counting the mean observed duration of the group's experiments for each lease (or 1 if none is known). Within a
+    group, experiments are leased in row order.
+    """
+    def __init__(self, group_column: str, shares: Optional[Dict[str, float]]=None):
+        """
+        :param shares: the relative share of each group. Groups that are not in shares have a share of 1.
+        """
+        self.__group_column = group_column
+        self.__shares = shares if shares is not None else {}
+        self.__group_of = np.zeros(0, dtype=np.int64)
+        self.__groups = []  # type: List
+        self.__members = []  # type: List[np.ndarray]
+        self.__next = []  # type: List[int]
+        self.__usage = []  # type: List[float]
+        self.__total_duration = []  # type: List[float]
+        self.__num_durations = []  # type: List[int]
+
+    def bind(self, parameters: pd.DataFrame) -> None:
+        if self.__group_column not in parameters.columns:
+            raise KeyError('Unknown group column %s' % self.__group_column)
+        codes, self.__groups = pd.factorize(parameters[self.__group_column])
+        self.__group_of = codes
+        self.__members = [np.flatnonzero(codes == i) for i in range(len(self.__groups))]
+        self.__next = [0] * len(self.__groups)
+        self.__usage = [0.] * len(self.__groups)
+        self.__total_duration = [0.] * len(self.__groups)
+        self.__num_durations = [0] * len(self.__groups)
+
+    @property
+    def usage(self) -> Dict:
+        """
+        :return: the worker time used by each group so far (in seconds, once durations are known)
+        """
+        return dict(zip(self.__groups, self.__usage))
+
+    def __expected_duration(self, group: int) -> float:
+        if self.__num_durations[group] == 0:
+            return 1.
+        return self.__total_duration[group] / self.__num_durations[group]
+
+    def pop_next(self) -> Optional[int]:
+        candidate_groups = [g for g in range(len(self.__groups)) if self.__next[g] < len(self.__members[g])]
+        if len(candidate_groups) == 0:
+            return None
+        group = min(candidate_groups, key=lambda g: self.__usage[g] / self.__shares.get(self.__groups[g], 1.))
+        self.__usage[group] += self.__expected_duration(group)
+        self.__next[group] += 1
+        return int(self.__members[group][self.__next[group] - 1])
+
+    def record_duration(self, experiment_id: int, duration_secs: float) -> None:
+        group = self.__group_of[experiment_id]
+        self.__total_duration[group] += duration_secs
+        self.__num_durations[group] += 1
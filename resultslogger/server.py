@@ -1,36 +1,112 @@
 import json
+import math
 import os
 import sys
 import pickle
+import threading
+import time
+from contextlib import nullcontext
+from typing import Optional
 
-from flask import Flask, request, make_response
+from flask import Flask, Response, request, jsonify, abort, g
 import pystache
 
+from resultslogger.backends import available_backends, create_backend
 from resultslogger.constants import ResultLoggerConstants
 from resultslogger.experimentlogger import ExperimentLogger
-from resultslogger.experimentqueue import ExperimentQueue, CsvExperimentQueue
-from resultslogger.bayesoptqueue import BayesianOptimizedExperimentQueue
+from resultslogger.experimentqueue import ExperimentQueue
+from resultslogger.export import csv_chunks, gzip_chunks, columnar_chunks
+from resultslogger.journal import ExperimentJournal
+from resultslogger.metrics import MetricsRegistry, RequestProfiler
+from resultslogger.pagination import page_arguments, page_json, paginated_json
+from resultslogger.sqlitestore import SqliteResultCache
 
 
 def load_template(relative_filename: str):
     with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), relative_filename)) as f:
         return pystache.parse(f.read())
 
+
+def get_groupby_links(parameter_names: list, current_parameters: set) -> list:
+    """The group, by links are incremental, toggle-like"""
+    def get_parameters(name_of_param)-> tuple:
+        active = name_of_param in current_parameters
+        if active:
+            params_to_use = current_parameters - {name_of_param}
+            if len(params_to_use) > 0:
+                return ','.join(params_to_use)
+            else:
+                return ','.join(current_parameters)
+        else:
+            return ','.join(current_parameters | {name_of_param})
+    return [{'name': n, 'link': get_parameters(n), 'active': n in current_parameters} for n in parameter_names]
+
+
 class ResultsLoggerServer:
 
     PAGE_TEMPLATE = load_template("resources/page.mustache")
 
+    QUEUE_OPERATION_METRIC = 'resultslogger_queue_operation_seconds'
+    QUEUE_OPERATION_DOC = 'Time spent in queue and logger operations'
+
+    # Complete at most this many leased experiments from the result cache in a single lease (or fewer, if the queue
+    # limits them, see ExperimentQueue.max_cache_hits_per_lease). The next leased experiment is then returned even if it
+    # is cached. A leased experiment is also returned if the queue suggests parameters that were already completed from
+    # the cache in the same lease, as an optimizing queue may repeat itself.
+    MAX_CACHE_HITS_PER_LEASE = 1000
+
     def __init__(self, experiment_name: str, queue: ExperimentQueue,
                  autosave_path: str='.',  experiment_logger: ExperimentLogger=None,
-                 allow_unsolicited_results: bool=True):
+                 allow_unsolicited_results: bool=True, snapshot_every: int=1000, journal_fsync_every: int=32,
+                 profile_sampling_rate: float=0., result_cache: SqliteResultCache=None, journal_replayed: bool=False):
         """
 
         :param autosave_path: the path where to autosave the results
         :param lease_timout_secs: the number of secs that a lease times out. Defaults to 2 days
         :param allow_unsolicited_results: allow clients to report results about experiments that are not in the queue/have been leased.
+        :param snapshot_every: the number of journaled events after which a compacted snapshot is saved.
+        :param journal_fsync_every: the number of journaled events after which the journal is fsynced.
+        :param profile_sampling_rate: the fraction of requests to profile with cProfile. It can be changed at runtime
+        through the /metrics/profile route.
+        :param result_cache: a cache of the results of previously run experiments (possibly of other experiment names).
+        Leased experiments whose parameters are in the cache are completed with the cached results instead of being
+        returned to the client, and stored results are added to the cache, except those of experiments that were told to
+        stop (e.g. by a pruner), since they are partial.
+        :param journal_replayed: whether the queue and the logger already include the events of the journal in
+        autosave_path (as in load()). Otherwise the server refuses to start over a journal with events, since its
+        initial snapshot would discard them.
         """
         self.__app = Flask(__name__)
         self.__queue = queue
+        self.__result_cache = result_cache
+        # The cache keys of the experiments that were told to stop and whose (partial) results were not stored yet
+        self.__stopped_experiments = set()
+        # Guards the queue, the logger and the journal. Handlers take snapshots (e.g. of all_results) under it and render
+        # them outside of it.
+        self.__lock = threading.RLock()
+        self.__metrics = MetricsRegistry()
+        self.__profiler = RequestProfiler(profile_sampling_rate)
+
+        @self.__app.before_request
+        def start_request_metrics():
+            g.request_start = time.perf_counter()
+            g.profiler = self.__profiler.start()
+
+        @self.__app.after_request
+        def record_request_metrics(response):
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            self.__metrics.observe('resultslogger_request_seconds',
+                                   'Time to handle a request (streamed responses excluded)',
+                                   time.perf_counter() - g.request_start, route=route, method=request.method)
+            self.__metrics.inc('resultslogger_requests', 'Number of requests', route=route, method=request.method,
+                               status=response.status_code)
+            return response
+
+        @self.__app.teardown_request
+        def stop_request_profiler(exception):
+            profiler = g.pop('profiler', None)
+            if profiler is not None:
+                self.__profiler.stop(profiler)
 
         self.__renderer = pystache.Renderer()
         self.__experiment_name = experiment_name
@@ -38,12 +114,24 @@ class ResultsLoggerServer:
         @self.__app.route(ResultLoggerConstants.ROUTE_LEASE_EXPERIMENT, methods=['POST'])
         def lease_next_experiment():
            client = request.form[ResultLoggerConstants.FIELD_CLIENT]
-           next_lease = self.__queue.lease_new(client)
+           next_lease = self.__lease(client)
            if next_lease is None:
                return ResultLoggerConstants.END
            params, experiment_id = next_lease
            return json.dumps(dict(parameters=params, experiment_id=experiment_id))
 
+        @self.__app.route(ResultLoggerConstants.ROUTE_LEASE_EXPERIMENTS_BATCH, methods=['POST'])
+        def lease_experiments_batch():
+            client = request.form[ResultLoggerConstants.FIELD_CLIENT]
+            num_experiments = int(request.form[ResultLoggerConstants.FIELD_NUM_EXPERIMENTS])
+            leased = []
+            for _ in range(num_experiments):
+                next_lease = self.__lease(client)
+                if next_lease is None:
+                    break
+                params, experiment_id = next_lease
+                leased.append(dict(parameters=params, experiment_id=experiment_id))
+            return json.dumps(leased)
 
         @self.__app.route(ResultLoggerConstants.ROUTE_STORE_EXPERIMENT, methods=['POST'])
         def store_experiment():
@@ -51,61 +139,219 @@ class ResultsLoggerServer:
             experiment_parameters = request.form[ResultLoggerConstants.FIELD_PARAMETERS]
             results = request.form[ResultLoggerConstants.FIELD_RESULTS]
             experiment_id = request.form[ResultLoggerConstants.FIELD_EXPERIMENT_ID]
-            parameters = json.loads(experiment_parameters)
-            results = json.loads(results)
-            self.__logger.log_experiment(parameters, results)
-            experiment_id = int(experiment_id)
-            if experiment_id == -1 and not self.__allow_unsolicited_results:
-                assert False, "Unsolicited experiment returned"
-            else:
-                self.__queue.complete(experiment_id, parameters, client,
-                 results[ResultLoggerConstants.BASE_RESULT_FIELD] if ResultLoggerConstants.BASE_RESULT_FIELD in results else 0.)
-            self.autosave()
+            self.__store(client, int(experiment_id), json.loads(experiment_parameters), json.loads(results))
+            return ResultLoggerConstants.OK
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_STORE_EXPERIMENTS_BATCH, methods=['POST'])
+        def store_experiments_batch():
+            client = request.form[ResultLoggerConstants.FIELD_CLIENT]
+            experiments = json.loads(request.form[ResultLoggerConstants.FIELD_EXPERIMENTS])
+            for experiment in experiments:
+                self.__store(client, int(experiment[ResultLoggerConstants.FIELD_EXPERIMENT_ID]),
+                             experiment[ResultLoggerConstants.FIELD_PARAMETERS],
+                             experiment[ResultLoggerConstants.FIELD_RESULTS])
             return ResultLoggerConstants.OK
 
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_LEASE, methods=['POST'])
+        def api_lease():
+            payload = request.get_json(force=True)
+            client = payload[ResultLoggerConstants.FIELD_CLIENT]
+            leased = []
+            for _ in range(int(payload.get(ResultLoggerConstants.FIELD_NUM_EXPERIMENTS, 1))):
+                next_lease = self.__lease(client)
+                if next_lease is None:
+                    break
+                params, experiment_id = next_lease
+                leased.append(dict(parameters=params, experiment_id=experiment_id))
+            return jsonify({ResultLoggerConstants.FIELD_EXPERIMENTS: leased})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_STORE, methods=['POST'])
+        def api_store():
+            payload = request.get_json(force=True)
+            client = payload[ResultLoggerConstants.FIELD_CLIENT]
+            for experiment in payload[ResultLoggerConstants.FIELD_EXPERIMENTS]:
+                self.__store(client, int(experiment[ResultLoggerConstants.FIELD_EXPERIMENT_ID]),
+                             experiment[ResultLoggerConstants.FIELD_PARAMETERS],
+                             experiment[ResultLoggerConstants.FIELD_RESULTS])
+            return jsonify({'status': ResultLoggerConstants.OK})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_HEARTBEAT, methods=['POST'])
+        def api_heartbeat():
+            """
+            Extend the leases of running experiments. Replies whether each experiment is still leased to the client.
+            """
+            payload = request.get_json(force=True)
+            client = payload[ResultLoggerConstants.FIELD_CLIENT]
+            with self.__lock, self.__metrics.time(self.QUEUE_OPERATION_METRIC, self.QUEUE_OPERATION_DOC,
+                                                  operation='heartbeat'):
+                leased = [self.__queue.heartbeat(int(experiment[ResultLoggerConstants.FIELD_EXPERIMENT_ID]),
+                                                 experiment[ResultLoggerConstants.FIELD_PARAMETERS], client)
+                          for experiment in payload[ResultLoggerConstants.FIELD_EXPERIMENTS]]
+            return jsonify({ResultLoggerConstants.FIELD_LEASED: leased})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_REPORT, methods=['POST'])
+        def api_report():
+            """
+            Record intermediate results of running experiments (e.g. after each epoch). Replies whether each experiment
+            should continue. Stopped experiments should store their results so far.
+            """
+            payload = request.get_json(force=True)
+            client = payload[ResultLoggerConstants.FIELD_CLIENT]
+            experiments = payload[ResultLoggerConstants.FIELD_EXPERIMENTS]
+            for experiment in experiments:
+                for field in (ResultLoggerConstants.FIELD_STEP, ResultLoggerConstants.FIELD_VALUE):
+                    try:
+                        value = float(experiment[field])
+                    except (TypeError, ValueError):
+                        abort(400, 'The %s of an intermediate result must be a number' % field)
+                    if not math.isfinite(value):
+                        abort(400, 'The %s of an intermediate result must be finite' % field)
+            with self.__lock, self.__metrics.time(self.QUEUE_OPERATION_METRIC, self.QUEUE_OPERATION_DOC,
+                                                  operation='report'):
+                decisions = [self.__queue.report(int(experiment[ResultLoggerConstants.FIELD_EXPERIMENT_ID]),
+                                                 experiment[ResultLoggerConstants.FIELD_PARAMETERS], client,
+                                                 float(experiment[ResultLoggerConstants.FIELD_STEP]),
+                                                 float(experiment[ResultLoggerConstants.FIELD_VALUE]))
+                             for experiment in experiments]
+                if self.__result_cache is not None:
+                    for experiment, should_continue in zip(experiments, decisions):
+                        if not should_continue:
+                            self.__stopped_experiments.add(
+                                self.__result_cache.key(experiment[ResultLoggerConstants.FIELD_PARAMETERS]))
+            num_stopped = decisions.count(False)
+            if num_stopped > 0:
+                self.__metrics.inc('resultslogger_stopped_experiments', 'Running experiments that were told to stop',
+                                   num_stopped)
+            return jsonify({ResultLoggerConstants.FIELD_CONTINUE: decisions})
+
         @self.__app.route(ResultLoggerConstants.ROUTE_EXPERIMENTS_ALL_RESULTS)
         def show_results_html():
             return self.__renderer.render(self.PAGE_TEMPLATE,
                                           {'title': 'All Results',
                                            'experiment_name' : self.__experiment_name,
-                                           'body': self.__pandas_to_html_table(self.__logger.all_results),
+                                           'api_url': ResultLoggerConstants.ROUTE_API_RESULTS,
+                                           'page_size': ResultLoggerConstants.DEFAULT_PAGE_SIZE,
                                            'summary_links': self.__get_groupby_links(set()),
                                            'in_results': True})
 
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_RESULTS)
+        def api_results():
+            with self.__lock:
+                all_results = self.__logger.all_results
+            return self.__paginated_json(all_results)
+
         @self.__app.route(ResultLoggerConstants.ROUTE_CSV_DUMP)
         def download_csv():
-            response = make_response(self.__logger.all_results.to_csv())
+            """
+            Stream all the results. The format argument may be csv (default), parquet or arrow and csv may be gzipped
+            with compression=gzip.
+            """
+            with self.__lock:
+                all_results = self.__logger.all_results
+            file_format = request.args.get(ResultLoggerConstants.FIELD_FORMAT, 'csv')
+            if file_format == 'csv':
+                chunks = csv_chunks(all_results)
+                extension = '.csv'
+                if request.args.get(ResultLoggerConstants.FIELD_COMPRESSION) == 'gzip':
+                    chunks = gzip_chunks(chunks)
+                    extension += '.gz'
+            elif file_format in ('parquet', 'arrow'):
+                chunks = columnar_chunks(all_results, file_format)
+                extension = '.' + file_format
+            else:
+                abort(400, 'Unrecognized format %s' % file_format)
+
+            response = Response(chunks)
             response.headers['Content-Description'] = 'File Transfer'
             response.headers['Cache-Control'] = 'no-cache'
             response.headers['Content-Type'] = 'application/octet-stream'
-            response.headers['Content-Disposition'] = 'attachment; filename=%s' % self.__experiment_name+'.csv'
+            response.headers['Content-Disposition'] = 'attachment; filename=%s' % self.__experiment_name + extension
             return response
 
         @self.__app.route(ResultLoggerConstants.ROUTE_EXPERIMENTS_SUMMARY)
         def show_summary_html():
             group_by_values = request.args.get(ResultLoggerConstants.FIELD_GROUPBY).split(',')
+            with self.__lock:
+                try:
+                    summary = self.__logger.group_summary(group_by_values)
+                except KeyError as e:
+                    abort(400, str(e))
             return self.__renderer.render(self.PAGE_TEMPLATE,
                                           {'title': 'Results Summary',
                                            'experiment_name': self.__experiment_name,
-                                           'body': self.__pandas_to_html_table(self.__logger.all_results.groupby(group_by_values).mean()),
+                                           'body': self.__pandas_to_html_table(summary),
                                            'summary_links': self.__get_groupby_links(set(group_by_values)),
                                            'in_summary':True
                                            })
 
         @self.__app.route(ResultLoggerConstants.ROUTE_EXPERIMENTS_QUEUE)
         def experiment_queue_html():
-            pct_completed = self.__queue.completed_percent * 100
-            pct_leased = self.__queue.leased_percent * 100
+            with self.__lock:
+                pct_completed = self.__queue.completed_percent * 100
+                pct_leased = self.__queue.leased_percent * 100
             return self.__renderer.render(self.PAGE_TEMPLATE,
                                           {'title': 'Experiments Queue',
                                            'experiment_name' : self.__experiment_name,
-                                           'body': self.__pandas_to_html_table(self.__queue.all_experiments),
+                                           'api_url': ResultLoggerConstants.ROUTE_API_QUEUE,
+                                           'page_size': ResultLoggerConstants.DEFAULT_PAGE_SIZE,
                                            'progress': pct_completed + pct_leased > 0,
                                            'progress_complete': int(pct_completed) if pct_completed > 0 else False,
                                            'progress_leased': int(pct_leased) if pct_leased > 0 else False,
                                            'summary_links': self.__get_groupby_links(set()),
                                            'in_queue': True})
 
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_QUEUE)
+        def api_queue():
+            try:
+                limit, offset, sort_by, _, filters = page_arguments(request.args)
+            except ValueError as e:
+                abort(400, str(e))
+            if sort_by is None and len(filters) == 0:
+                # Only the rows of the page are needed
+                with self.__lock:
+                    total = self.__queue.num_experiments
+                    page = self.__queue.experiments_slice(offset, offset + limit)
+                return self.__app.response_class(page_json(total, offset, limit, page), mimetype='application/json')
+            with self.__lock:
+                build_all_experiments = self.__queue.snapshot_experiments()
+            return self.__paginated_json(build_all_experiments())
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_API_PROGRESS)
+        def api_progress():
+            with self.__lock:
+                return jsonify({'completed': self.__queue.completed_percent,
+                                'leased': self.__queue.leased_percent,
+                                ResultLoggerConstants.FIELD_PARAMETERS: self.__queue.experiment_parameters})
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_METRICS)
+        def metrics():
+            """
+            The server metrics in the Prometheus text format.
+            """
+            with self.__lock:
+                for status, count in self.__queue.status_counts.items():
+                    self.__metrics.set('resultslogger_queue_experiments', 'Number of experiments per status', count,
+                                       status=status)
+                if hasattr(self.__queue, 'model_metrics'):
+                    for name, value in self.__queue.model_metrics.items():
+                        self.__metrics.set('resultslogger_model_' + name, 'Surrogate model metric ' + name, value)
+                self.__metrics.set('resultslogger_results', 'Number of logged results', self.__logger.num_results)
+            return Response(self.__metrics.render(), mimetype='text/plain; version=0.0.4')
+
+        @self.__app.route(ResultLoggerConstants.ROUTE_METRICS_PROFILE, methods=['GET', 'POST'])
+        def metrics_profile():
+            """
+            GET: the accumulated cProfile statistics of the sampled requests. POST: set the sampling rate (rate=0.05)
+            and/or reset the statistics (reset=1).
+            """
+            if request.method == 'POST':
+                if ResultLoggerConstants.FIELD_SAMPLING_RATE in request.values:
+                    self.__profiler.sampling_rate = float(request.values[ResultLoggerConstants.FIELD_SAMPLING_RATE])
+                if request.values.get(ResultLoggerConstants.FIELD_RESET) == '1':
+                    self.__profiler.reset()
+            return Response(self.__profiler.report(sort_by=request.args.get(ResultLoggerConstants.FIELD_SORT, 'cumulative')),
+                            mimetype='text/plain')
+
         self.__autosave_path = autosave_path
         self.__allow_unsolicited_results = allow_unsolicited_results
 
@@ -114,58 +360,199 @@ class ResultsLoggerServer:
         else:
             self.__logger = experiment_logger
 
+        self.__snapshot_every = snapshot_every
+        journal_path = self.__journal_path(autosave_path, experiment_name)
+        if not journal_replayed and next(ExperimentJournal.read_events(journal_path), None) is not None:
+            raise Exception('The journal %s has events that are not in a snapshot. Load the server with '
+                            'ResultsLoggerServer.load() or remove the journal.' % journal_path)
+        self.__journal = ExperimentJournal(journal_path, fsync_every=journal_fsync_every)
+        self.__events_since_snapshot = 0
+        self.autosave()
 
-    def run(self):
-        self.__app.run(host='0.0.0.0')
+
+    @property
+    def wsgi_app(self) -> Flask:
+        """
+        :return: the WSGI application of the server, e.g. to serve it through a different WSGI server.
+        """
+        return self.__app
+
+    def run(self, host: str='0.0.0.0', port: int=5000, num_threads: int=8, wsgi_server: str='flask'):
+        """
+        Serve the experiments. Requests are handled concurrently: lease and store requests are serialized on a lock
+        around the queue and the logger, while the dashboard routes render snapshots outside of the lock.
+        :param num_threads: the number of request handler threads (used by waitress)
+        :param wsgi_server: 'flask' for Flask's threaded development server or 'waitress' to use the production
+        waitress WSGI server (requires the waitress package).
+        """
+        if wsgi_server == 'flask':
+            self.__app.run(host=host, port=port, threaded=True)
+        elif wsgi_server == 'waitress':
+            import waitress
+            waitress.serve(self.__app, host=host, port=port, threads=num_threads)
+        else:
+            raise Exception('Unrecognized WSGI server %s' % wsgi_server)
 
     def __pandas_to_html_table(self, frame):
         return frame.to_html(classes=['table', 'table-striped', 'table-condensed', 'table-hover']).replace('border="1"', 'border="0"')
 
+    def __paginated_json(self, frame):
+        """
+        Respond with a page of the frame, as selected by the limit, offset, sort, ascending and filter arguments.
+        """
+        try:
+            response = paginated_json(frame, request.args)
+        except (KeyError, ValueError) as e:
+            abort(400, str(e))
+        return self.__app.response_class(response, mimetype='application/json')
+
     def __get_groupby_links(self, current_parameters:set)->list:
-        """The group, by links are incremental, toggle-like"""
-        def get_parameters(name_of_param)-> tuple:
-            active = name_of_param in current_parameters
-            if active:
-                params_to_use = current_parameters - {name_of_param}
-                if len(params_to_use) > 0:
-                    return ','.join(params_to_use)
-                else:
-                    return ','.join(current_parameters)
-            else:
-                return ','.join(current_parameters | {name_of_param})
-        return [{'name': n, 'link': get_parameters(n), 'active': n in current_parameters} for n in self.__queue.experiment_parameters]
+        return get_groupby_links(self.__queue.experiment_parameters, current_parameters)
+
+    def __lease(self, client: str):
+        with self.__lock:
+            completed_from_cache = set()
+            max_cache_hits = self.MAX_CACHE_HITS_PER_LEASE
+            if self.__queue.max_cache_hits_per_lease is not None:
+                max_cache_hits = min(max_cache_hits, self.__queue.max_cache_hits_per_lease)
+            while True:
+                with self.__metrics.time(self.QUEUE_OPERATION_METRIC, self.QUEUE_OPERATION_DOC, operation='lease_new'):
+                    next_lease = self.__queue.lease_new(client)
+                if next_lease is None:
+                    return None
+                params, experiment_id = next_lease
+                self.__journal.log_lease(experiment_id, params, client)
+                self.__maybe_snapshot()
+                if self.__result_cache is None or len(completed_from_cache) >= max_cache_hits:
+                    return next_lease
+                cache_key = self.__result_cache.key(params)
+                cached_results = self.__result_cache.get(params) if cache_key not in completed_from_cache else None
+                if cached_results is None:
+                    return next_lease
+
+                # Already evaluated: complete it with the cached results and lease another experiment.
+                completed_from_cache.add(cache_key)
+                self.__metrics.inc('resultslogger_result_cache_hits', 'Leased experiments completed from the cache')
+                self.__complete_experiment(self.__queue, self.__logger, experiment_id, params, client, cached_results,
+                                           self.__metrics)
+                self.__journal.log_complete(experiment_id, params, client, cached_results)
+                self.__maybe_snapshot()
+
+    def __store(self, client: str, experiment_id: int, parameters: dict, results: dict) -> None:
+        if experiment_id == -1 and not self.__allow_unsolicited_results:
+            assert False, "Unsolicited experiment returned"
+        with self.__lock:
+            self.__complete_experiment(self.__queue, self.__logger, experiment_id, parameters, client, results,
+                                       self.__metrics)
+            self.__journal.log_complete(experiment_id, parameters, client, results)
+            self.__maybe_snapshot()
+            cache_key = self.__result_cache.key(parameters) if self.__result_cache is not None else None
+            was_stopped = cache_key in self.__stopped_experiments
+            self.__stopped_experiments.discard(cache_key)
+        if self.__result_cache is not None and not was_stopped:
+            self.__result_cache.put(parameters, results)
+
+    @staticmethod
+    def __journal_path(autosave_path: str, experiment_name: str) -> str:
+        return os.path.join(autosave_path, experiment_name + ".journal")
+
+    @staticmethod
+    def __complete_experiment(queue: ExperimentQueue, experiment_logger: ExperimentLogger, experiment_id: int,
+                              parameters: dict, client: str, results: dict,
+                              metrics: Optional[MetricsRegistry]=None) -> None:
+        """
+        :param metrics: where to record the time of the operations, if given (e.g. not when replaying a journal)
+        """
+        def timed(operation: str):
+            if metrics is None:
+                return nullcontext()
+            return metrics.time(ResultsLoggerServer.QUEUE_OPERATION_METRIC, ResultsLoggerServer.QUEUE_OPERATION_DOC,
+                                operation=operation)
+
+        with timed('log_experiment'):
+            experiment_logger.log_experiment(parameters, results)
+        with timed('complete'):
+            queue.complete(experiment_id, parameters, client,
+                           results[ResultLoggerConstants.BASE_RESULT_FIELD] if ResultLoggerConstants.BASE_RESULT_FIELD in results else 0.)
+
+    def __maybe_snapshot(self):
+        self.__events_since_snapshot += 1
+        if self.__events_since_snapshot >= self.__snapshot_every:
+            self.autosave()
 
     def autosave(self):
-        self.__logger.save_results_csv(os.path.join(self.__autosave_path, self.__experiment_name + "_results.csv"))
-        with open(os.path.join(self.__autosave_path, self.__experiment_name + ".pkl"), 'wb') as f:
-            pickle.dump((self.__queue, self.__logger), f, pickle.HIGHEST_PROTOCOL)
+        """
+        Save a compacted snapshot of the queue and the results and truncate the journal. The snapshot is first written
+        to a temporary file, so that a crash while saving never corrupts the previous snapshot.
+        """
+        with self.__lock:
+            start = time.perf_counter()
+            results_path = os.path.join(self.__autosave_path, self.__experiment_name + "_results.csv")
+            self.__logger.save_results_csv(results_path + ".tmp")
+            os.replace(results_path + ".tmp", results_path)
+
+            snapshot_path = os.path.join(self.__autosave_path, self.__experiment_name + ".pkl")
+            with open(snapshot_path + ".tmp", 'wb') as f:
+                pickle.dump((self.__queue, self.__logger, self.__journal.last_sequence_number), f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(snapshot_path + ".tmp", snapshot_path)
+
+            self.__journal.truncate()
+            self.__events_since_snapshot = 0
+
+            self.__metrics.observe('resultslogger_autosave_seconds', 'Time to save a snapshot',
+                                   time.perf_counter() - start)
+            self.__metrics.set('resultslogger_autosave_bytes', 'Size of the files of the last snapshot',
+                               os.path.getsize(snapshot_path), file='snapshot')
+            self.__metrics.set('resultslogger_autosave_bytes', 'Size of the files of the last snapshot',
+                               os.path.getsize(results_path), file='results')
 
     @staticmethod
-    def load(filename: str, experiment_name: str):
+    def load(filename: str, experiment_name: str, autosave_path: Optional[str]=None,
+             result_cache: SqliteResultCache=None):
         """
-        Load previously saved experiment data and progress.
+        Load previously saved experiment data and progress, replaying any journaled events after the snapshot. Snapshots
+        saved before the journal, of a CsvExperimentQueue and an ExperimentLogger, are migrated when unpickled.
+        :param filename: the snapshot (.pkl) file
+        :param autosave_path: the path where the journal of the snapshot is and where the loaded server saves its
+        snapshots and journal. Defaults to the directory of the snapshot.
+        :param result_cache: the result cache of the loaded server (see the constructor)
         """
+        if autosave_path is None:
+            autosave_path = os.path.dirname(filename) or '.'
         with open(filename, 'rb') as f:
-            queue, experiment_logger = pickle.load(f)
-            return ResultsLoggerServer(experiment_name, queue=queue, experiment_logger=experiment_logger)
+            snapshot = pickle.load(f)
+        if len(snapshot) == 2:
+            queue, experiment_logger = snapshot
+            snapshot_sequence_number = 0
+        else:
+            queue, experiment_logger, snapshot_sequence_number = snapshot
+
+        journal_path = ResultsLoggerServer.__journal_path(autosave_path, experiment_name)
+        for event in ExperimentJournal.read_events(journal_path):
+            if event['seq'] <= snapshot_sequence_number:
+                continue
+            if event['event'] == ExperimentJournal.LEASE:
+                queue.restore_lease(event['experiment_id'], event['parameters'], event['client'])
+            elif event['event'] == ExperimentJournal.COMPLETE:
+                ResultsLoggerServer.__complete_experiment(queue, experiment_logger, event['experiment_id'],
+                                                          event['parameters'], event['client'], event['results'])
+
+        return ResultsLoggerServer(experiment_name, queue=queue, autosave_path=autosave_path,
+                                   experiment_logger=experiment_logger, result_cache=result_cache,
+                                   journal_replayed=True)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage <experimentName> csv <listOfExperiments.csv>")
-        print("Usage <experimentName> bayesianOpt <inputSpaceParameters.json>")
+    if len(sys.argv) not in (4, 5):
+        for backend_name, argument_description in available_backends():
+            print("Usage <experimentName> %s %s [resultCache.sqlite]" % (backend_name, argument_description))
+        print("Usage <experimentName> <module:factory> <path> [resultCache.sqlite]")
         sys.exit(-1)
 
     experiment_name = sys.argv[1]
-    queue_type = sys.argv[2]
-
-    if queue_type == 'csv':
-        queue = CsvExperimentQueue(sys.argv[3])
-    elif queue_type == 'bayesianOpt':
-        queue = BayesianOptimizedExperimentQueue(sys.argv[3])
-    else:
-        raise Exception('Unrecognized queue type %s' % queue_type)
-    list_of_experiments_csv_path = sys.argv[2]
-
-    logger = ResultsLoggerServer(experiment_name, queue)
-    logger.run()
\ No newline at end of file
+    queue, experiment_logger = create_backend(sys.argv[2], experiment_name, sys.argv[3])
+    result_cache = SqliteResultCache(sys.argv[4]) if len(sys.argv) == 5 else None
+    logger = ResultsLoggerServer(experiment_name, queue, experiment_logger=experiment_logger, result_cache=result_cache)
+    logger.run()
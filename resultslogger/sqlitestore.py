@@ -0,0 +1,438 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from numbers import Integral, Real
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from resultslogger.experimentlogger import ExperimentLogger
+from resultslogger.experimentqueue import ExperimentQueue
+from resultslogger.leaseindex import AdaptiveLeaseTimeout
+
+
+class _SqliteConnections:
+    """
+    One connection per thread to a SQLite database in WAL mode, so that readers do not block the writer and multiple
+    processes can share the database. Only the path is pickled.
+    """
+    BUSY_TIMEOUT_MS = 30000
+
+    def __init__(self, db_path: str):
+        self.__db_path = db_path
+        self.__local = threading.local()
+
+    @property
+    def db_path(self) -> str:
+        return self.__db_path
+
+    def get(self) -> sqlite3.Connection:
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.__db_path, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA busy_timeout=%d' % self.BUSY_TIMEOUT_MS)
+            self.__local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """
+        A write transaction. The write lock is taken when the transaction starts, so that a read-then-update (e.g. a
+        lease) is atomic across threads and processes.
+        """
+        connection = self.get()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def __getstate__(self):
+        return self.__db_path
+
+    def __setstate__(self, db_path):
+        self.__init__(db_path)
+
+
+class SqliteExperimentQueue(ExperimentQueue):
+    """
+    A queue of a fixed list of experiments stored in a SQLite database. Every lease and completion is a transaction, so
+    the queue can be shared by multiple processes and is durable without pickling. The database can be queried while
+    experiments are running, e.g.
+        SELECT json_extract(parameters, '$.lr'), status FROM experiments WHERE status = 'LEASED'
+    """
+    INSERT_BATCH_ROWS = 10000
+
+    def __init__(self, db_path: str, list_of_experiments_path: Optional[str]=None, lease_timout='2 days',
+                 heartbeat_timeout='5 minutes'):
+        """
+        :param db_path: the path of the SQLite database. It is created if it does not exist.
+        :param list_of_experiments_path: The path to a csv file containing all possible experiments. It is only read
+        if the database contains no experiments.
+        :param lease_timout: the maximum time that a lease lasts (see CsvExperimentQueue)
+        :param heartbeat_timeout: the time that a lease lasts after the last heartbeat of its client
+        """
+        self.__db = _SqliteConnections(db_path)
+        self.__lease_duration = pd.to_timedelta(lease_timout)
+        self.__timeout = AdaptiveLeaseTimeout(self.__lease_duration.total_seconds(),
+                                              pd.to_timedelta(heartbeat_timeout).total_seconds())
+
+        with self.__db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS experiments (experiment_id INTEGER PRIMARY KEY, '
+                       'parameters TEXT NOT NULL, status TEXT NOT NULL, last_update REAL, client TEXT, '
+                       'lease_start REAL, lease_expiry REAL, duration REAL)')
+            self.__add_lease_columns(db)
+            db.execute('CREATE INDEX IF NOT EXISTS experiments_status ON experiments (status, last_update)')
+            db.execute('CREATE INDEX IF NOT EXISTS experiments_lease_expiry ON experiments (status, lease_expiry)')
+            db.execute('CREATE INDEX IF NOT EXISTS experiments_next ON experiments (status, experiment_id)')
+            db.execute('CREATE TABLE IF NOT EXISTS queue_metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self.__add_status_counts(db)
+            has_experiments = db.execute('SELECT 1 FROM experiments LIMIT 1').fetchone() is not None
+            if not has_experiments:
+                assert list_of_experiments_path is not None, "The database %s has no experiments" % db_path
+                self.__insert_experiments(db, list_of_experiments_path)
+            self.__parameter_names = json.loads(db.execute('SELECT value FROM queue_metadata WHERE key = ?',
+                                                           ('parameter_names',)).fetchone()[0])
+
+    def __add_lease_columns(self, db: sqlite3.Connection) -> None:
+        """
+        Migrate databases created before leases had an expiry: add the lease columns and let the current leases expire
+        lease_timout after their last update, as they did then.
+        """
+        columns = {row[1] for row in db.execute('PRAGMA table_info(experiments)').fetchall()}
+        if 'lease_expiry' in columns:
+            return
+        for column in ('lease_start', 'lease_expiry', 'duration'):
+            if column not in columns:
+                db.execute('ALTER TABLE experiments ADD COLUMN %s REAL' % column)
+        db.execute('UPDATE experiments SET lease_start = last_update, lease_expiry = last_update + ? WHERE status = ?',
+                   (self.__lease_duration.total_seconds(), self.LEASED))
+
+    @staticmethod
+    def __add_status_counts(db: sqlite3.Connection) -> None:
+        """
+        Keep the number of experiments per status in a small table, updated by triggers on every insert and status
+        change (also by other processes), so that the progress of the queue is known without scanning it.
+        """
+        if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'status_counts'").fetchone():
+            return
+        db.execute('CREATE TABLE status_counts (status TEXT PRIMARY KEY, count INTEGER NOT NULL)')
+        db.execute('INSERT INTO status_counts SELECT status, COUNT(*) FROM experiments GROUP BY status')
+        db.execute('CREATE TRIGGER status_counts_insert AFTER INSERT ON experiments BEGIN '
+                   'INSERT OR IGNORE INTO status_counts VALUES (NEW.status, 0); '
+                   'UPDATE status_counts SET count = count + 1 WHERE status = NEW.status; END')
+        db.execute('CREATE TRIGGER status_counts_update AFTER UPDATE OF status ON experiments '
+                   'WHEN OLD.status != NEW.status BEGIN '
+                   'UPDATE status_counts SET count = count - 1 WHERE status = OLD.status; '
+                   'INSERT OR IGNORE INTO status_counts VALUES (NEW.status, 0); '
+                   'UPDATE status_counts SET count = count + 1 WHERE status = NEW.status; END')
+        db.execute('CREATE TRIGGER status_counts_delete AFTER DELETE ON experiments BEGIN '
+                   'UPDATE status_counts SET count = count - 1 WHERE status = OLD.status; END')
+
+    def __insert_experiments(self, db: sqlite3.Connection, list_of_experiments_path: str) -> None:
+        experiment_id = 0
+        for chunk in pd.read_csv(list_of_experiments_path, chunksize=self.INSERT_BATCH_ROWS):
+            db.execute('INSERT OR REPLACE INTO queue_metadata VALUES (?, ?)',
+                       ('parameter_names', json.dumps(list(chunk.columns))))
+            rows = [(experiment_id + i, json.dumps(parameters), self.WAITING)
+                    for i, parameters in enumerate(json.loads(chunk.to_json(orient='records')))]
+            db.executemany('INSERT INTO experiments (experiment_id, parameters, status) VALUES (?, ?, ?)', rows)
+            experiment_id += len(rows)
+
+    @property
+    def db_path(self) -> str:
+        return self.__db.db_path
+
+    @property
+    def all_experiments(self) -> pd.DataFrame:
+        return self.experiments_slice(0, self.num_experiments)
+
+    @property
+    def num_experiments(self) -> int:
+        return sum(self.status_counts.values())
+
+    def experiments_slice(self, start: int, stop: int) -> pd.DataFrame:
+        # Experiment ids are the row numbers of the list of experiments
+        rows = self.__db.get().execute('SELECT experiment_id, parameters, status, last_update, client, duration '
+                                       'FROM experiments WHERE experiment_id >= ? AND experiment_id < ? '
+                                       'ORDER BY experiment_id', (start, stop)).fetchall()
+        view = pd.DataFrame([json.loads(row[1]) for row in rows], index=[row[0] for row in rows],
+                            columns=self.__parameter_names)
+        view['status'] = [row[2] for row in rows]
+        view['last_update'] = pd.to_datetime([row[3] if row[3] is not None else float('nan') for row in rows], unit='s')
+        view['client'] = [row[4] if row[4] is not None else "" for row in rows]
+        view['duration'] = pd.to_timedelta([row[5] for row in rows], unit='s')
+        return view
+
+    def snapshot_experiments(self) -> Callable[[], pd.DataFrame]:
+        # The experiments are read from a consistent snapshot of the database when the frame is built.
+        return lambda: self.all_experiments
+
+    def __str__(self):
+        return str(self.all_experiments)
+
+    @property
+    def status_counts(self) -> Dict[str, int]:
+        return dict(self.__db.get().execute('SELECT status, count FROM status_counts WHERE count > 0').fetchall())
+
+    @property
+    def completed_percent(self) -> float:
+        counts = self.status_counts
+        return float(counts.get(self.DONE, 0)) / sum(counts.values())
+
+    @property
+    def leased_percent(self) -> float:
+        counts = self.status_counts
+        return float(counts.get(self.LEASED, 0)) / sum(counts.values())
+
+    @property
+    def experiment_parameters(self) -> List[str]:
+        return list(self.__parameter_names)
+
+    def lease_new(self, client_name: str) -> tuple:
+        now = time.time()
+        with self.__db.transaction() as db:
+            selected = db.execute('SELECT experiment_id, parameters FROM experiments WHERE status = ? '
+                                  'ORDER BY experiment_id LIMIT 1', (self.WAITING,)).fetchone()
+            if selected is None:
+                selected = db.execute('SELECT experiment_id, parameters FROM experiments WHERE status = ? AND '
+                                      'lease_expiry < ? ORDER BY lease_expiry LIMIT 1', (self.LEASED, now)).fetchone()
+                if selected is None:
+                    return None
+                print("Re-leasing experiment %s since it expired" % selected[0])
+            db.execute('UPDATE experiments SET status = ?, last_update = ?, client = ?, lease_start = ?, '
+                       'lease_expiry = ? WHERE experiment_id = ?',
+                       (self.LEASED, now, client_name, now, now + self.__timeout.timeout_secs, selected[0]))
+        return json.loads(selected[1]), selected[0]
+
+    def restore_lease(self, experiment_id: int, parameters: dict, client: str) -> None:
+        if experiment_id == -1: return
+        now = time.time()
+        with self.__db.transaction() as db:
+            db.execute('UPDATE experiments SET status = ?, last_update = ?, client = ?, lease_start = ?, '
+                       'lease_expiry = ? WHERE experiment_id = ? AND status != ?',
+                       (self.LEASED, now, client, now, now + self.__timeout.timeout_secs, experiment_id, self.DONE))
+
+    def heartbeat(self, experiment_id: int, parameters: dict, client: str) -> bool:
+        if experiment_id == -1: return True
+        with self.__db.transaction() as db:
+            updated = db.execute('UPDATE experiments SET lease_expiry = ? WHERE experiment_id = ? AND status = ? '
+                                 'AND client = ?', (time.time() + self.__timeout.heartbeat_timeout_secs,
+                                                    experiment_id, self.LEASED, client))
+            return updated.rowcount > 0
+
+    def complete(self, experiment_id: int, parameters: dict, client: str, result: float):
+        if experiment_id == -1: return
+        now = time.time()
+        with self.__db.transaction() as db:
+            original_params, status, leased_client, lease_start = db.execute(
+                'SELECT parameters, status, client, lease_start FROM experiments WHERE experiment_id = ?',
+                (experiment_id,)).fetchone()
+            assert json.loads(original_params) == parameters, "Experiment Parameters do not match!"
+            if leased_client != client:
+                print("Experiment returned from non-leased (or expired) client")
+            duration = None
+            if status == self.LEASED and leased_client == client:
+                duration = now - lease_start
+                self.__timeout.record_duration(duration)
+            db.execute('UPDATE experiments SET status = ?, last_update = ?, client = ?, lease_expiry = NULL, '
+                       'duration = COALESCE(?, duration) WHERE experiment_id = ?',
+                       (self.DONE, now, client, duration, experiment_id))
+
+
+class SqliteExperimentLogger(ExperimentLogger):
+    """
+    Log all experiment results in a SQLite database. Results are inserted in batches of batch_size rows and read back
+    incrementally into the in-memory ExperimentLogger before all_results and group_summary, so that results logged by
+    other processes sharing the database are also included.
+
+    When pickled (e.g. in a server snapshot), only the path of the database is kept. When unpickled, the rows that this
+    logger inserted after the snapshot are removed, since the server journal replays them.
+    """
+
+    def __init__(self, db_path: str, parameter_names: List[str], result_columns: List[str], batch_size: int=32) -> None:
+        super().__init__(parameter_names, result_columns)
+        self.__db = _SqliteConnections(db_path)
+        self.__initial_columns = parameter_names, result_columns
+        self.__batch_size = batch_size
+        self.__writer = uuid.uuid4().hex
+
+        with self.__db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS results (result_id INTEGER PRIMARY KEY, writer TEXT NOT NULL, '
+                       'parameters TEXT NOT NULL, results TEXT NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_writer ON results (writer, result_id)')
+        self.__init_transient_state()
+
+    def __init_transient_state(self) -> None:
+        self.__pending = []  # type: List[tuple]
+        self.__last_read_result_id = 0
+        # Guards the pending rows and the in-memory logger, which new rows are read into and which group_summary
+        # updates. Reentrant, since group_summary reads all_results.
+        self.__sync_lock = threading.RLock()
+
+    @property
+    def db_path(self) -> str:
+        return self.__db.db_path
+
+    def log_experiment(self, parameters: Dict[str, Any], results: Dict[str, Any]) -> None:
+        with self.__sync_lock:
+            self.__pending.append((self.__writer, json.dumps(parameters), json.dumps(results)))
+            if len(self.__pending) >= self.__batch_size:
+                self.__flush()
+
+    def flush(self) -> None:
+        """
+        Insert all pending results into the database.
+        """
+        with self.__sync_lock:
+            self.__flush()
+
+    def __flush(self) -> None:
+        if len(self.__pending) == 0:
+            return
+        with self.__db.transaction() as db:
+            db.executemany('INSERT INTO results (writer, parameters, results) VALUES (?, ?, ?)', self.__pending)
+        self.__pending = []
+
+    def __sync(self) -> None:
+        """
+        Read the new rows into the in-memory logger. Must be called with __sync_lock held.
+        """
+        self.__flush()
+        new_rows = self.__db.get().execute('SELECT result_id, parameters, results FROM results WHERE result_id > ? '
+                                           'ORDER BY result_id', (self.__last_read_result_id,)).fetchall()
+        for result_id, parameters, results in new_rows:
+            super().log_experiment(json.loads(parameters), json.loads(results))
+            self.__last_read_result_id = result_id
+
+    def group_summary(self, group_by: List[str]) -> pd.DataFrame:
+        with self.__sync_lock:
+            self.__sync()
+            return super().group_summary(group_by)
+
+    @property
+    def all_results(self) -> pd.DataFrame:
+        with self.__sync_lock:
+            self.__sync()
+            return super().all_results
+
+    @property
+    def num_results(self) -> int:
+        with self.__sync_lock:
+            self.__sync()
+            return super().num_results
+
+    def __getstate__(self):
+        self.flush()
+        last_result_id = self.__db.get().execute('SELECT MAX(result_id) FROM results WHERE writer = ?',
+                                                 (self.__writer,)).fetchone()[0]
+        return {'db': self.__db, 'initial_columns': self.__initial_columns, 'batch_size': self.__batch_size,
+                'writer': self.__writer, 'last_result_id': last_result_id or 0}
+
+    def __setstate__(self, state):
+        super().__init__(*state['initial_columns'])
+        self.__db = state['db']
+        self.__initial_columns = state['initial_columns']
+        self.__batch_size = state['batch_size']
+        self.__writer = state['writer']
+        self.__init_transient_state()
+        with self.__db.transaction() as db:
+            db.execute('DELETE FROM results WHERE writer = ? AND result_id > ?', (self.__writer, state['last_result_id']))
+
+
+class SqliteResultCache:
+    """
+    A persistent cache of the results of experiments, indexed by a hash of their canonicalized parameters, so that an
+    experiment whose parameters were already evaluated is not run again. The cache only depends on the parameters, so
+    it can be shared by different experiments (and servers) by pointing them to the same database. When it holds more
+    than max_entries results, the least recently used ones are evicted.
+    """
+    # Check the size of the cache every this many insertions (of this process), so the cache may temporarily exceed
+    # max_entries by this many entries per writer.
+    EVICTION_CHECK_EVERY = 256
+
+    def __init__(self, db_path: str, max_entries: int=1000000):
+        """
+        :param db_path: the path of the SQLite database. It is created if it does not exist and may be shared with a
+        SqliteExperimentQueue or SqliteExperimentLogger.
+        :param max_entries: the maximum number of cached results
+        """
+        self.__db = _SqliteConnections(db_path)
+        self.__max_entries = max_entries
+        self.__num_puts = 0
+        with self.__db.transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, parameters TEXT NOT NULL, '
+                       'results TEXT NOT NULL, last_access REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS result_cache_by_access ON result_cache (last_access)')
+        self.__evict()
+
+    @property
+    def db_path(self) -> str:
+        return self.__db.db_path
+
+    @property
+    def num_entries(self) -> int:
+        return self.__db.get().execute('SELECT COUNT(*) FROM result_cache').fetchone()[0]
+
+    @staticmethod
+    def canonicalize(parameters: Dict[str, Any]) -> str:
+        """
+        :return: a canonical json representation of the parameters: sorted by name, with integral numbers as ints (so
+        that e.g. 1 and 1.0 are the same parameter value) and numpy scalars as python values.
+        """
+        def canonical_value(value):
+            if isinstance(value, (bool, np.bool_)):
+                return bool(value)
+            elif isinstance(value, Integral):
+                return int(value)
+            elif isinstance(value, Real):
+                value = float(value)
+                return int(value) if value.is_integer() else value
+            elif isinstance(value, np.str_):
+                return str(value)
+            return value
+        return json.dumps({str(name): canonical_value(value) for name, value in parameters.items()},
+                          sort_keys=True, separators=(',', ':'))
+
+    @staticmethod
+    def key(parameters: Dict[str, Any]) -> str:
+        return hashlib.sha256(SqliteResultCache.canonicalize(parameters).encode('utf-8')).hexdigest()
+
+    def get(self, parameters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        :return: the cached results of the experiment with these parameters or None
+        """
+        key = self.key(parameters)
+        db = self.__db.get()
+        row = db.execute('SELECT results FROM result_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        db.execute('UPDATE result_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, parameters: Dict[str, Any], results: Dict[str, Any]) -> None:
+        self.__db.get().execute('INSERT OR REPLACE INTO result_cache (key, parameters, results, last_access) '
+                                'VALUES (?, ?, ?, ?)',
+                                (self.key(parameters), self.canonicalize(parameters), json.dumps(results), time.time()))
+        self.__num_puts += 1
+        if self.__num_puts % self.EVICTION_CHECK_EVERY == 0:
+            self.__evict()
+
+    def __evict(self) -> None:
+        """
+        Delete the least recently used results beyond max_entries.
+        """
+        with self.__db.transaction() as db:
+            num_evicted = db.execute('SELECT COUNT(*) FROM result_cache').fetchone()[0] - self.__max_entries
+            if num_evicted > 0:
+                db.execute('DELETE FROM result_cache WHERE key IN '
+                           '(SELECT key FROM result_cache ORDER BY last_access LIMIT ?)', (num_evicted,))
@@ -0,0 +1,29 @@
+import pandas as pd
+import pytest
+
+from resultslogger.experimentqueue import CsvExperimentQueue
+from resultslogger.server import ResultsLoggerServer
+
+
+@pytest.fixture
+def experiments_csv(tmp_path):
+    """
+    A csv file with a grid of 6 experiments over the parameters a and b.
+    """
+    path = str(tmp_path / 'experiments.csv')
+    pd.DataFrame({'a': [1, 1, 2, 2, 3, 3], 'b': ['x', 'y'] * 3}).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def make_server(tmp_path, experiments_csv):
+    """
+    :return: a function that creates a server over a CsvExperimentQueue of experiments_csv (unless a queue is given)
+    autosaving in tmp_path, and returns it with a Flask test client.
+    """
+    def make(queue=None, **kwargs):
+        if queue is None:
+            queue = CsvExperimentQueue(experiments_csv)
+        server = ResultsLoggerServer('test', queue, autosave_path=str(tmp_path), **kwargs)
+        return server, server.wsgi_app.test_client()
+    return make
@@ -0,0 +1,57 @@
+import numpy as np
+
+from resultslogger.constants import ResultLoggerConstants
+from resultslogger.experimentlogger import ExperimentLogger
+
+
+def test_group_summary_of_empty_log():
+    logger = ExperimentLogger(['a', 'b'], [])
+    summary = logger.group_summary(['a'])
+    assert len(summary) == 0 and len(summary.columns) == 0
+    assert len(logger.group_summary(['b', 'a'])) == 0
+
+
+def test_group_summary_without_numeric_results():
+    logger = ExperimentLogger(['a', 'b'], [])
+    logger.group_summary(['b'])
+    logger.log_experiment({'a': 'p', 'b': 'x'}, {'result': 'fail'})
+    summary = logger.group_summary(['b'])
+    assert list(summary.index) == ['x'] and len(summary.columns) == 0
+
+
+def test_group_summary():
+    logger = ExperimentLogger(['a'], [])
+    for a, value in [(1, 1.), (1, 3.), (2, 5.)]:
+        logger.log_experiment({'a': a}, {'value': value})
+    summary = logger.group_summary(['a'])
+    assert list(summary[('value', 'mean')]) == [2., 5.]
+    assert list(summary[('value', 'count')]) == [2, 1]
+
+
+def test_result_summary_page_of_empty_server(make_server):
+    _, client = make_server()
+    response = client.get(ResultLoggerConstants.ROUTE_EXPERIMENTS_SUMMARY + '?groupby=a')
+    assert response.status_code == 200
+
+
+def test_missing_values_keep_numeric_columns():
+    logger = ExperimentLogger(['a'], [])
+    logger.group_summary(['a'])
+    logger.log_experiment({'a': 1}, {'value': 1.5, 'count': 3})
+    logger.log_experiment({'a': 1}, {'value': None, 'count': None})
+    logger.log_experiment({'a': 1}, {'value': float('nan'), 'count': 4})
+    results = logger.all_results
+    assert results['value'].dtype == np.float64 and results['count'].dtype == np.float64
+    assert results['value'].isnull().tolist() == [False, True, True]
+    assert list(logger.group_summary(['a'])[('value', 'count')]) == [1]
+    assert list(logger.group_summary(['a'])[('count', 'mean')]) == [3.5]
+
+
+def test_large_integers_are_objects():
+    logger = ExperimentLogger(['a'], [])
+    logger.log_experiment({'a': 1}, {'value': 1})
+    logger.log_experiment({'a': 2}, {'value': 2 ** 70, 'other': 1})
+    logger.log_experiment({'a': 3}, {'value': 3})
+    results = logger.all_results
+    assert len(results) == 3 and results['value'].tolist() == [1, 2 ** 70, 3]
+    assert results['other'].isnull().tolist() == [True, False, True]
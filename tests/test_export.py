@@ -0,0 +1,58 @@
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from resultslogger.constants import ResultLoggerConstants
+from resultslogger.experimentlogger import ExperimentLogger
+from resultslogger.export import columnar_chunks, csv_chunks
+
+pa = pytest.importorskip('pyarrow')
+
+
+def mixed_results() -> pd.DataFrame:
+    logger = ExperimentLogger(['a'], [])
+    logger.log_experiment({'a': 1}, {'value': 0.5, 'note': 'ok', 'big': 1})
+    logger.log_experiment({'a': 2}, {'value': 1.5, 'note': 3, 'big': 2 ** 70})
+    logger.log_experiment({'a': 3}, {'value': 2.5, 'note': None, 'big': 3})
+    return logger.all_results
+
+
+def test_csv_chunks():
+    frame = mixed_results()
+    csv = ''.join(csv_chunks(frame, chunk_rows=2))
+    assert pd.read_csv(io.StringIO(csv), index_col=0)['value'].tolist() == [0.5, 1.5, 2.5]
+
+
+@pytest.mark.parametrize('file_format', ['arrow', 'parquet'])
+def test_columnar_chunks_of_mixed_columns(file_format):
+    frame = mixed_results()
+    content = b''.join(columnar_chunks(frame, file_format, chunk_rows=2))
+    if file_format == 'arrow':
+        read = pa.ipc.open_stream(content).read_pandas()
+    else:
+        import pyarrow.parquet as pq
+        read = pq.read_table(pa.BufferReader(content)).to_pandas()
+    assert read['value'].tolist() == [0.5, 1.5, 2.5]
+    assert read['note'].tolist()[:2] == ['ok', '3'] and pd.isna(read['note'][2])
+    assert read['big'].tolist() == ['1', str(2 ** 70), '3']
+
+
+def test_columnar_chunks_raise_before_streaming():
+    with pytest.raises(Exception):
+        columnar_chunks(mixed_results(), 'feather')
+
+
+def test_csv_dump_of_mixed_columns(make_server):
+    _, client = make_server()
+    client.post(ResultLoggerConstants.ROUTE_API_STORE, json={
+        ResultLoggerConstants.FIELD_CLIENT: 'c',
+        ResultLoggerConstants.FIELD_EXPERIMENTS: [
+            {ResultLoggerConstants.FIELD_EXPERIMENT_ID: 0, ResultLoggerConstants.FIELD_PARAMETERS: {'a': 1, 'b': 'x'},
+             ResultLoggerConstants.FIELD_RESULTS: {'note': 'ok'}},
+            {ResultLoggerConstants.FIELD_EXPERIMENT_ID: 1, ResultLoggerConstants.FIELD_PARAMETERS: {'a': 1, 'b': 'y'},
+             ResultLoggerConstants.FIELD_RESULTS: {'note': 1}}]})
+    response = client.get(ResultLoggerConstants.ROUTE_CSV_DUMP + '?format=arrow')
+    assert response.status_code == 200
+    assert pa.ipc.open_stream(response.data).read_pandas()['note'].tolist() == ['ok', '1']
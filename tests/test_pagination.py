@@ -0,0 +1,29 @@
+import pytest
+
+from resultslogger.constants import ResultLoggerConstants
+
+
+@pytest.mark.parametrize('route', [ResultLoggerConstants.ROUTE_API_QUEUE, ResultLoggerConstants.ROUTE_API_RESULTS])
+@pytest.mark.parametrize('arguments', ['limit=-1', 'limit=abc', 'offset=-5', 'offset=1.5', 'sort=unknown'])
+def test_invalid_page_arguments(make_server, route, arguments):
+    _, client = make_server()
+    assert client.get(route + '?' + arguments).status_code == 400
+
+
+def test_queue_page(make_server):
+    _, client = make_server()
+    client.post(ResultLoggerConstants.ROUTE_API_LEASE, json={ResultLoggerConstants.FIELD_CLIENT: 'c',
+                                                             ResultLoggerConstants.FIELD_NUM_EXPERIMENTS: 2})
+    client.post(ResultLoggerConstants.ROUTE_API_STORE, json={
+        ResultLoggerConstants.FIELD_CLIENT: 'c',
+        ResultLoggerConstants.FIELD_EXPERIMENTS: [
+            {ResultLoggerConstants.FIELD_EXPERIMENT_ID: 0, ResultLoggerConstants.FIELD_PARAMETERS: {'a': 1, 'b': 'x'},
+             ResultLoggerConstants.FIELD_RESULTS: {'minimized-value': 1.}}]})
+    for arguments in ['offset=0&limit=3', 'sort=a&offset=0&limit=3']:
+        reply = client.get(ResultLoggerConstants.ROUTE_API_QUEUE + '?' + arguments).json
+        assert reply['total'] == 6
+        page = reply['page']
+        rows = [dict(zip(page['columns'], row)) for row in page['data']]
+        assert [row['status'] for row in rows] == ['DONE', 'LEASED', 'WAITING']
+        assert isinstance(rows[0]['duration'], float) and rows[0]['duration'] >= 0
+        assert rows[1]['duration'] is None
@@ -0,0 +1,52 @@
+import pytest
+
+from resultslogger.constants import ResultLoggerConstants
+from resultslogger.experimentqueue import CsvExperimentQueue
+from resultslogger.pruning import SuccessiveHalvingPruner
+
+
+def test_successive_halving():
+    pruner = SuccessiveHalvingPruner(min_step=1, reduction_factor=2)
+    assert pruner.report('a', 1, 1.)
+    assert not pruner.report('b', 1, 2.)
+    assert not pruner.report('b', 2, 0.)
+    assert pruner.report('c', 1, 0.)
+    assert pruner.rung_sizes == [3]
+
+
+def test_forget():
+    pruner = SuccessiveHalvingPruner(min_step=1, reduction_factor=2)
+    assert pruner.report('a', 1, 1.)
+    assert not pruner.report('b', 1, 2.)
+    pruner.forget('b')
+    assert pruner.rung_sizes == [1]
+    assert pruner.report('b', 1, 0.5)
+
+
+def test_re_leased_experiment_is_forgotten(experiments_csv):
+    queue = CsvExperimentQueue(experiments_csv, lease_timout='0 seconds', heartbeat_timeout='0 seconds',
+                               pruner=SuccessiveHalvingPruner(min_step=1, reduction_factor=2))
+    leased = [queue.lease_new('c') for _ in range(6)]
+    assert queue.report(0, leased[0][0], 'c', 1, 1.)
+    assert not queue.report(1, leased[1][0], 'c', 1, 2.)
+    for parameters, experiment_id in leased:
+        if experiment_id != 1:
+            queue.complete(experiment_id, parameters, 'c', 1.)
+    assert queue.lease_new('d') == leased[1]
+    assert queue.report(1, leased[1][0], 'd', 1, 0.5)
+
+
+def report(client, value):
+    return client.post(ResultLoggerConstants.ROUTE_API_REPORT, json={
+        ResultLoggerConstants.FIELD_CLIENT: 'c',
+        ResultLoggerConstants.FIELD_EXPERIMENTS: [
+            {ResultLoggerConstants.FIELD_EXPERIMENT_ID: 0, ResultLoggerConstants.FIELD_PARAMETERS: {'a': 1, 'b': 'x'},
+             ResultLoggerConstants.FIELD_STEP: 1, ResultLoggerConstants.FIELD_VALUE: value}]})
+
+
+@pytest.mark.parametrize('value', ['nan', 'inf', 'abc', [1.], None])
+def test_report_rejects_invalid_values(experiments_csv, make_server, value):
+    _, client = make_server(queue=CsvExperimentQueue(experiments_csv, pruner=SuccessiveHalvingPruner()))
+    client.post(ResultLoggerConstants.ROUTE_API_LEASE, json={ResultLoggerConstants.FIELD_CLIENT: 'c'})
+    assert report(client, value).status_code == 400
+    assert report(client, 0.5).json[ResultLoggerConstants.FIELD_CONTINUE] == [True]
@@ -0,0 +1,69 @@
+from resultslogger.constants import ResultLoggerConstants
+from resultslogger.experimentqueue import CsvExperimentQueue
+from resultslogger.pruning import SuccessiveHalvingPruner
+from resultslogger.sqlitestore import SqliteResultCache
+
+
+def lease(client, num_experiments: int=1):
+    reply = client.post(ResultLoggerConstants.ROUTE_API_LEASE,
+                        json={ResultLoggerConstants.FIELD_CLIENT: 'c', ResultLoggerConstants.FIELD_NUM_EXPERIMENTS: num_experiments})
+    return reply.json[ResultLoggerConstants.FIELD_EXPERIMENTS]
+
+
+def store(client, experiment, results):
+    client.post(ResultLoggerConstants.ROUTE_API_STORE, json={
+        ResultLoggerConstants.FIELD_CLIENT: 'c',
+        ResultLoggerConstants.FIELD_EXPERIMENTS: [
+            {ResultLoggerConstants.FIELD_EXPERIMENT_ID: experiment['experiment_id'],
+             ResultLoggerConstants.FIELD_PARAMETERS: experiment['parameters'],
+             ResultLoggerConstants.FIELD_RESULTS: results}]})
+
+
+def report(client, experiment, step, value):
+    return client.post(ResultLoggerConstants.ROUTE_API_REPORT, json={
+        ResultLoggerConstants.FIELD_CLIENT: 'c',
+        ResultLoggerConstants.FIELD_EXPERIMENTS: [
+            {ResultLoggerConstants.FIELD_EXPERIMENT_ID: experiment['experiment_id'],
+             ResultLoggerConstants.FIELD_PARAMETERS: experiment['parameters'],
+             ResultLoggerConstants.FIELD_STEP: step, ResultLoggerConstants.FIELD_VALUE: value}]})
+
+
+def test_cached_results_complete_leases(tmp_path, make_server):
+    cache = SqliteResultCache(str(tmp_path / 'cache.sqlite'))
+    cache.put({'a': 1, 'b': 'x'}, {'minimized-value': 0.5})
+    cache.put({'a': 1.0, 'b': 'y'}, {'minimized-value': 0.25})
+    server, client = make_server(result_cache=cache)
+    assert [e['experiment_id'] for e in lease(client)] == [2]
+    assert client.get(ResultLoggerConstants.ROUTE_API_RESULTS).json['total'] == 2
+
+
+class ExpensiveQueue(CsvExperimentQueue):
+    @property
+    def max_cache_hits_per_lease(self):
+        return 1
+
+
+def test_queue_limits_cache_hits(tmp_path, experiments_csv, make_server):
+    cache = SqliteResultCache(str(tmp_path / 'cache.sqlite'))
+    cache.put({'a': 1, 'b': 'x'}, {'minimized-value': 0.5})
+    cache.put({'a': 1, 'b': 'y'}, {'minimized-value': 0.25})
+    server, client = make_server(queue=ExpensiveQueue(experiments_csv), result_cache=cache)
+    assert [e['experiment_id'] for e in lease(client)] == [1]
+
+
+def test_results_of_stopped_experiments_are_not_cached(tmp_path, experiments_csv, make_server):
+    cache = SqliteResultCache(str(tmp_path / 'cache.sqlite'))
+    queue = CsvExperimentQueue(experiments_csv, pruner=SuccessiveHalvingPruner(min_step=1, reduction_factor=2))
+    server, client = make_server(queue=queue, result_cache=cache)
+    first, second = lease(client, 2)
+    assert report(client, first, 1, 0.).json[ResultLoggerConstants.FIELD_CONTINUE] == [True]
+    assert report(client, second, 1, 1.).json[ResultLoggerConstants.FIELD_CONTINUE] == [False]
+
+    store(client, second, {'minimized-value': 1.})
+    store(client, first, {'minimized-value': 0.})
+    assert cache.get(second['parameters']) is None
+    assert cache.get(first['parameters']) == {'minimized-value': 0.}
+
+    # A later complete run of the stopped parameters is cached
+    store(client, second, {'minimized-value': 0.5})
+    assert cache.get(second['parameters']) == {'minimized-value': 0.5}
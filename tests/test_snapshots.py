@@ -0,0 +1,86 @@
+import pickle
+
+import pandas as pd
+
+from resultslogger.constants import ResultLoggerConstants
+from resultslogger.experimentlogger import ExperimentLogger
+from resultslogger.experimentqueue import CsvExperimentQueue
+from resultslogger.server import ResultsLoggerServer
+
+
+def baseline_queue(experiments_csv: str, leased, done) -> CsvExperimentQueue:
+    """
+    :return: a queue with the state of a CsvExperimentQueue pickled before the lease index, where the ids in leased were
+    leased an hour ago and those in done were completed.
+    """
+    all_experiments = pd.read_csv(experiments_csv)
+    status = [CsvExperimentQueue.WAITING] * len(all_experiments)
+    last_update = [pd.NaT] * len(all_experiments)
+    client = [""] * len(all_experiments)
+    for experiment_id in leased:
+        status[experiment_id] = CsvExperimentQueue.LEASED
+        last_update[experiment_id] = pd.Timestamp('now') - pd.Timedelta('1 hour')
+        client[experiment_id] = 'old-client'
+    for experiment_id in done:
+        status[experiment_id] = CsvExperimentQueue.DONE
+        last_update[experiment_id] = pd.Timestamp('now')
+        client[experiment_id] = 'old-client'
+    all_experiments['status'] = status
+    all_experiments['last_update'] = pd.to_datetime(last_update)
+    all_experiments['client'] = client
+
+    queue = CsvExperimentQueue.__new__(CsvExperimentQueue)
+    queue.__dict__.update({'_CsvExperimentQueue__all_experiments': all_experiments,
+                           '_CsvExperimentQueue__lease_duration': pd.to_timedelta('2 days'),
+                           '_CsvExperimentQueue__non_parameter_fields': {'status', 'last_update', 'client'}})
+    return queue
+
+
+def baseline_logger(results: pd.DataFrame) -> ExperimentLogger:
+    logger = ExperimentLogger.__new__(ExperimentLogger)
+    logger.__dict__['_ExperimentLogger__results_frame'] = results
+    return logger
+
+
+def test_migrate_baseline_queue(experiments_csv):
+    queue = pickle.loads(pickle.dumps(baseline_queue(experiments_csv, leased=[1], done=[0, 3])))
+    assert queue.status_counts == {'WAITING': 3, 'LEASED': 1, 'DONE': 2}
+    assert queue.experiment_parameters == ['a', 'b']
+    assert list(queue.all_experiments['client']) == ['old-client', 'old-client', '', 'old-client', '', '']
+
+    # The lease of experiment 1 is an hour old, so it expires after the waiting experiments were leased
+    leased_ids = [experiment_id for _, experiment_id in iter(lambda: queue.lease_new('c'), None)]
+    assert leased_ids == [2, 4, 5]
+    queue.complete(1, {'a': 1, 'b': 'y'}, 'old-client', 0.)
+    assert queue.status_counts == {'WAITING': 0, 'LEASED': 3, 'DONE': 3}
+
+    assert pickle.loads(pickle.dumps(queue)).status_counts == queue.status_counts
+
+
+def test_migrate_baseline_logger():
+    results = pd.DataFrame([{'a': 1, 'b': 'x', 'value': 0.5}, {'a': 2, 'b': 'y', 'value': float('nan')}],
+                           columns=['a', 'b', 'value'], dtype=object)
+    logger = pickle.loads(pickle.dumps(baseline_logger(results)))
+    assert logger.num_results == 2
+    assert logger.all_results['a'].tolist() == [1, 2]
+    assert logger.all_results['value'].dtype == float
+    logger.log_experiment({'a': 3, 'b': 'x'}, {'value': 1.5})
+    assert logger.group_summary(['b']).loc['x', ('value', 'mean')] == 1.
+
+    assert pickle.loads(pickle.dumps(logger)).all_results.equals(logger.all_results)
+
+
+def test_load_baseline_snapshot(tmp_path, experiments_csv):
+    results = pd.DataFrame([{'a': 1, 'b': 'x', 'minimized-value': 0.5}], dtype=object)
+    with open(str(tmp_path / 'test.pkl'), 'wb') as f:
+        pickle.dump((baseline_queue(experiments_csv, leased=[], done=[0]), baseline_logger(results)), f)
+
+    server = ResultsLoggerServer.load(str(tmp_path / 'test.pkl'), 'test')
+    client = server.wsgi_app.test_client()
+    leased = client.post(ResultLoggerConstants.ROUTE_API_LEASE, json={ResultLoggerConstants.FIELD_CLIENT: 'c'}).json
+    assert [e['experiment_id'] for e in leased[ResultLoggerConstants.FIELD_EXPERIMENTS]] == [1]
+    assert client.get(ResultLoggerConstants.ROUTE_API_RESULTS).json['total'] == 1
+
+    # The migrated state is saved in the current format
+    server = ResultsLoggerServer.load(str(tmp_path / 'test.pkl'), 'test')
+    assert server.wsgi_app.test_client().get(ResultLoggerConstants.ROUTE_API_PROGRESS).json['completed'] == 1 / 6